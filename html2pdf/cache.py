@@ -0,0 +1,75 @@
+"""
+Content addressed storage of rendered PDF documents.
+
+A document is keyed by the hash of its template name and rendered HTML, so
+printing unchanged data again reuses the stored PDF instead of running
+WeasyPrint. Files live in ``settings.HTML2PDF_CACHE_ROOT`` and are shared by
+all workers.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+from django.conf import settings
+
+
+def enabled():
+    return getattr(settings, 'HTML2PDF_CACHE', False)
+
+
+def cache_root():
+    root = getattr(settings, 'HTML2PDF_CACHE_ROOT',
+                   os.path.join(tempfile.gettempdir(), 'html2pdf-cache'))
+    os.makedirs(root, exist_ok=True)
+    return root
+
+
+def make_key(template_name, content):
+    digest = hashlib.sha256()
+    digest.update(str(template_name).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(content)
+    return digest.hexdigest()
+
+
+def path(key):
+    return os.path.join(cache_root(), '{}.pdf'.format(key))
+
+
+def lookup(key):
+    """
+    Return the path of the stored document for ``key``, or ``None``.
+    """
+    target = path(key)
+    if os.path.exists(target):
+        return target
+    return None
+
+
+def store(key, pdf):
+    """
+    Atomically store ``pdf`` under ``key`` and return its path.
+    """
+    target = path(key)
+    partial = '{}.{}.part'.format(target, os.getpid())
+    with open(partial, 'wb') as f:
+        f.write(pdf)
+    os.replace(partial, target)
+    return target
+
+
+def cleanup():
+    """
+    Remove documents older than ``settings.HTML2PDF_CACHE_MAX_AGE`` seconds.
+    """
+    max_age = getattr(settings, 'HTML2PDF_CACHE_MAX_AGE', 7 * 24 * 60 * 60)
+    root = cache_root()
+    expired = time.time() - max_age
+    for name in os.listdir(root):
+        target = os.path.join(root, name)
+        try:
+            if os.path.getmtime(target) < expired:
+                os.remove(target)
+        except OSError:
+            pass
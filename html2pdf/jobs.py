@@ -0,0 +1,181 @@
+"""
+Background rendering of PDF documents.
+
+Jobs run in a local process pool and exchange their state through files in
+``settings.HTML2PDF_JOB_ROOT``, so any WSGI worker can answer status and
+download requests for a job started by another one.
+
+``<id>.json`` holds the job metadata, ``<id>.pdf`` appears once rendering
+succeeded and ``<id>.error`` once it failed, also when the pool process
+died or the pool could not take the job. A job still pending after
+``settings.HTML2PDF_JOB_TIMEOUT`` seconds, e.g. because the process owning
+its pool was stopped, is reported failed.
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from django.conf import settings
+
+from html2pdf import cache, metrics
+
+
+_executor = None
+
+
+def job_root():
+    root = getattr(settings, 'HTML2PDF_JOB_ROOT',
+                   os.path.join(tempfile.gettempdir(), 'html2pdf-jobs'))
+    os.makedirs(root, exist_ok=True)
+    return root
+
+
+def _path(job_id, extension):
+    return os.path.join(job_root(), '{}.{}'.format(job_id, extension))
+
+
+def _executor_pool():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=getattr(settings, 'HTML2PDF_WORKERS', 2))
+    return _executor
+
+
+def _reset_pool():
+    """
+    Drop a broken pool, the next job starts a new one.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = None
+
+
+def fail(job_id, message):
+    """
+    Mark ``job_id`` failed unless its document was written.
+    """
+    if not os.path.exists(_path(job_id, 'pdf')):
+        with open(_path(job_id, 'error'), 'w') as f:
+            f.write(message)
+
+
+def _job_done(job_id, future):
+    """
+    Fail the job when its pool process did not get to record the outcome.
+    """
+    error = future.exception()
+    if error is None:
+        return
+    if isinstance(error, BrokenProcessPool):
+        _reset_pool()
+    fail(job_id, ''.join(traceback.format_exception(type(error), error, error.__traceback__)))
+
+
+def write_pdf(content, base_url):
+    from weasyprint import HTML
+
+    with metrics.RENDER_SECONDS.time():
+        pdf = HTML(string=content, base_url=base_url).write_pdf()
+    metrics.DOCUMENT_BYTES.observe(len(pdf))
+    return pdf
+
+
+def render(root, job_id, content, base_url, cache_path=None):
+    """
+    Render one job inside a pool process.
+
+    The document is also stored at ``cache_path`` when given.
+    """
+    target = os.path.join(root, '{}.pdf'.format(job_id))
+    try:
+        pdf = write_pdf(content, base_url)
+        if cache_path:
+            partial = '{}.{}.part'.format(cache_path, os.getpid())
+            with open(partial, 'wb') as f:
+                f.write(pdf)
+            os.replace(partial, cache_path)
+        with open(target + '.part', 'wb') as f:
+            f.write(pdf)
+        os.replace(target + '.part', target)
+    except Exception:
+        with open(os.path.join(root, '{}.error'.format(job_id)), 'w') as f:
+            f.write(traceback.format_exc())
+
+
+def cleanup():
+    """
+    Remove files of jobs older than ``settings.HTML2PDF_JOB_MAX_AGE`` seconds.
+    """
+    max_age = getattr(settings, 'HTML2PDF_JOB_MAX_AGE', 24 * 60 * 60)
+    root = job_root()
+    expired = time.time() - max_age
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.getmtime(path) < expired:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def submit(content, base_url, filename=None, cache_key=None):
+    """
+    Queue rendering of the HTML ``content`` and return the job id.
+
+    With a ``cache_key`` a document already in the render cache completes
+    the job immediately, otherwise the rendered document is cached.
+    """
+    cleanup()
+    job_id = uuid.uuid4().hex
+    with open(_path(job_id, 'json'), 'w') as f:
+        json.dump({'filename': filename, 'created': time.time()}, f)
+
+    cache_path = None
+    if cache_key:
+        cached = cache.lookup(cache_key)
+        if cached:
+            shutil.copyfile(cached, _path(job_id, 'pdf'))
+            return job_id
+        cache.cleanup()
+        cache_path = cache.path(cache_key)
+    try:
+        future = _executor_pool().submit(render, job_root(), job_id, content, base_url, cache_path)
+    except BrokenProcessPool:
+        _reset_pool()
+        fail(job_id, traceback.format_exc())
+        return job_id
+    future.add_done_callback(partial(_job_done, job_id))
+    return job_id
+
+
+def status(job_id):
+    """
+    Return ``None`` for unknown jobs, else one of pending, done or failed.
+    """
+    if not os.path.exists(_path(job_id, 'json')):
+        return None
+    if os.path.exists(_path(job_id, 'pdf')):
+        return 'done'
+    if os.path.exists(_path(job_id, 'error')):
+        return 'failed'
+    timeout = getattr(settings, 'HTML2PDF_JOB_TIMEOUT', 10 * 60)
+    if time.time() - metadata(job_id)['created'] > timeout:
+        return 'failed'
+    return 'pending'
+
+
+def metadata(job_id):
+    with open(_path(job_id, 'json')) as f:
+        return json.load(f)
+
+
+def pdf_path(job_id):
+    return _path(job_id, 'pdf')
@@ -0,0 +1,24 @@
+"""
+Prometheus metrics of the PDF conversion.
+
+Documents rendered in the background pool are counted by the pool
+processes, they only show up in ``/metrics`` with the client in
+multiprocess mode (``PROMETHEUS_MULTIPROC_DIR`` set for every process).
+"""
+from prometheus_client import Counter, Histogram
+
+
+RENDER_SECONDS = Histogram(
+    'html2pdf_render_seconds', "Time WeasyPrint took to convert a document",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float('inf'))
+)
+
+DOCUMENT_BYTES = Histogram(
+    'html2pdf_document_bytes', "Size of the converted documents",
+    buckets=(10 ** 4, 5 * 10 ** 4, 10 ** 5, 5 * 10 ** 5, 10 ** 6, 5 * 10 ** 6, 10 ** 7,
+             float('inf'))
+)
+
+CACHE_LOOKUPS = Counter(
+    'html2pdf_cache_lookups_total', "Render cache lookups by result", ['result']
+)
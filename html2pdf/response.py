@@ -1,26 +1,112 @@
-from weasyprint import HTML
+import os
 
+from django.template.loader import render_to_string
 from django.template.response import TemplateResponse
 from django.conf import settings
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from html2pdf import cache, jobs, metrics
 
 
 class HTML2PDFResponse(TemplateResponse):
+    """
+    Render ``template`` to HTML and convert it to PDF with WeasyPrint.
+
+    With ``asynchronous`` (default ``settings.HTML2PDF_ASYNC``) the conversion
+    runs in the background worker pool and the response is a page polling the
+    job status until the document can be downloaded.
+
+    With ``settings.HTML2PDF_CACHE`` documents are looked up in the render
+    cache by their HTML first, and carry ``ETag`` and ``Last-Modified`` so
+    browsers can revalidate them. The ``cache_exclude`` context entries, the
+    print time of the layouts by default, are left out of the HTML the key is
+    computed from, a document served from the cache shows the time it was
+    first printed.
+    """
+    cache_exclude = ('date',)
+
     def __init__(self, request, template, context=None, filename=None,
-                 content_type='application/pdf', status=None, charset=None, using=None):
+                 content_type='application/pdf', status=None, charset=None, using=None,
+                 asynchronous=None, cache_exclude=None):
+        if cache_exclude is not None:
+            self.cache_exclude = cache_exclude
+        if asynchronous is None:
+            asynchronous = getattr(settings, 'HTML2PDF_ASYNC', False)
+        self.asynchronous = asynchronous
+        self.filename = filename
+        if asynchronous:
+            content_type = None
         super().__init__(request, template, context, content_type, status, charset, using)
 
-        if filename:
-            self['Content-Disposition'] = 'attachment; filename="{0}"'.format(filename)
-        else:
-            self['Content-Disposition'] = 'attachment'
+        if not asynchronous:
+            if filename:
+                self['Content-Disposition'] = 'attachment; filename="{0}"'.format(filename)
+            else:
+                self['Content-Disposition'] = 'attachment'
 
-    @property
-    def rendered_content(self):
+    def get_base_url(self):
+        if hasattr(settings, 'WEASYPRINT_BASEURL'):
+            return settings.WEASYPRINT_BASEURL
+        return self._request.build_absolute_uri()
+
+    def render_html(self, exclude=()):
         template = self.resolve_template(self.template_name)
         context = self.resolve_context(self.context_data)
-        content = template.render(context, self._request).encode('utf-8')
-        if hasattr(settings, 'WEASYPRINT_BASEURL'):
-            base_url = settings.WEASYPRINT_BASEURL
+        if exclude and context:
+            context = dict(context, **dict.fromkeys(exclude))
+        return template.render(context, self._request).encode('utf-8')
+
+    def cache_key(self):
+        return cache.make_key(self.template_name, self.render_html(self.cache_exclude))
+
+    def render_cached(self, key):
+        """
+        Return the document for ``key`` from the render cache, rendering it on a miss.
+
+        Answers ``304 Not Modified`` with an empty body when the browser copy
+        is still current.
+        """
+        etag = quote_etag(key)
+        cached = cache.lookup(key)
+        last_modified = int(os.path.getmtime(cached)) if cached else None
+        self['ETag'] = etag
+        self['Cache-Control'] = 'private, no-cache'
+        if self.has_header('Expires'):
+            del self['Expires']
+
+        conditional = get_conditional_response(
+            self._request, etag=etag, last_modified=last_modified
+        )
+        if conditional is not None and conditional.status_code == 304:
+            self.status_code = 304
+            del self['Content-Disposition']
+            return b''
+
+        metrics.CACHE_LOOKUPS.labels('hit' if cached else 'miss').inc()
+        if cached:
+            with open(cached, 'rb') as f:
+                pdf = f.read()
         else:
-            base_url = self._request.build_absolute_uri()
-        return HTML(string=content, base_url=base_url).write_pdf()
+            pdf = jobs.write_pdf(self.render_html(), self.get_base_url())
+            cache.cleanup()
+            cached = cache.store(key, pdf)
+            last_modified = int(os.path.getmtime(cached))
+        self['Last-Modified'] = http_date(last_modified)
+        return pdf
+
+    @property
+    def rendered_content(self):
+        key = self.cache_key() if cache.enabled() else None
+        if self.asynchronous:
+            job_id = jobs.submit(self.render_html(), self.get_base_url(), self.filename,
+                                 cache_key=key)
+            return render_to_string('html2pdf/job.html', {
+                'job_id': job_id,
+                'filename': self.filename,
+                'status_url': reverse('html2pdf:job_status', args=[job_id]),
+            }, self._request)
+        if key:
+            return self.render_cached(key)
+        return jobs.write_pdf(self.render_html(), self.get_base_url())
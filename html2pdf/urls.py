@@ -0,0 +1,10 @@
+from django.urls import path
+
+from html2pdf import views
+
+app_name = 'html2pdf'
+
+urlpatterns = [
+    path('jobs/<str:job_id>/', views.job_status, name='job_status'),
+    path('jobs/<str:job_id>/download/', views.job_download, name='job_download'),
+]
@@ -0,0 +1,34 @@
+import re
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404, JsonResponse
+from django.urls import reverse
+
+from html2pdf import jobs
+
+
+def _job_or_404(job_id):
+    if not re.match(r'^[0-9a-f]{32}$', job_id):
+        raise Http404("Unknown job")
+    state = jobs.status(job_id)
+    if state is None:
+        raise Http404("Unknown job")
+    return state
+
+
+@staff_member_required
+def job_status(request, job_id):
+    state = _job_or_404(job_id)
+    data = {'id': job_id, 'status': state}
+    if state == 'done':
+        data['download_url'] = reverse('html2pdf:job_download', args=[job_id])
+    return JsonResponse(data)
+
+
+@staff_member_required
+def job_download(request, job_id):
+    if _job_or_404(job_id) != 'done':
+        raise Http404("Document is not ready")
+    filename = jobs.metadata(job_id).get('filename') or '{}.pdf'.format(job_id)
+    return FileResponse(open(jobs.pdf_path(job_id), 'rb'), as_attachment=True,
+                        filename=filename, content_type='application/pdf')
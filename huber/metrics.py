@@ -0,0 +1,129 @@
+"""
+Prometheus metrics of the requests, exposed on ``/metrics``.
+
+``MetricsMiddleware`` records the latency, SQL query count and SQL time of
+every request labelled with the name of the view, e.g.
+``admin:production_inventoryitems_changelist``. Streaming responses are
+measured until their last chunk was sent.
+
+The endpoint only answers to ``settings.METRICS_ALLOWED_IPS``, and there
+only to staff users or to scrapers sending ``settings.METRICS_TOKEN`` as a
+bearer token: behind a proxy on the same host every request comes from the
+loopback address. With several WSGI processes set ``PROMETHEUS_MULTIPROC_DIR``
+so it reports all of them.
+"""
+import os
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, \
+    generate_latest
+
+
+LATENCY = Histogram(
+    'django_request_seconds', "Time to answer a request, until the last byte for streams",
+    ['view', 'method'],
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float('inf'))
+)
+
+QUERIES = Histogram(
+    'django_request_queries', "SQL queries sent while answering a request", ['view'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float('inf'))
+)
+
+QUERY_SECONDS = Histogram(
+    'django_request_query_seconds', "Time spent in SQL queries while answering a request",
+    ['view'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.view_name
+
+
+class RequestRecorder(object):
+    """
+    Database execute wrapper counting the queries of one request.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - start
+
+    @contextmanager
+    def recording(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield
+
+    def stream(self, content, request):
+        try:
+            with self.recording():
+                yield from content
+        finally:
+            self.observe(request)
+
+    def observe(self, request):
+        view = view_name(request)
+        LATENCY.labels(view, request.method).observe(time.perf_counter() - self.started)
+        QUERIES.labels(view).observe(self.queries)
+        QUERY_SECONDS.labels(view).observe(self.query_seconds)
+
+
+class MetricsMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = RequestRecorder()
+        with recorder.recording():
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = recorder.stream(response.streaming_content, request)
+        else:
+            recorder.observe(request)
+        return response
+
+
+def registry():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ or 'prometheus_multiproc_dir' in os.environ:
+        from prometheus_client import multiprocess
+
+        collector_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collector_registry)
+        return collector_registry
+    return REGISTRY
+
+
+def authorized(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''),
+                                       'Bearer {}'.format(token)):
+        return True
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_active and user.is_staff)
+
+
+def metrics_view(request):
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ())
+    if request.META.get('REMOTE_ADDR') not in allowed or not authorized(request):
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)
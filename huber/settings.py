@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
+import tempfile
 from django.conf.locale.id import formats as id_formats
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'huber.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -154,3 +156,30 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 STATICFILES_DIR = os.path.join(BASE_DIR, 'static')
 
 ADMIN_TITLE = "System Management Produksi Tinta"
+
+# Cached reports, formula vectors and search indexes must be seen by every
+# process serving the site, use memcached or redis when it runs on several hosts
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('HUBER_CACHE_DIR',
+                                   os.path.join(tempfile.gettempdir(), 'huber_cache')),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+}
+
+# PDF reports, set HTML2PDF_ASYNC to render them in a background process pool
+HTML2PDF_ASYNC = False
+HTML2PDF_WORKERS = 2
+HTML2PDF_JOB_ROOT = os.path.join(BASE_DIR, 'pdf_jobs')
+# Seconds after which a job still rendering is reported failed
+HTML2PDF_JOB_TIMEOUT = 10 * 60
+# Reuse rendered PDF documents whose HTML did not change
+HTML2PDF_CACHE = True
+HTML2PDF_CACHE_ROOT = os.path.join(BASE_DIR, 'pdf_cache')
+
+# Addresses allowed to read the Prometheus metrics on /metrics, none by default
+# in production. Requests must also come from a staff user or send
+# "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_ALLOWED_IPS = os.environ.get('HUBER_METRICS_IPS', '127.0.0.1 ::1' if DEBUG else '').split()
+METRICS_TOKEN = os.environ.get('HUBER_METRICS_TOKEN', '')
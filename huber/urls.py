@@ -19,11 +19,17 @@ from django.conf import settings
 from django.http import HttpResponseRedirect
 
 from . import grappelli_urls
+from .metrics import metrics_view
+from production.views import AutocompleteLookup
 
 urlpatterns = [
     path('', lambda x: HttpResponseRedirect('admin')),
+    path('grappelli/lookup/autocomplete/', AutocompleteLookup.as_view(),
+         name='grp_autocomplete_lookup'),
     path('grappelli/', include('grappelli.urls')), # grappelli URLS
     path('admin/', admin.site.urls),
+    path('html2pdf/', include('html2pdf.urls')),
+    path('metrics', metrics_view, name='metrics'),
     # path('doc/', include(grappelli_urls))
 ]
 
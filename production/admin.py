@@ -1,25 +1,33 @@
-import numpy as np
+from collections import defaultdict
+from decimal import Decimal
+
 import pandas as pd
 
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin import helpers
 from django.urls import path
 from django.template.response import TemplateResponse
 
-from django.db.models import F, Q
+from django.db.models import Q
 from django.contrib import messages
 from django.utils import timezone
 
 from import_export.admin import ImportExportMixin, ExportMixin
+from import_export.signals import post_export
 from rangefilter.filter import DateRangeFilter
 
 from production.models.customer import Customer, CustomerCategory, Supplier
 from production.models.inventory import UnitMeasurement, InventoryItems, StockLevel, \
-    StockMovement, InventoryAdjustment
+    StockMovement, InventoryAdjustment, DailyItemRollup, ItemCost
 from production.models.manufacture import BillOfMaterial, BillOfMaterialDetails, \
-    Manufacture, ProductUsage
+    Manufacture, ProductUsage, DailyUsageRollup
 from production.resources import ManufactureExportResource, ProductUsageExportResource, \
-    StockMovementExportResource
-from production.forms import ProductUsageReportForm, ProductUsageInlineForm, StockMovementForm
+    StockMovementExportResource, StockLevelImportResource, StockMovementImportResource
+from production.forms import ProductUsageReportForm, ProductUsageInlineForm, \
+    ProductUsageInlineFormSet, StockMovementForm, MaterialPlanningForm, FormulaScaleForm, \
+    FormulaSubstituteForm, PreloadedInlineFormSet, PreloadedRawIdWidget
+from production import bookkeeping, exports, formulas, mrp, pagination, reports
 from html2pdf.response import HTML2PDFResponse
 
 # Register your models here.
@@ -57,6 +65,100 @@ class BasePrintAdmin(object):
         return cl.get_queryset(request)
 
 
+class StreamingExportMixin(object):
+    """
+    Stream CSV and XLSX exports instead of building the dataset in memory.
+
+    Other formats, and resources with computed fields, use the regular export.
+    """
+    def export_action(self, request, *args, **kwargs):
+        if request.method == 'POST' and self.has_export_permission(request):
+            formats = self.get_export_formats()
+            form = self.get_export_form()(formats, request.POST)
+            if form.is_valid():
+                file_format = formats[int(form.cleaned_data['file_format'])]()
+                resource = self.get_export_resource_class()(**self.get_export_resource_kwargs(request))
+                columns = exports.projection(resource)
+                if columns and file_format.get_title() in exports.STREAMING_FORMATS:
+                    queryset = self.get_export_queryset(request)
+                    response = exports.streaming_response(
+                        file_format.get_title(), queryset, columns,
+                        self.get_export_filename(request, queryset, file_format)
+                    )
+                    post_export.send(sender=None, model=self.model)
+                    return response
+        return super().export_action(request, *args, **kwargs)
+
+
+class KeysetPaginationMixin(object):
+    """
+    Page a large changelist by cursor on ``ordering`` with an estimated count.
+
+    "Show all" is capped, larger results are exported instead.
+    """
+    paginator = pagination.EstimatedCountPaginator
+    show_full_result_count = False
+    list_max_show_all = pagination.SHOW_ALL_LIMIT
+
+    def get_changelist(self, request, **kwargs):
+        return pagination.KeysetChangeList
+
+
+class PreloadedInlineMixin(object):
+    """
+    Inline whose rows are shown in a fixed number of queries, the relations
+    in ``__str__`` of a row are named by ``row_select_related``.
+    """
+    formset = PreloadedInlineFormSet
+    row_select_related = ()
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(*self.row_select_related)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.raw_id_fields and 'widget' not in kwargs:
+            kwargs['widget'] = PreloadedRawIdWidget(db_field.remote_field, self.admin_site,
+                                                    using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+class FormulaFilter(admin.RelatedFieldListFilter):
+    """
+    Formula choices read with their product, which ``__str__`` shows.
+    """
+    def field_choices(self, field, request, model_admin):
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        formulas = BillOfMaterial.objects.select_related('product').only('code', 'product__name')
+        return [(formula.pk, str(formula)) for formula in formulas.order_by(*ordering)]
+
+
+class StockAvailabilityFilter(admin.SimpleListFilter):
+    """
+    Filter items on the ``available`` annotation of ``with_availability()``.
+
+    The low stock threshold is read from ``settings.LOW_STOCK_THRESHOLD``.
+    """
+    title = "Stock"
+    parameter_name = 'stock'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('low', "Di bawah batas minimum"),
+            ('empty', "Habis"),
+            ('negative', "Minus"),
+        )
+
+    def queryset(self, request, queryset):
+        threshold = getattr(settings, 'LOW_STOCK_THRESHOLD', 10)
+        if self.value() == 'low':
+            return queryset.filter(available__lt=threshold)
+        if self.value() == 'empty':
+            return queryset.filter(available=0)
+        if self.value() == 'negative':
+            return queryset.filter(available__lt=0)
+        return queryset
+
+
 @admin.register(Customer)
 class CustomerAdmin(ImportExportMixin, admin.ModelAdmin):
     fieldsets = (
@@ -114,12 +216,20 @@ class InventoryItemAdmin(ImportExportMixin, BasePrintAdmin, admin.ModelAdmin):
         'fk': ['unit'],
     }
     search_fields = ('code', 'name')
-    list_filter = ('type', 'unit')
+    list_filter = ('type', 'unit', StockAvailabilityFilter)
     list_display_links = ('id', 'code',)
     list_display = ('id', 'code', 'name', 'type', 'initial', 'availability' ,'unit', 'price')
     list_per_page = 15
     change_list_template = 'admin/inventory/inventory_item_report_page.html'
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).light().with_availability()
+
+    def availability(self, obj):
+        return round(obj.available, 4)
+    availability.short_description = "Availability"
+    availability.admin_order_field = 'available'
+
     def get_urls(self):
         urls = super().get_urls()
         info = self.get_model_info()
@@ -150,6 +260,7 @@ class InventoryItemAdmin(ImportExportMixin, BasePrintAdmin, admin.ModelAdmin):
 class InventoryAdjustmentAdmin(admin.ModelAdmin):
     fields = (('item', 'quantity'), )
     list_display = ('item', 'quantity', 'last_edited', 'first_created')
+    list_select_related = ('item',)
     raw_id_fields = ['item',]
     autocomplete_lookup_fields = {
         'fk': ['item',]
@@ -157,7 +268,8 @@ class InventoryAdjustmentAdmin(admin.ModelAdmin):
 
 
 @admin.register(StockLevel)
-class StockLevelAdmin(ImportExportMixin, BasePrintAdmin, admin.ModelAdmin):
+class StockLevelAdmin(KeysetPaginationMixin, StreamingExportMixin, ImportExportMixin, BasePrintAdmin,
+                      admin.ModelAdmin):
     fieldsets = (
         ('Stock Movement Details', {
             'fields': (('item', 'supplier'),('delivery_note', 'datetime'))
@@ -174,7 +286,9 @@ class StockLevelAdmin(ImportExportMixin, BasePrintAdmin, admin.ModelAdmin):
     list_filter = ('item__type', 'status', 'datetime', ('datetime', DateRangeFilter))
     list_display = ('item', 'item_type', 'delivery_note', 'datetime',
                     'supplier', 'quantity', 'unit', 'status')
+    list_select_related = ('item', 'supplier', 'unit')
     list_per_page = 25
+    ordering = ('-datetime', '-pk')
     change_list_template = 'admin/stocklevel/stocklevel_report_page.html'
 
     def save_model(self, request, obj, form, change):
@@ -182,6 +296,9 @@ class StockLevelAdmin(ImportExportMixin, BasePrintAdmin, admin.ModelAdmin):
             obj.quantity *= -1
         super().save_model(request, obj, form, change)
 
+    def get_import_resource_class(self):
+        return StockLevelImportResource
+
     def get_urls(self):
         urls = super().get_urls()
         info = self.get_model_info()
@@ -196,25 +313,18 @@ class StockLevelAdmin(ImportExportMixin, BasePrintAdmin, admin.ModelAdmin):
         queryset = self.get_print_queryset(request)
         page_title = "Daftar Pembelian Baranag"
         date = timezone.now()
-        data = dict(date=[], product_code=[], product_name=[], status=[], quantity=[])
-        for i in queryset:
-            data['date'].append(i.datetime.date())
-            data['product_code'].append(i.item.code)
-            data['product_name'].append(i.item.name)
-            data['status'].append(i.status)
-            data['quantity'].append(i.quantity)
-
-        data_frame = pd.DataFrame(data=data)
-        data_frame['quantity'] = data_frame['quantity'].astype(float)
-        pivot = pd.pivot_table(
-            data_frame.round(3),
-            index=['date', 'product_code', 'product_name', 'status'],
-            values='quantity',
-            fill_value=0
-        )
+        data_frame = reports.data_frame(queryset, {
+            'date': 'datetime__date',
+            'product_code': 'item__code',
+            'product_name': 'item__name',
+            'status': 'status',
+            'quantity': 'quantity',
+        })
         template = 'admin/stocklevel/stocklevel_print_pdf_layout.html'
         context = {
-            'delivery_list': pivot.to_html(classes=['minimalistBlack']),
+            'delivery_list': reports.pivot_html(
+                data_frame, ['date', 'product_code', 'product_name', 'status'], aggfunc='mean'
+            ),
             'page_title': page_title,
             'date': date
         }
@@ -226,7 +336,8 @@ class StockLevelAdmin(ImportExportMixin, BasePrintAdmin, admin.ModelAdmin):
 
 
 @admin.register(StockMovement)
-class StockMovementAdmin(ImportExportMixin, BasePrintAdmin, admin.ModelAdmin):
+class StockMovementAdmin(KeysetPaginationMixin, StreamingExportMixin, ImportExportMixin, BasePrintAdmin,
+                         admin.ModelAdmin):
     fieldsets = (
         ('Stock Movement Details', {
             'fields': (('customer', 'jo_number'), ('delivery_order', 'datetime'), 'status')
@@ -245,7 +356,9 @@ class StockMovementAdmin(ImportExportMixin, BasePrintAdmin, admin.ModelAdmin):
     search_fields = ('item__name', 'customer__name', 'delivery_order')
     list_filter = ('status', 'datetime', ('datetime', DateRangeFilter))
     list_display = ('item', 'customer', 'jo_number', 'quantity', 'unit', 'datetime', 'status')
+    list_select_related = ('item', 'customer', 'unit')
     list_per_page = 25
+    ordering = ('-datetime', '-pk')
     form = StockMovementForm
     resource_class = StockMovementExportResource
     change_list_template = 'admin/stockmovement/stockmovement_report_page.html'
@@ -256,6 +369,9 @@ class StockMovementAdmin(ImportExportMixin, BasePrintAdmin, admin.ModelAdmin):
         else:
             return self.readonly_fields
 
+    def get_import_resource_class(self):
+        return StockMovementImportResource
+
     def get_urls(self):
         urls = super().get_urls()
         info = self.get_model_info()
@@ -270,26 +386,20 @@ class StockMovementAdmin(ImportExportMixin, BasePrintAdmin, admin.ModelAdmin):
         queryset = self.get_print_queryset(request)
         page_title = "Daftar Pengiriman Barang"
         date = timezone.now()
-        data = dict(date=[], product_code=[], product_name=[], jo_number=[], status=[], quantity=[])
-        for i in queryset:
-            data['date'].append(i.datetime.date())
-            data['product_code'].append(i.item.code)
-            data['product_name'].append(i.item.name)
-            data['jo_number'].append(i.jo_number)
-            data['status'].append(i.status)
-            data['quantity'].append(i.quantity)
-
-        data_frame = pd.DataFrame(data=data)
-        data_frame['quantity'] = data_frame['quantity'].astype(float)
-        pivot = pd.pivot_table(
-            data_frame.round(3),
-            index=['date', 'product_code', 'product_name', 'jo_number', 'status'],
-            values='quantity',
-            fill_value=0
-        )
+        data_frame = reports.data_frame(queryset, {
+            'date': 'datetime__date',
+            'product_code': 'item__code',
+            'product_name': 'item__name',
+            'jo_number': 'jo_number',
+            'status': 'status',
+            'quantity': 'quantity',
+        })
         template = 'admin/stockmovement/stockmovement_pdf_layout.html'
         context = {
-            'delivery_list': pivot.to_html(classes=['minimalistBlack']),
+            'delivery_list': reports.pivot_html(
+                data_frame, ['date', 'product_code', 'product_name', 'jo_number', 'status'],
+                aggfunc='mean'
+            ),
             'page_title': page_title,
             'date': date
         }
@@ -300,8 +410,9 @@ class StockMovementAdmin(ImportExportMixin, BasePrintAdmin, admin.ModelAdmin):
         )
 
 
-class BillOfMaterialDetailsInline(admin.TabularInline):
+class BillOfMaterialDetailsInline(PreloadedInlineMixin, admin.TabularInline):
     model = BillOfMaterialDetails
+    row_select_related = ('material',)
     extra = 0
     fields = ('material', 'quantity', 'unit')
     raw_id_fields = ('material', 'unit')
@@ -311,17 +422,49 @@ class BillOfMaterialDetailsInline(admin.TabularInline):
 
 
 def copy_bill_of_material(modeladmin, request, queryset):
-    for query in queryset:
-        details = query.billofmaterialdetails_set.all()
-        query.pk = None
-        query.save()
-        for detail in details:
-            detail.pk = None
-            detail.bill_of_material = query
-            detail.save()
+    copies = formulas.copy(queryset.values_list('pk', flat=True))
+    modeladmin.message_user(request, "{} formula disalin".format(len(copies)))
 copy_bill_of_material.short_description = "Copy Formula"
 
 
+def formula_action(form_class, title):
+    """
+    Turn ``function(modeladmin, request, queryset, form)`` into an admin action
+    which first asks for the fields of ``form_class`` on an intermediate page.
+    """
+    def decorator(function):
+        def action(modeladmin, request, queryset):
+            form = form_class(request.POST if 'apply' in request.POST else None)
+            if form.is_valid():
+                function(modeladmin, request, queryset, form)
+                return None
+            context = dict(
+                modeladmin.admin_site.each_context(request), opts=modeladmin.model._meta,
+                title=title, form=form, queryset=queryset, action=function.__name__,
+                action_checkbox_name=helpers.ACTION_CHECKBOX_NAME,
+            )
+            return TemplateResponse(request, 'admin/billofmaterial/bulk_action.html', context)
+        action.__name__ = function.__name__
+        action.short_description = title
+        return action
+    return decorator
+
+
+@formula_action(FormulaScaleForm, "Scale Formula")
+def scale_bill_of_material(modeladmin, request, queryset, form):
+    lines = formulas.scale(queryset.values_list('pk', flat=True), form.cleaned_data['factor'])
+    modeladmin.message_user(request, "{} rincian formula diubah".format(lines))
+
+
+@formula_action(FormulaSubstituteForm, "Substitute Material")
+def substitute_material(modeladmin, request, queryset, form):
+    changed = formulas.substitute(
+        form.cleaned_data['material'].pk, form.cleaned_data['replacement'].pk,
+        form.cleaned_data['ratio'], bom_ids=queryset.values_list('pk', flat=True)
+    )
+    modeladmin.message_user(request, "{} formula diubah".format(len(changed)))
+
+
 @admin.register(BillOfMaterial)
 class BillOfMaterialAdmin(ImportExportMixin, admin.ModelAdmin):
     fieldsets = (
@@ -345,10 +488,11 @@ class BillOfMaterialAdmin(ImportExportMixin, admin.ModelAdmin):
     inlines = [BillOfMaterialDetailsInline]
     readonly_fields = ['output_standard']
     list_display = ('code', 'product', 'customer', 'customer_category', 'color_name')
+    list_select_related = ('product', 'customer', 'customer_category')
     list_filter = ('color_name', 'customer', 'customer_category')
     search_fields = ('code', 'product__name', 'customer__name', 'color_name')
     list_per_page = 25
-    actions = [copy_bill_of_material]
+    actions = [copy_bill_of_material, scale_bill_of_material, substitute_material]
 
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
@@ -360,20 +504,28 @@ class BillOfMaterialAdmin(ImportExportMixin, admin.ModelAdmin):
 @admin.register(BillOfMaterialDetails)
 class BillOfMaterialDetailsAdmin(ImportExportMixin, admin.ModelAdmin):
     list_display = ('bill_of_material', 'material', 'quantity', 'unit')
+    list_select_related = ('bill_of_material__product', 'material', 'unit')
+    raw_id_fields = ('bill_of_material', 'material', 'unit')
+    autocomplete_lookup_fields = {
+        'fk': ['bill_of_material', 'material', 'unit']
+    }
 
 
-class ProductUsageInline(admin.TabularInline):
+class ProductUsageInline(PreloadedInlineMixin, admin.TabularInline):
     model = ProductUsage
+    row_select_related = ('item',)
     extra = 0
     raw_id_fields = ['item', 'unit']
     autocomplete_lookup_fields = {
         'fk': ['item', 'unit']
     }
     form = ProductUsageInlineForm
+    formset = ProductUsageInlineFormSet
 
 
 @admin.register(Manufacture)
-class ManufactureAdmin(ImportExportMixin, admin.ModelAdmin):
+class ManufactureAdmin(KeysetPaginationMixin, StreamingExportMixin, ImportExportMixin,
+                       admin.ModelAdmin):
     fieldsets = (
         ('Production Details', {
             'fields': (('customer', 'datetime'), ('bill_of_material', 'price'), ('unit', 'quantity')),
@@ -381,6 +533,7 @@ class ManufactureAdmin(ImportExportMixin, admin.ModelAdmin):
     )
     list_display = ('datetime', 'bill_of_material', '_product_name', 'price',
                     'customer', 'quantity', 'unit', 'status')
+    list_select_related = ('bill_of_material__product', 'customer', 'unit')
     search_fields = ('bill_of_material__code', 'bill_of_material__product__name')
     readonly_fields = ('price', 'bom_output_standard')
     list_editable = ('status',)
@@ -388,30 +541,45 @@ class ManufactureAdmin(ImportExportMixin, admin.ModelAdmin):
     inlines = [ProductUsageInline]
     raw_id_fields = ['bill_of_material', 'customer', 'unit']
     list_per_page = 25
+    ordering = ('-datetime', '-pk')
     autocomplete_lookup_fields = {
         'fk': ['bill_of_material', 'customer', 'unit']
     }
     resource_class = ManufactureExportResource
     change_form_template = 'admin/manufacture/change_form.html'
+    change_list_template = 'admin/manufacture/manufacture_report_page.html'
 
     def save_model(self, request, obj, form, change):
         if obj.id == None:
             obj.save()
             t_qty = obj.quantity
-            bom = BillOfMaterialDetails.objects.filter(bill_of_material=obj.bill_of_material)
-            bom_output_weight = obj.bill_of_material.output_weight()
+            bom = list(BillOfMaterialDetails.objects.filter(
+                bill_of_material=obj.bill_of_material
+            ).select_related('material'))
+            bom_output_weight = round(sum(i.quantity for i in bom), 4)
             mtr_used = []
 
+            requirements = defaultdict(Decimal)
+            for i in bom:
+                requirements[i.material_id] += (i.quantity / bom_output_weight) * t_qty
+            # reserved with the usage rows when the inline formset was cleaned
+            shortages = InventoryItems.objects.shortages(
+                requirements, lock=True, available=getattr(obj, '_reserved_stock', None)
+            )
+            costs = ItemCost.objects.costs_for(requirements)
+
             msgs = []
             for i in bom:
                 p = ProductUsage(
                     item=i.material, manufacture=obj,
-                    quantity=((i.quantity / bom_output_weight) * t_qty), unit=i.unit
+                    quantity=((i.quantity / bom_output_weight) * t_qty), unit_id=i.unit_id
                 )
-                if p.quantity > p.item.availability():
-                    msgs.append("Stock \"{} - {}\" tidak mencukupi".format(p.item.code, p.item.name))
+                if p.item_id in shortages:
+                    msg = "Stock \"{} - {}\" tidak mencukupi".format(p.item.code, p.item.name)
+                    if msg not in msgs:
+                        msgs.append(msg)
                 else:
-                    p.price = p.quantity * i.material.price
+                    p.price = p.quantity * costs.get(i.material_id, i.material.price)
                     mtr_used.append(p)
 
             if msgs:
@@ -425,6 +593,7 @@ class ManufactureAdmin(ImportExportMixin, admin.ModelAdmin):
                 messages.add_message(request, messages.INFO, info_msg)
 
             ProductUsage.objects.bulk_create(mtr_used)
+            bookkeeping.record_created(ProductUsage, mtr_used)
 
         super().save_model(request, obj, form, change)
 
@@ -439,16 +608,22 @@ class ManufactureAdmin(ImportExportMixin, admin.ModelAdmin):
         manufacture_urls = [
             path('<int:object_id>/print/',
                     self.admin_site.admin_view(self.print_bill_of_material),
-                    name='{}_{}_print'.format(info[0], info[1]))
+                    name='{}_{}_print'.format(info[0], info[1])),
+            path('planning/',
+                    self.admin_site.admin_view(self.print_material_planning),
+                    name='{}_{}_planning'.format(info[0], info[1])),
         ]
 
         return manufacture_urls + urls
 
     def print_bill_of_material(self, request, object_id):
-        manufacture = Manufacture.objects.get(pk=object_id)
+        manufacture = Manufacture.objects.select_related('bill_of_material__product', 'unit').get(
+            pk=object_id
+        )
         filters = (Q(item__type='TTD') | Q(item__type='BT'))
-        product_usage = ProductUsage.objects.filter(manufacture=manufacture).exclude(item__type='CON')
-        consumable = ProductUsage.objects.filter(manufacture=manufacture).exclude(filters)
+        usages = ProductUsage.objects.filter(manufacture=manufacture).select_related('item', 'unit')
+        product_usage = usages.exclude(item__type='CON')
+        consumable = usages.exclude(filters)
         context = {
             'manufacture': manufacture,
             'product_usage': product_usage,
@@ -460,14 +635,50 @@ class ManufactureAdmin(ImportExportMixin, admin.ModelAdmin):
             context=context, filename='BoM-{}.pdf'.format(manufacture.datetime.date())
         )
 
+    def print_material_planning(self, request):
+        form = MaterialPlanningForm(request.POST or None)
+
+        if form.is_valid():
+            start_date = form.cleaned_data['start_date']
+            end_date = form.cleaned_data['end_date']
+            lines = mrp.run(start_date, end_date, nested=form.cleaned_data['nested'])
+            data_frame = pd.DataFrame(
+                [line[1:] for line in lines], columns=mrp.PlanningLine._fields[1:]
+            )
+            quantities = ['required', 'available', 'short']
+            data_frame[quantities] = data_frame[quantities].astype(float).round(3)
+            date = timezone.now()
+            context = {
+                'page_title': "Kebutuhan Material Produksi - Periode {} - {}".format(
+                    start_date or '', end_date or ''
+                ),
+                'date': date,
+                'report': data_frame.to_html(classes=['minimalistBlack'], index=False),
+            }
+            return HTML2PDFResponse(
+                request, 'admin/manufacture/material_planning_layout.html', context,
+                filename="Material Planning - {}.pdf".format(date.date())
+            )
+
+        opts = self.model._meta
+        context = dict(self.admin_site.each_context(request), opts=opts, form=form)
+        return TemplateResponse(request, 'admin/manufacture/material_planning.html', context=context)
+
 
 @admin.register(ProductUsage)
-class ProductUsageAdmin(ExportMixin, admin.ModelAdmin):
+class ProductUsageAdmin(KeysetPaginationMixin, StreamingExportMixin, ExportMixin,
+                        admin.ModelAdmin):
     list_display = ('get_datetime', 'item', 'manufacture', 'quantity', 'unit')
     list_display_links = ('item',)
+    list_select_related = ('item', 'manufacture__bill_of_material', 'manufacture__customer', 'unit')
+    raw_id_fields = ('item', 'manufacture', 'unit')
+    autocomplete_lookup_fields = {
+        'fk': ['item', 'unit'],
+    }
     search_fields = ('item__code', 'item__name')
-    list_filter = ('manufacture__datetime', 'manufacture__bill_of_material',
+    list_filter = ('manufacture__datetime', ('manufacture__bill_of_material', FormulaFilter),
                    ('manufacture__datetime', DateRangeFilter))
+    ordering = ('-manufacture__datetime', '-pk')
     change_list_template = 'admin/productusage/productusage_report_page.html'
     resource_class = ProductUsageExportResource
 
@@ -518,79 +729,66 @@ class ProductUsageAdmin(ExportMixin, admin.ModelAdmin):
         cl = ChageList(**changelist_kwargs)
         return cl.get_queryset(request)
 
-    def _get_dataframe(self, queryset):
-        data = dict(date=[], item_code=[], item_name=[], unit=[], product=[],
-                    product_code=[], quantity=[])
-        for i in queryset:
-            data['date'].append(i['datetime'].date())
-            data['item_code'].append(i['item_code'])
-            data['item_name'].append(i['item_name'])
-            data['unit'].append(i['item_unit_name'])
-            data['product_code'].append(i['product_code'])
-            data['product'].append(i['product_name'])
-            data['quantity'].append(i['usage'])
-
-        data_frame = pd.DataFrame(data=data)
-        return data_frame
-
-    def _pivoting_by_materialused(self, queryset):
-        data_frame = self._get_dataframe(queryset)
-        data_frame['quantity'] = data_frame['quantity'].astype(float)
-        pivot = pd.pivot_table(
-            data_frame.round(3),
-            index=['date', 'item_code', 'item_name', 'unit', 'product_code', 'product'],
-            values='quantity',
-            aggfunc=np.sum,
-            fill_value=0
-        )
-        return pivot.to_html(classes=['minimalistBlack'])
-
-    def _pivoting_materialused_sum(self, queryset):
-        data_frame = self._get_dataframe(queryset)
-        data_frame['quantity'] = data_frame['quantity'].astype(float)
-        pivot = pd.pivot_table(
-            data_frame.round(3),
-            index=['date', 'item_code', 'item_name'],
-            values='quantity',
-            aggfunc=np.sum,
-            fill_value=0
-        )
-        return pivot.to_html(classes=['minimalistBlack'])
-
-    def _pivoting_product_output(self, queryset):
-        data_frame = self._get_dataframe(queryset)
-        data_frame['quantity'] = data_frame['quantity'].astype(float)
-        pivot = pd.pivot_table(
-            data_frame.round(3),
-            index=['date', 'product_code', 'product', 'item_code', 'item_name', 'unit'],
-            values='quantity',
-            aggfunc=np.sum,
-            fill_value=0
-        )
-        return pivot.to_html(classes=['minimalistBlack'])
-
-    def _pivoting_product_output_summary(self, queryset):
-        data = dict(date=[], product_code=[], product_name=[], unit=[], quantity=[], price=[])
-
-        for i in queryset:
-            data['date'].append(i['date_time'].date())
-            data['product_code'].append(i['product_code'])
-            data['product_name'].append(i['product_name'])
-            data['unit'].append(i['unit_name'])
-            data['quantity'].append(i['qty'])
-            data['price'].append(i['total'])
-
-        data_frame = pd.DataFrame(data=data)
-        data_frame['quantity'] = data_frame['quantity'].astype(float)
-        data_frame['price'] = data_frame['price'].astype(float)
-        pivot = pd.pivot_table(
-            data_frame.round(3),
-            index=['date', 'product_code', 'product_name', 'unit'],
-            values='quantity',
-            aggfunc=np.sum,
-            fill_value=0
+    def report_context(self, start_date, end_date, report_type):
+        """
+        Return the page title and pivots of a usage report.
+        """
+        context = {}
+
+        material = reports.data_frame(
+            DailyUsageRollup.objects.filter(
+                date__range=[start_date, end_date]
+            ).exclude(quantity=0).order_by('date', 'item'), {
+                'date': 'date',
+                'item_code': 'item__code',
+                'item_name': 'item__name',
+                'unit': 'item__unit__name',
+                'product_code': 'product__code',
+                'product': 'product__name',
+                'quantity': 'quantity',
+            }
         )
-        return pivot.to_html(classes=['minimalistBlack'])
+
+        if report_type == 'material':
+            data_mat = reports.pivot_html(
+                material,
+                ['date', 'item_code', 'item_name', 'unit', 'product_code', 'product']
+            )
+            data_sum = reports.pivot_html(material, ['date', 'item_code', 'item_name'])
+            context['page_title'] = "Summary Penggunaan Material - Periode {} - {}".format(
+                start_date, end_date
+            )
+            context['report'] = data_mat
+            context['summary'] = data_sum
+
+        if report_type == 'product':
+            manufacture = reports.data_frame(
+                DailyItemRollup.objects.filter(
+                    date__range=[start_date, end_date]
+                ).exclude(output=0).order_by('date', 'item__name'), {
+                    'date': 'date',
+                    'product_code': 'item__code',
+                    'product_name': 'item__name',
+                    'unit': 'item__unit__name',
+                    'quantity': 'output',
+                    'price': 'output_value',
+                }, numeric=('quantity', 'price')
+            )
+
+            data_mat = reports.pivot_html(
+                material,
+                ['date', 'product_code', 'product', 'item_code', 'item_name', 'unit']
+            )
+            data_sum = reports.pivot_html(
+                manufacture, ['date', 'product_code', 'product_name', 'unit']
+            )
+            context['page_title'] = "Summary Penggunaan Material per Output Produksi - Periode {} - {}".format(
+                start_date, end_date
+            )
+            context['report'] = data_mat
+            context['summary'] = data_sum
+
+        return context
 
     def print(self, request):
         form = ProductUsageReportForm(request.POST or None)
@@ -599,58 +797,11 @@ class ProductUsageAdmin(ExportMixin, admin.ModelAdmin):
             start_date = form.cleaned_data['start_date']
             end_date = form.cleaned_data['end_date']
             report_type = form.cleaned_data['report_type']
-            context = {}
-            template = 'admin/productusage/productusage_report_layout.html'
-
-            material = ProductUsage.objects.filter(
-                manufacture__datetime__date__range=[start_date, end_date]
-            ).select_related(
-                'manufacture', 'item', 'manufacture__bill_of_material__product'
-            ).values(
-                datetime=F('manufacture__datetime'),
-                item_pk=F('item__pk'),
-                item_code=F('item__code'),
-                item_name=F('item__name'),
-                item_unit_name=F('item__unit__name'),
-                product_code=F('manufacture__bill_of_material__product__code'),
-                product_name=F('manufacture__bill_of_material__product__name'),
-                usage=F('quantity'),
-                unit_name=F('unit__name')
-            ).order_by(
-                'manufacture__datetime__date', 'item'
+            context = reports.cached(
+                'productusage-{}'.format(report_type), start_date, end_date,
+                lambda: self.report_context(start_date, end_date, report_type)
             )
-
-            if report_type == 'material':
-                data_mat = self._pivoting_by_materialused(material)
-                data_sum = self._pivoting_materialused_sum(material)
-                context['page_title'] = "Summary Penggunaan Material - Periode {} - {}".format(
-                    start_date, end_date
-                )
-                context['report'] = data_mat
-                context['summary'] = data_sum
-
-            if report_type == 'product':
-                manufacture = Manufacture.objects.filter(
-                    datetime__date__range=[start_date, end_date]
-                ).values(
-                    date_time=F('datetime'),
-                    bom=F('bill_of_material'),
-                    product_code=F('bill_of_material__product__code'),
-                    product_name=F('bill_of_material__product__name'),
-                    unit_name=F('unit__name'),
-                    qty=F('quantity'),
-                    total=F('price'),
-                ).order_by(
-                    'datetime__date', 'bill_of_material__product__name'
-                )
-
-                data_mat = self._pivoting_product_output(material)
-                data_sum = self._pivoting_product_output_summary(manufacture)
-                context['page_title'] = "Summary Penggunaan Material per Output Produksi - Periode {} - {}".format(
-                    start_date, end_date
-                )
-                context['report'] = data_mat
-                context['summary'] = data_sum
+            template = 'admin/productusage/productusage_report_layout.html'
 
             return HTML2PDFResponse(
                 request, template, context,
@@ -6,5 +6,5 @@ class ProductionConfig(AppConfig):
     verbose_name = 'Huber System'
 
     def ready(self):
-        pass
-        # import production.signals TODO evalute
+        import production.checks
+        import production.signals
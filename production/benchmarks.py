@@ -0,0 +1,293 @@
+"""
+Benchmarks of the hot paths, run against whatever data is in the database.
+
+Every case prepares its input untimed and returns the callable which is
+timed, each run also counts the SQL queries it sends. Responses are fully
+rendered, PDF reports are converted on every run with the render cache off.
+Manufactures created by the benchmark are rolled back.
+
+Results are plain dictionaries which ``compare()`` can check against an
+earlier run, e.g. one loaded back from the JSON written by ``benchmark``.
+"""
+import datetime
+import platform
+import random
+import statistics
+import time
+from collections import OrderedDict
+
+import django
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.contrib.messages.storage import default_storage
+from django.db import connection, transaction
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from production import reports
+from production.models.customer import Customer
+from production.models.inventory import UnitMeasurement, InventoryItems, StockLevel, StockMovement
+from production.models.manufacture import BillOfMaterial, BillOfMaterialDetails, Manufacture, \
+    ProductUsage
+
+
+CASES = OrderedDict()
+
+COUNTED_MODELS = [InventoryItems, BillOfMaterial, BillOfMaterialDetails, StockLevel,
+                  StockMovement, Manufacture, ProductUsage]
+
+
+def case(name):
+    """
+    Register the decorated ``function(benchmark)`` as case ``name``.
+    """
+    def register(function):
+        CASES[name] = function
+        return function
+    return register
+
+
+def consume(response):
+    """
+    Render ``response`` completely and return its size in bytes.
+    """
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    if hasattr(response, 'render'):
+        response.render()
+    return len(response.content)
+
+
+class Benchmark(object):
+    """
+    Run registered cases ``repeat`` times each.
+
+    Reports cover the last ``days`` days, ``sample`` items are looked up one
+    by one for the availability case and a hundred times as many at once.
+    """
+    def __init__(self, repeat=5, days=30, sample=100, seed=0, log=None):
+        self.repeat = repeat
+        self.days = days
+        self.sample = sample
+        self.random = random.Random(seed)
+        self.log = log or (lambda message: None)
+        self.end_date = timezone.localdate()
+        self.start_date = self.end_date - datetime.timedelta(days=days - 1)
+
+    def request(self, method='get', data=None):
+        request = getattr(RequestFactory(), method)('/', data or {})
+        request.user = User(is_superuser=True, is_staff=True, is_active=True)
+        request.session = {}
+        request._messages = default_storage(request)
+        return request
+
+    def admin(self, model):
+        return site._registry[model]
+
+    def moment(self, date):
+        return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
+    def date_filter(self, field='datetime'):
+        return {
+            field + '__gte': self.moment(self.start_date).isoformat(),
+            field + '__lt': self.moment(self.end_date + datetime.timedelta(days=1)).isoformat(),
+        }
+
+    def export(self, model, file_format):
+        model_admin = self.admin(model)
+        formats = [f().get_title() for f in model_admin.get_export_formats()]
+        request = self.request('post', {'file_format': formats.index(file_format)})
+        return lambda: consume(model_admin.export_action(request))
+
+    def measure(self, run):
+        timings, queries = [], []
+        for i in range(self.repeat):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - start)
+            queries.append(len(captured))
+        return OrderedDict([
+            ('runs', self.repeat),
+            ('min', min(timings)),
+            ('median', statistics.median(timings)),
+            ('max', max(timings)),
+            ('queries', max(queries)),
+        ])
+
+    def row_counts(self):
+        return {model._meta.model_name: model.objects.count() for model in COUNTED_MODELS}
+
+    def run(self, names=None):
+        """
+        Run the cases ``names``, all by default, and return the results.
+        """
+        results = OrderedDict([
+            ('created', timezone.now().isoformat()),
+            ('database', connection.vendor),
+            ('python', platform.python_version()),
+            ('django', django.get_version()),
+            ('repeat', self.repeat),
+            ('days', self.days),
+            ('rows', self.row_counts()),
+            ('cases', OrderedDict()),
+        ])
+        with override_settings(HTML2PDF_CACHE=False, HTML2PDF_ASYNC=False):
+            for name in names or CASES:
+                self.log(name)
+                results['cases'][name] = self.measure(CASES[name](self))
+        return results
+
+
+def compare(baseline, results, tolerance=0.2):
+    """
+    Return ``[(case, baseline median, median, ratio, regressed)]`` of the cases in both.
+
+    A case regressed when its median grew by more than ``tolerance``.
+    """
+    rows = []
+    for name, current in results['cases'].items():
+        previous = baseline.get('cases', {}).get(name)
+        if not previous:
+            continue
+        ratio = current['median'] / previous['median'] if previous['median'] else 1
+        rows.append((name, previous['median'], current['median'], ratio, ratio > 1 + tolerance))
+    return rows
+
+
+@case('availability')
+def availability(benchmark):
+    ids = list(InventoryItems.objects.values_list('pk', flat=True))
+    items = list(InventoryItems.objects.filter(
+        pk__in=benchmark.random.sample(ids, min(len(ids), benchmark.sample))
+    ))
+
+    def run():
+        for item in items:
+            item.availability()
+    return run
+
+
+@case('availability_for')
+def availability_for(benchmark):
+    ids = list(InventoryItems.objects.values_list('pk', flat=True))
+    sample = benchmark.random.sample(ids, min(len(ids), benchmark.sample * 100))
+    return lambda: InventoryItems.objects.availability_for(sample)
+
+
+@case('inventory_changelist')
+def inventory_changelist(benchmark):
+    model_admin = benchmark.admin(InventoryItems)
+    request = benchmark.request()
+    return lambda: consume(model_admin.changelist_view(request))
+
+
+@case('inventory_changelist_low_stock')
+def inventory_changelist_low_stock(benchmark):
+    model_admin = benchmark.admin(InventoryItems)
+    request = benchmark.request(data={'stock': 'low', 'o': '6'})
+    return lambda: consume(model_admin.changelist_view(request))
+
+
+@case('manufacture_create')
+def manufacture_create(benchmark):
+    model_admin = benchmark.admin(Manufacture)
+    formulas = list(BillOfMaterial.objects.filter(
+        billofmaterialdetails__isnull=False
+    ).values_list('pk', flat=True).distinct()[:1000])
+    customer = Customer.objects.values_list('pk', flat=True).first()
+    unit = UnitMeasurement.objects.values_list('pk', flat=True).first()
+
+    def run():
+        with transaction.atomic():
+            obj = Manufacture(
+                datetime=timezone.now(), bill_of_material_id=benchmark.random.choice(formulas),
+                customer_id=customer, unit_id=unit, quantity=100, status='pending'
+            )
+            model_admin.save_model(benchmark.request('post'), obj, None, False)
+            transaction.set_rollback(True)
+    return run
+
+
+@case('print_inventory')
+def print_inventory(benchmark):
+    model_admin = benchmark.admin(InventoryItems)
+    request = benchmark.request()
+    return lambda: consume(model_admin.print_itenvetoryitem(request))
+
+
+@case('print_purchasing')
+def print_purchasing(benchmark):
+    model_admin = benchmark.admin(StockLevel)
+    request = benchmark.request(data=benchmark.date_filter())
+    return lambda: consume(model_admin.print_purchasing(request))
+
+
+@case('print_delivery')
+def print_delivery(benchmark):
+    model_admin = benchmark.admin(StockMovement)
+    request = benchmark.request(data=benchmark.date_filter())
+    return lambda: consume(model_admin.print_delivery(request))
+
+
+def usage_report(benchmark, report_type, cold=True):
+    model_admin = benchmark.admin(ProductUsage)
+    request = benchmark.request('post', {
+        'start_date': benchmark.start_date, 'end_date': benchmark.end_date,
+        'report_type': report_type,
+    })
+    moments = [benchmark.moment(benchmark.start_date + datetime.timedelta(days=i))
+               for i in range(benchmark.days)]
+
+    def run():
+        if cold:
+            reports.invalidate(*moments)
+        return consume(model_admin.print(request))
+    return run
+
+
+@case('print_usage_material')
+def print_usage_material(benchmark):
+    return usage_report(benchmark, 'material')
+
+
+@case('print_usage_product')
+def print_usage_product(benchmark):
+    return usage_report(benchmark, 'product')
+
+
+@case('print_usage_product_cached')
+def print_usage_product_cached(benchmark):
+    run = usage_report(benchmark, 'product', cold=False)
+    run()
+    return run
+
+
+@case('print_material_planning')
+def print_material_planning(benchmark):
+    model_admin = benchmark.admin(Manufacture)
+    request = benchmark.request('post', {
+        'start_date': benchmark.start_date, 'end_date': benchmark.end_date, 'nested': 'on',
+    })
+    return lambda: consume(model_admin.print_material_planning(request))
+
+
+@case('export_stocklevel_csv')
+def export_stocklevel_csv(benchmark):
+    return benchmark.export(StockLevel, 'csv')
+
+
+@case('export_stockmovement_csv')
+def export_stockmovement_csv(benchmark):
+    return benchmark.export(StockMovement, 'csv')
+
+
+@case('export_manufacture_xlsx')
+def export_manufacture_xlsx(benchmark):
+    return benchmark.export(Manufacture, 'xlsx')
+
+
+@case('export_productusage_csv')
+def export_productusage_csv(benchmark):
+    return benchmark.export(ProductUsage, 'csv')
@@ -0,0 +1,185 @@
+"""
+Multi level explosion of bill of materials.
+
+A formula may use finished goods which are produced by other formulas. The
+requirement vector of a formula maps every leaf material to the quantity
+needed for one unit of output, nested formulas resolved. Vectors are cached
+per formula in the shared ``default`` cache and dropped whenever a detail
+anywhere below it changes, or an item below it becomes or stops being a
+finished good.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+
+from production.models.manufacture import BillOfMaterial, BillOfMaterialDetails
+
+
+CACHE_PREFIX = 'production:bom-requirements:'
+
+
+class BOMCycleError(Exception):
+    """
+    A formula requires, directly or through other formulas, its own product.
+    """
+    def __init__(self, path):
+        self.path = path
+        super().__init__("Formula cycle: {}".format(" -> ".join(str(pk) for pk in path)))
+
+
+def _cache_key(bom_id):
+    return '{}{}'.format(CACHE_PREFIX, bom_id)
+
+
+def load_tree(bom_ids):
+    """
+    Fetch the details of ``bom_ids`` and every formula below them, one level per query.
+
+    Returns ``(details, formula)`` where ``details`` maps a formula to its
+    ``(material_id, quantity)`` lines and ``formula`` maps a finished good to
+    the formula producing it, the latest one when there are several.
+    """
+    details = defaultdict(list)
+    formula = {}
+    pending = set(bom_ids)
+    loaded = set()
+    while pending:
+        rows = BillOfMaterialDetails.objects.filter(bill_of_material__in=pending).values_list(
+            'bill_of_material_id', 'material_id', 'quantity', 'material__type'
+        ).order_by('pk')
+        loaded |= pending
+
+        products = set()
+        for bom_id, material_id, quantity, material_type in rows:
+            details[bom_id].append((material_id, quantity))
+            if material_type == 'BT' and material_id not in formula:
+                products.add(material_id)
+
+        if products:
+            latest = BillOfMaterial.objects.filter(product__in=products).values(
+                'product'
+            ).annotate(latest=Max('pk')).values_list('product', 'latest')
+            formula.update(dict.fromkeys(products))
+            formula.update(latest)
+        pending = {bom_id for bom_id in formula.values() if bom_id} - loaded
+    return details, formula
+
+
+def _resolve(bom_ids):
+    details, formula = load_tree(bom_ids)
+    vectors = {}
+
+    def resolve(bom_id, path):
+        if bom_id in vectors:
+            return vectors[bom_id]
+        if bom_id in path:
+            raise BOMCycleError(path[path.index(bom_id):] + (bom_id,))
+
+        lines = details[bom_id]
+        output_weight = sum(quantity for material_id, quantity in lines)
+        vector = defaultdict(Decimal)
+        if output_weight:
+            for material_id, quantity in lines:
+                share = quantity / output_weight
+                sub_formula = formula.get(material_id)
+                if sub_formula:
+                    for leaf, per_unit in resolve(sub_formula, path + (bom_id,)).items():
+                        vector[leaf] += share * per_unit
+                else:
+                    vector[material_id] += share
+        vectors[bom_id] = dict(vector)
+        return vectors[bom_id]
+
+    for bom_id in bom_ids:
+        resolve(bom_id, ())
+    return vectors
+
+
+def requirement_vectors(bom_ids):
+    """
+    Return ``{bom_id: {item_id: quantity per unit of output}}``.
+
+    Cached vectors are reused, the others are resolved together and cached.
+    Raises ``BOMCycleError`` when a formula ends up requiring itself.
+    """
+    bom_ids = set(bom_ids)
+    cached = cache.get_many([_cache_key(bom_id) for bom_id in bom_ids])
+    vectors = {bom_id: cached[_cache_key(bom_id)] for bom_id in bom_ids
+               if _cache_key(bom_id) in cached}
+
+    missing = bom_ids - set(vectors)
+    if missing:
+        resolved = _resolve(missing)
+        cache.set_many({_cache_key(bom_id): vector for bom_id, vector in resolved.items()},
+                       timeout=None)
+        vectors.update((bom_id, resolved[bom_id]) for bom_id in missing)
+    return vectors
+
+
+def per_unit(lines):
+    """
+    Return ``{material_id: quantity per unit of output}`` of the ``(material_id,
+    quantity)`` lines of one formula.
+    """
+    output_weight = sum(quantity for material_id, quantity in lines)
+    vector = defaultdict(Decimal)
+    if output_weight:
+        for material_id, quantity in lines:
+            vector[material_id] += quantity / output_weight
+    return dict(vector)
+
+
+def direct_vectors(bom_ids):
+    """
+    Return per unit requirement vectors from the formulas' own lines only.
+
+    Finished goods stay as materials, the way ``ManufactureAdmin`` issues
+    them. Not cached, it is a single query.
+    """
+    rows = BillOfMaterialDetails.objects.filter(bill_of_material__in=bom_ids).values_list(
+        'bill_of_material_id', 'material_id', 'quantity'
+    )
+    details = defaultdict(list)
+    for bom_id, material_id, quantity in rows:
+        details[bom_id].append((material_id, quantity))
+
+    return {bom_id: per_unit(details[bom_id]) for bom_id in bom_ids}
+
+
+def requirement_vector(bom_id):
+    return requirement_vectors([bom_id])[bom_id]
+
+
+def explode(bom_id, quantity):
+    """
+    Return ``{item_id: quantity}`` of leaf materials needed to produce ``quantity``.
+    """
+    return {item_id: per_unit * quantity
+            for item_id, per_unit in requirement_vector(bom_id).items()}
+
+
+def invalidate(bom_ids=(), product_ids=()):
+    """
+    Drop cached vectors of ``bom_ids``, of formulas producing ``product_ids``
+    and of every formula using them, directly or nested, once the current
+    transaction commits.
+    """
+    affected = set(bom_ids)
+    affected |= set(BillOfMaterial.objects.filter(product__in=product_ids).values_list('pk', flat=True))
+    products = set(product_ids) | set(
+        BillOfMaterial.objects.filter(pk__in=affected).values_list('product_id', flat=True)
+    )
+    while products:
+        parents = set(BillOfMaterialDetails.objects.filter(material__in=products).values_list(
+            'bill_of_material_id', flat=True
+        )) - affected
+        affected |= parents
+        products = set(
+            BillOfMaterial.objects.filter(pk__in=parents).values_list('product_id', flat=True)
+        )
+    keys = [_cache_key(bom_id) for bom_id in affected]
+    # a vector resolved from the rows before the commit must not survive it
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,85 @@
+"""
+Single entry point to the stores derived from the transaction tables.
+
+Saves and deletes through the ORM are followed by the handlers of
+``production.signals``. Code writing rows without signals goes through this
+module so balances, snapshots, costs, lots, rollups and cached reports are
+all kept in step: ``record_created()`` posts a batch of new rows,
+``rebuild()`` replays the history of items after loads too large to post
+row by row. ``record_product_changed()`` follows a formula producing
+another item, which moves what its manufactures produced.
+"""
+from django.db import transaction
+from django.db.models import F, Sum
+
+from production import costing, ledger, lots, reports, rollups
+from production.models.inventory import StockSnapshot
+from production.models.manufacture import Manufacture, ProductUsage
+
+
+# Items per transaction of ``rebuild()``, keeps ``IN`` lists below the SQLite limit
+REBUILD_BATCH_SIZE = 500
+
+
+def record_created(model, objs):
+    """
+    Post rows of ``model`` written through ``bulk_create``.
+    """
+    if not objs:
+        return
+    ledger.record_created(model, objs)
+    if model in rollups.ROLLUPS:
+        rollups.record_created(model, objs)
+    costing.record_created(model, objs)
+    if model in lots.CONSUMERS:
+        lots.record_created(model, objs)
+    reports.invalidate(*(ledger.instance_values(obj)['moved_at'] for obj in objs))
+
+
+def record_product_changed(bom_id, previous_product_id, product_id):
+    """
+    Move the output of the manufactures of formula ``bom_id``, and the usage
+    rollups filed under its product, from ``previous_product_id`` to ``product_id``.
+    """
+    manufactures = list(Manufacture.objects.filter(bill_of_material=bom_id).values(
+        'quantity', 'status', moved_at=F('datetime'), cost=F('price')
+    ))
+    if not manufactures:
+        return
+    previous = [dict(values, item_pk=previous_product_id) for values in manufactures]
+    current = [dict(values, item_pk=product_id) for values in manufactures]
+    ledger.record_changes(Manufacture, previous, current)
+    rollups.record_changes(Manufacture, previous, current)
+    costing.record_changes(Manufacture, previous, current)
+
+    totals = ProductUsage.objects.filter(manufacture__bill_of_material=bom_id).order_by().values(
+        'item', moved_at=F('manufacture__datetime')
+    ).annotate(total_quantity=Sum('quantity'), total_cost=Sum('price'))
+    usages = [{'item_pk': total['item'], 'moved_at': total['moved_at'],
+               'quantity': total['total_quantity'], 'cost': total['total_cost']} for total in totals]
+    rollups.record_changes(
+        ProductUsage,
+        [dict(values, product_pk=previous_product_id) for values in usages],
+        [dict(values, product_pk=product_id) for values in usages]
+    )
+    reports.invalidate(*(values['moved_at'] for values in manufactures))
+
+
+def rebuild(item_ids, start_date=None, end_date=None):
+    """
+    Recompute the balances, costs and lots of ``item_ids`` from their history,
+    drop their snapshots from ``start_date`` on, and recompute the rollups of
+    ``[start_date, end_date]``, which also expires the cached reports.
+    """
+    item_ids = list(item_ids)
+    for start in range(0, len(item_ids), REBUILD_BATCH_SIZE):
+        batch = item_ids[start:start + REBUILD_BATCH_SIZE]
+        with transaction.atomic():
+            ledger.rebuild(batch)
+            costing.rebuild(batch)
+            snapshots = StockSnapshot.objects.filter(item__in=batch)
+            if start_date is not None:
+                snapshots = snapshots.filter(date__gte=start_date)
+            snapshots.delete()
+    lots.rebuild(item_ids)
+    rollups.rebuild(start_date, end_date)
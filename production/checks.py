@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core import checks
+
+
+# Backends keeping their entries in the memory of one process
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+
+@checks.register(checks.Tags.caches)
+def shared_cache_check(app_configs, **kwargs):
+    """
+    Cached reports, formula vectors and search indexes are expired by version
+    tokens in the default cache, a process local cache misses the tokens
+    renewed by the other processes and serves stale entries forever.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHES:
+        return [checks.Warning(
+            "The default cache {} is not shared between processes.".format(backend),
+            hint="Configure a file based, memcached or redis cache in CACHES.",
+            id='production.W001',
+        )]
+    return []
@@ -0,0 +1,162 @@
+"""
+Moving weighted average cost of the inventory items.
+
+Every write to the transaction tables moves the ``ItemCost`` row of its item
+once, whatever the length of its history. Receipts, returns to suppliers and
+finished production (at the ``price`` of the manufacture) carry their own
+value and update the average, usages, deliveries and adjustments leave at
+the current average. Opening stock is valued at the master ``price``.
+
+Changes are applied in the order they are written, ``rebuild()`` replays the
+history in date order instead, e.g. after back dated entries.
+"""
+import heapq
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import F
+
+from production import ledger
+from production.models.inventory import InventoryItems, StockLevel, StockBalance, ItemCost
+from production.models.manufacture import Manufacture
+
+
+# Models whose rows carry their own value, from the ``cost`` of rollup values
+VALUED = {
+    StockLevel: F('quantity') * F('price'),
+    Manufacture: F('price'),
+}
+
+COST_PLACES = Decimal('0.0001')
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def quantize(value):
+    return Decimal(value).quantize(COST_PLACES, rounding=ROUND_HALF_UP)
+
+
+def move(quantity, average, change, value=None):
+    """
+    Return ``(quantity, average)`` after ``change`` units worth ``value`` moved in.
+
+    Without ``value``, or once nothing is left on hand, the average stays.
+    Stock received while none was on hand is valued at its own unit cost.
+    """
+    after = quantity + change
+    if value is None or after <= 0:
+        return after, average
+    if quantity <= 0:
+        return after, quantize(value / change) if change > 0 else average
+    new_average = (quantity * average + value) / after
+    return after, quantize(new_average) if new_average >= 0 else average
+
+
+def entries(model, values):
+    """
+    Return ``{item_id: (quantity, value)}`` contributed by one row of ``model``.
+
+    ``value`` is ``None`` for rows valued at the current average.
+    """
+    if not values:
+        return {}
+    quantities = ledger.entries(model, values)
+    if not quantities:
+        return {}
+    (item_id, column), quantity = quantities.popitem()
+    value = quantize(values['cost']) if model in VALUED else None
+    return {item_id: (StockBalance.SIGNS[column] * quantity, value)}
+
+
+def post(changes):
+    """
+    Apply ``{item_id: (quantity, value)}`` to the stored costs.
+    """
+    changes = {item_id: (quantity, value) for item_id, (quantity, value) in changes.items()
+               if quantity or value}
+    if changes:
+        ItemCost.objects.apply(changes)
+
+
+def record_changes(model, previous, current):
+    """
+    Post the difference between the ``previous`` and ``current`` values of rows.
+    """
+    changes = defaultdict(lambda: [Decimal(0), None])
+    for values, sign in [(value, 1) for value in current] + [(value, -1) for value in previous]:
+        for item_id, (quantity, value) in entries(model, values).items():
+            change = changes[item_id]
+            change[0] += sign * quantity
+            if value is not None:
+                change[1] = (change[1] or Decimal(0)) + sign * value
+    post(changes)
+
+
+def record_change(model, previous, current):
+    record_changes(model, [previous], [current])
+
+
+def record_created(model, objs):
+    """
+    Post rows written without signals, e.g. through ``bulk_create``.
+    """
+    from production import rollups
+
+    record_changes(model, [], [rollups.instance_values(obj) for obj in objs])
+
+
+def _movements(rows, sign, valued):
+    for item_id, moved_at, quantity, value in rows:
+        if valued:
+            yield item_id, moved_at, 0, sign * quantity, value
+        else:
+            yield item_id, moved_at, 1, sign * quantity, None
+
+
+def history(item_ids=None):
+    """
+    Yield ``(item_id, moved_at, order, quantity, value)`` of every movement,
+    sorted by item and date, valued movements first on the same moment.
+    """
+    streams = []
+    for model, (column, item_field, datetime_field) in ledger.LEDGER_SOURCES.items():
+        queryset = ledger.ledger_queryset(model)
+        if item_ids is not None:
+            queryset = queryset.filter(**{item_field + '__in': item_ids})
+        rows = queryset.order_by(item_field, datetime_field, 'pk').values_list(
+            item_field, datetime_field, 'quantity', VALUED.get(model, F('pk'))
+        ).iterator()
+        streams.append(_movements(rows, StockBalance.SIGNS[column], model in VALUED))
+    return heapq.merge(*streams, key=itemgetter(0, 1, 2))
+
+
+def rebuild(item_ids=None):
+    """
+    Recompute the cost of ``item_ids``, all items by default, in date order.
+
+    Returns the number of items stored.
+    """
+    items = InventoryItems.objects.all()
+    if item_ids is not None:
+        item_ids = list(item_ids)
+        items = items.filter(pk__in=item_ids)
+    state = {pk: [initial, quantize(price)] for pk, initial, price in
+             items.values_list('pk', 'initial', 'price').iterator()}
+
+    for item_id, moved_at, order, quantity, value in history(item_ids):
+        if item_id in state:
+            state[item_id] = list(move(state[item_id][0], state[item_id][1], quantity, value))
+
+    with transaction.atomic():
+        pks = list(state)
+        for start in range(0, len(pks), REBUILD_BATCH_SIZE):
+            batch = pks[start:start + REBUILD_BATCH_SIZE]
+            ItemCost.objects.filter(item_id__in=batch).delete()
+            ItemCost.objects.bulk_create([
+                ItemCost(item_id=pk, quantity=state[pk][0], average=state[pk][1],
+                         value=quantize(state[pk][0] * state[pk][1]))
+                for pk in batch
+            ])
+    return len(state)
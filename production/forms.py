@@ -1,9 +1,17 @@
+from collections import defaultdict
+from decimal import Decimal
+
 from django import forms
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.urls import NoReverseMatch, reverse
+from django.utils.functional import cached_property
+from django.utils.text import Truncator
 from django.utils.translation import ugettext_lazy as _
-from django.contrib.admin.widgets import AdminDateWidget
+from django.contrib.admin.widgets import AdminDateWidget, ForeignKeyRawIdWidget
 
-from production.models.manufacture import ProductUsage
-from production.models.inventory import StockMovement
+from production.models.manufacture import BillOfMaterialDetails, ProductUsage
+from production.models.inventory import InventoryItems, StockMovement
 
 
 PRODUCT_USAGE_REPORT = [
@@ -29,22 +37,184 @@ class ProductUsageReportForm(forms.Form):
                 )
 
 
+class MaterialPlanningForm(forms.Form):
+    start_date = forms.DateField(widget=AdminDateWidget, required=False)
+    end_date = forms.DateField(widget=AdminDateWidget, required=False)
+    nested = forms.BooleanField(
+        required=False, label=_("Explode nested formula"),
+        help_text=_("Hitung kebutuhan sampai bahan baku dari formula barang jadi")
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get("start_date")
+        end_date = cleaned_data.get("end_date")
+
+        if start_date and end_date:
+            if end_date < start_date:
+                raise forms.ValidationError(
+                    _("Tanggal akhir tidak boleh kurang / sebelum "
+                      "tanggal awal")
+                )
+
+
+def reserve(requirements, also=()):
+    """
+    Return the shortages of ``{item_id: required}`` and the stock read,
+    locking the balances when the form is validated inside the transaction
+    that saves it, as the admin does, so simultaneous entries cannot both
+    take the same stock.
+
+    ``also`` names items the same save takes later, their balances are read
+    and locked in the same statement so the save locks in one item order.
+    """
+    available = InventoryItems.objects.availability_for(
+        set(requirements) | set(also), lock=transaction.get_connection().in_atomic_block
+    )
+    return InventoryItems.objects.shortages(requirements, available=available), available
+
+
+def formula_materials(manufacture):
+    """
+    Ids of the materials ``ManufactureAdmin.save_model`` issues from the
+    formula of a new ``manufacture``.
+    """
+    if manufacture.pk is not None or manufacture.bill_of_material_id is None:
+        return set()
+    return set(BillOfMaterialDetails.objects.filter(
+        bill_of_material=manufacture.bill_of_material_id
+    ).values_list('material_id', flat=True))
+
+
+def stored_quantity(form, item):
+    """
+    Quantity of ``item`` already taken by the saved row ``form`` edits, read
+    from its initial data since validating the form copies the new values
+    onto the instance.
+    """
+    if form.instance.pk and form.initial.get('item') == item.pk:
+        return form.initial.get('quantity') or 0
+    return 0
+
+
+class FormulaScaleForm(forms.Form):
+    factor = forms.DecimalField(
+        label=_("Factor"), max_digits=10, decimal_places=4, min_value=Decimal('0.0001'),
+        help_text=_("Semua jumlah bahan dalam formula dikalikan dengan faktor ini")
+    )
+
+
+class FormulaSubstituteForm(forms.Form):
+    material = forms.ModelChoiceField(
+        label=_("Material"), queryset=InventoryItems.objects.all(), to_field_name='code',
+        widget=forms.TextInput, help_text=_("Kode material yang diganti")
+    )
+    replacement = forms.ModelChoiceField(
+        label=_("Replacement"), queryset=InventoryItems.objects.all(), to_field_name='code',
+        widget=forms.TextInput, help_text=_("Kode material pengganti")
+    )
+    ratio = forms.DecimalField(
+        label=_("Ratio"), max_digits=10, decimal_places=4, min_value=Decimal('0.0001'),
+        initial=Decimal(1), help_text=_("Jumlah material pengganti per satuan material lama")
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        material = cleaned_data.get("material")
+        if material and material == cleaned_data.get("replacement"):
+            raise forms.ValidationError(_("Material pengganti harus berbeda"))
+        return cleaned_data
+
+
+class PreloadedRawIdWidget(ForeignKeyRawIdWidget):
+    """
+    Raw id widget labelled from ``objects`` when the related row is found there.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.objects = {}
+
+    def label_and_url_for_value(self, value):
+        try:
+            obj = self.objects.get(self.rel.get_related_field().to_python(value))
+        except ValidationError:
+            obj = None
+        if obj is None:
+            return super().label_and_url_for_value(value)
+        try:
+            url = reverse('{}:{}_{}_change'.format(
+                self.admin_site.name, obj._meta.app_label, obj._meta.model_name
+            ), args=(obj.pk,))
+        except NoReverseMatch:
+            url = ''
+        return Truncator(obj).words(14), url
+
+
+class PreloadedInlineFormSet(forms.BaseInlineFormSet):
+    """
+    Inline formset rendered in a fixed number of queries: rows point to the
+    parent object already loaded and the rows labelling the raw id fields are
+    read in one query per field.
+    """
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        if self.instance.pk is not None:
+            setattr(form.instance, self.fk.name, self.instance)
+        return form
+
+    @cached_property
+    def forms(self):
+        forms = super().forms
+        for name, field in self.form.base_fields.items():
+            if not isinstance(field.widget, PreloadedRawIdWidget):
+                continue
+            related = field.widget.rel.get_related_field()
+            values = set()
+            for form in forms:
+                try:
+                    values.add(related.to_python(form[name].value()))
+                except ValidationError:
+                    pass
+            values.discard(None)
+            objects = related.model._default_manager.in_bulk(values, field_name=related.name)
+            for form in forms:
+                form.fields[name].widget.objects = objects
+        return forms
+
+
 class ProductUsageInlineForm(forms.ModelForm):
     class Meta:
         model = ProductUsage
         fields = '__all__'
 
-    def clean(self):
-        cleaned_data = super().clean()
-        qty = cleaned_data.get('quantity')
-        item = cleaned_data.get('item')
 
-        if qty > item.availability():
-            raise forms.ValidationError(
-                _("Jumlah stock yang tersedia tidak mencukupi")
-            )
-        else:
-            return cleaned_data
+class ProductUsageInlineFormSet(PreloadedInlineFormSet):
+    def clean(self):
+        """
+        Check and reserve stock for every usage row with a single lookup,
+        the rows of an item are summed before comparing with its stock.
+        """
+        super().clean()
+        rows = []
+        for form in self.forms:
+            if not hasattr(form, 'cleaned_data') or self._should_delete_form(form):
+                continue
+            qty = form.cleaned_data.get('quantity')
+            item = form.cleaned_data.get('item')
+            if qty is not None and item is not None:
+                rows.append((form, item, qty))
+
+        requirements = defaultdict(Decimal)
+        for form, item, qty in rows:
+            requirements[item.pk] += qty - stored_quantity(form, item)
+        # the formula materials of a new manufacture are locked together
+        # with the rows, save_model() issues them from the stock read here
+        shortages, self.instance._reserved_stock = reserve(
+            requirements, also=formula_materials(self.instance)
+        )
+        for form, item, qty in rows:
+            if item.pk in shortages:
+                form.add_error(None, _("Jumlah stock yang tersedia tidak mencukupi"))
 
 
 class StockMovementForm(forms.ModelForm):
@@ -54,7 +224,6 @@ class StockMovementForm(forms.ModelForm):
 
     def clean_quantity(self):
         qty = self.cleaned_data.get('quantity')
-        item = self.cleaned_data.get('item')
 
         status = self.instance.status or self.cleaned_data.get('status')
 
@@ -66,10 +235,17 @@ class StockMovementForm(forms.ModelForm):
             if qty < 0:
                 qty *= -1
 
-        if qty > item.availability():
-            raise forms.ValidationError(
-                _("Jumlah stock yang tersedia tidak mencukupi")
-            )
-
         return qty
 
+    def clean(self):
+        """
+        Check and reserve stock once both item and quantity are cleaned,
+        ``item`` comes after ``quantity`` in the field order.
+        """
+        cleaned_data = super().clean()
+        qty = cleaned_data.get('quantity')
+        item = cleaned_data.get('item')
+        if item and qty is not None and reserve({item.pk: qty - stored_quantity(self, item)})[0]:
+            self.add_error('quantity', _("Jumlah stock yang tersedia tidak mencukupi"))
+        return cleaned_data
+
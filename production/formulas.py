@@ -0,0 +1,153 @@
+"""
+Bulk operations on formulas.
+
+Copies, scaling and material substitution run as a fixed number of
+set based statements whatever the number of formulas or lines involved,
+``output_standard`` is recomputed once per affected formula and cached
+requirement vectors are dropped for them.
+"""
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import DecimalField, F, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from production import bom, search
+from production.models.inventory import InventoryItems
+from production.models.manufacture import BillOfMaterial, BillOfMaterialDetails
+
+
+BATCH_SIZE = 1000
+
+COPIED_FIELDS = ['code', 'customer_id', 'customer_category_id', 'color_name', 'product_id',
+                 'price', 'description', 'output_standard']
+
+
+def formulas_using(material_ids):
+    """
+    Return the ids of formulas with a line of ``material_ids``, served by the
+    ``bomdetail_material_bom_idx`` index alone.
+    """
+    return set(BillOfMaterialDetails.objects.filter(material__in=material_ids).values_list(
+        'bill_of_material', flat=True
+    ).distinct())
+
+
+def update_output_standard(bom_ids):
+    """
+    Set ``output_standard`` of ``bom_ids`` to the sum of their lines in one statement.
+    """
+    total = BillOfMaterialDetails.objects.filter(bill_of_material=OuterRef('pk')).order_by().values(
+        'bill_of_material'
+    ).annotate(total=Sum('quantity')).values('total')
+    return BillOfMaterial.objects.filter(pk__in=bom_ids).update(output_standard=Coalesce(
+        Subquery(total, output_field=DecimalField()), Value(Decimal(0)),
+        output_field=DecimalField(max_digits=14, decimal_places=4)
+    ))
+
+
+def _changed(bom_ids, product_ids=()):
+    bom.invalidate(bom_ids=bom_ids, product_ids=product_ids)
+    search.invalidate(BillOfMaterial)
+
+
+def _insert_formulas(rows):
+    """
+    Insert ``BillOfMaterial`` rows, returning them with their primary keys.
+    """
+    formulas = [BillOfMaterial(**row) for row in rows]
+    if connection.features.can_return_rows_from_bulk_insert:
+        return BillOfMaterial.objects.bulk_create(formulas, batch_size=BATCH_SIZE)
+    for formula in formulas:
+        formula.save()
+    return formulas
+
+
+def copy(bom_ids, code_suffix=''):
+    """
+    Copy the formulas ``bom_ids`` with their lines. Returns ``{old id: new id}``.
+    """
+    with transaction.atomic():
+        originals = list(BillOfMaterial.objects.filter(pk__in=bom_ids).order_by('pk').values(
+            'pk', *COPIED_FIELDS
+        ))
+        for row in originals:
+            row['code'] = (row['code'] + code_suffix)[:45]
+        copies = _insert_formulas([{field: row[field] for field in COPIED_FIELDS}
+                                   for row in originals])
+        mapping = {row['pk']: formula.pk for row, formula in zip(originals, copies)}
+
+        lines = BillOfMaterialDetails.objects.filter(bill_of_material__in=mapping).order_by(
+            'pk'
+        ).values_list('bill_of_material', 'material', 'quantity', 'unit', 'price')
+        BillOfMaterialDetails.objects.bulk_create((
+            BillOfMaterialDetails(bill_of_material_id=mapping[bom_id], material_id=material_id,
+                                  quantity=quantity, unit_id=unit_id, price=price)
+            for bom_id, material_id, quantity, unit_id, price in lines.iterator()
+        ), batch_size=BATCH_SIZE)
+        _changed(mapping.values())
+    return mapping
+
+
+def scale(bom_ids, factor):
+    """
+    Multiply every line quantity of ``bom_ids`` by ``factor``. Returns the
+    number of lines changed.
+    """
+    bom_ids = list(bom_ids)
+    with transaction.atomic():
+        changed = BillOfMaterialDetails.objects.filter(bill_of_material__in=bom_ids).update(
+            quantity=F('quantity') * factor
+        )
+        update_output_standard(bom_ids)
+        _changed(bom_ids)
+    return changed
+
+
+def substitute(material_id, replacement_id, ratio=1, bom_ids=None):
+    """
+    Replace ``material_id`` by ``ratio`` times as much ``replacement_id`` in
+    every formula using it, or only in ``bom_ids``.
+
+    Replaced lines take the unit of the replacement. Where a formula already
+    has a line of the replacement, the quantity is added to it and the old
+    line removed. Formulas producing the replacement
+    are left alone. Returns the ids of the changed formulas.
+    """
+    with transaction.atomic():
+        affected = formulas_using([material_id])
+        if bom_ids is not None:
+            affected &= set(bom_ids)
+        affected -= set(BillOfMaterial.objects.filter(
+            pk__in=affected, product=replacement_id
+        ).values_list('pk', flat=True))
+        if not affected:
+            return set()
+
+        old_lines = BillOfMaterialDetails.objects.filter(bill_of_material__in=affected,
+                                                         material=material_id)
+        merged = set(BillOfMaterialDetails.objects.filter(
+            bill_of_material__in=affected, material=replacement_id
+        ).values_list('bill_of_material', flat=True))
+        if merged:
+            added = old_lines.filter(bill_of_material=OuterRef('bill_of_material')).order_by().values(
+                'bill_of_material'
+            ).annotate(total=Sum('quantity')).values('total')
+            # one replacement line per formula takes the substituted quantity
+            first_lines = BillOfMaterialDetails.objects.filter(
+                bill_of_material__in=merged, material=replacement_id
+            ).order_by().values('bill_of_material').annotate(first=Min('pk')).values('first')
+            BillOfMaterialDetails.objects.filter(pk__in=first_lines).update(
+                quantity=F('quantity') + Subquery(added, output_field=DecimalField()) * ratio
+            )
+            # a plain DELETE, the per row signals would invalidate formula by formula
+            merged_lines = old_lines.filter(bill_of_material__in=merged)
+            merged_lines._raw_delete(merged_lines.db)
+        # the lines take the unit of the replacement, their price was the old material's
+        unit_id = InventoryItems.objects.values_list('unit', flat=True).get(pk=replacement_id)
+        old_lines.exclude(bill_of_material__in=merged).update(
+            material=replacement_id, quantity=F('quantity') * ratio, unit=unit_id, price=0
+        )
+        update_output_standard(affected)
+        _changed(affected)
+    return affected
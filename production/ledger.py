@@ -0,0 +1,212 @@
+"""
+Incremental maintenance of ``StockBalance`` and ``StockSnapshot``.
+
+Every transaction row contributes a signed quantity to one column of an item
+balance. Writes compute the difference between the previous and the new
+contribution of a row and push it with a single ``UPDATE``.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from production.models.inventory import InventoryItems, StockLevel, StockMovement, \
+    InventoryAdjustment, StockBalance, StockSnapshot
+from production.models.manufacture import Manufacture, ProductUsage
+
+
+# model: (balance column, item lookup, effective datetime lookup)
+LEDGER_SOURCES = {
+    StockLevel: ('purchased', 'item', 'datetime'),
+    StockMovement: ('delivered', 'item', 'datetime'),
+    ProductUsage: ('used', 'item', 'manufacture__datetime'),
+    InventoryAdjustment: ('adjustment', 'item', 'first_created'),
+    Manufacture: ('produced', 'bill_of_material__product', 'datetime'),
+}
+
+LEDGER_COLUMNS = {model: source[0] for model, source in LEDGER_SOURCES.items()}
+
+QUANTITY_PLACES = Decimal('0.0001')
+
+
+def _quantize(value):
+    return Decimal(value).quantize(QUANTITY_PLACES, rounding=ROUND_HALF_UP)
+
+
+def day_start(date):
+    """
+    Return the aware datetime at which ``date`` starts in the current timezone.
+    """
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
+
+def ledger_queryset(model):
+    """
+    Return the rows of ``model`` that count towards stock.
+    """
+    if model is Manufacture:
+        return model.objects.filter(status='done')
+    return model.objects.all()
+
+
+def instance_values(instance):
+    """
+    Return the ledger relevant values of an unsaved or saved ``instance``.
+    """
+    if isinstance(instance, Manufacture):
+        return {
+            'item_pk': instance.bill_of_material.product_id,
+            'quantity': instance.quantity,
+            'moved_at': instance.datetime,
+            'status': instance.status,
+        }
+    if isinstance(instance, ProductUsage):
+        moved_at = instance.manufacture.datetime
+    else:
+        moved_at = getattr(instance, LEDGER_SOURCES[type(instance)][2])
+    return {'item_pk': instance.item_id, 'quantity': instance.quantity, 'moved_at': moved_at}
+
+
+def stored_values(model, pk, **extra):
+    """
+    Return the ledger relevant values of row ``pk`` as currently stored.
+
+    ``extra`` expressions are fetched along in the same query.
+    """
+    column, item_field, datetime_field = LEDGER_SOURCES[model]
+    fields = ['quantity']
+    if model is Manufacture:
+        fields.append('status')
+    return model.objects.filter(pk=pk).values(
+        *fields, item_pk=F(item_field), moved_at=F(datetime_field), **extra
+    ).first()
+
+
+def entries(model, values):
+    """
+    Return ``{(item_id, column): quantity}`` contributed by one row of ``model``.
+    """
+    if not values:
+        return {}
+    if model is Manufacture and values['status'] != 'done':
+        return {}
+    return {(values['item_pk'], LEDGER_COLUMNS[model]): _quantize(values['quantity'])}
+
+
+def post(changes):
+    """
+    Apply ``{(item_id, column): delta}`` to the stored balances, one update per item.
+    """
+    per_item = defaultdict(dict)
+    for (item_id, column), delta in changes.items():
+        if delta:
+            per_item[item_id][column] = delta
+    for item_id, deltas in per_item.items():
+        StockBalance.objects.apply(item_id, **deltas)
+
+
+def invalidate_snapshots(model, *values):
+    """
+    Drop snapshots taken on or after the effective date of changed rows.
+    """
+    earliest = {}
+    for value in values:
+        if value and value['moved_at'] and entries(model, value):
+            moved_on = timezone.localtime(value['moved_at']).date()
+            item_id = value['item_pk']
+            earliest[item_id] = min(moved_on, earliest.get(item_id, moved_on))
+    for item_id, moved_on in earliest.items():
+        StockSnapshot.objects.filter(item_id=item_id, date__gte=moved_on).delete()
+
+
+def record_change(model, previous, current):
+    """
+    Post the difference between two ledger value sets of the same row.
+    """
+    changes = defaultdict(Decimal)
+    for key, quantity in entries(model, current).items():
+        changes[key] += quantity
+    for key, quantity in entries(model, previous).items():
+        changes[key] -= quantity
+    if any(changes.values()) or (previous and current and
+                                 previous['moved_at'] != current['moved_at']):
+        invalidate_snapshots(model, previous, current)
+    post(changes)
+
+
+def record_changes(model, previous, current):
+    """
+    Post the difference between the ``previous`` and ``current`` values of rows.
+    """
+    changes = defaultdict(Decimal)
+    for values, sign in [(value, 1) for value in current] + [(value, -1) for value in previous]:
+        for key, quantity in entries(model, values).items():
+            changes[key] += sign * quantity
+    if any(changes.values()):
+        invalidate_snapshots(model, *previous, *current)
+    post(changes)
+
+
+def record_manufacture_moved(pk, previous, current):
+    """
+    Usages are dated by their manufacture, moving it invalidates their snapshots too.
+    """
+    if not previous or previous['moved_at'] == current['moved_at']:
+        return
+    moved_on = timezone.localtime(min(previous['moved_at'], current['moved_at'])).date()
+    StockSnapshot.objects.filter(
+        date__gte=moved_on, item__productusage__manufacture=pk
+    ).delete()
+
+
+def record_created(model, objs):
+    """
+    Post rows written without signals, e.g. through ``bulk_create``.
+    """
+    changes = defaultdict(Decimal)
+    values = [instance_values(obj) for obj in objs]
+    for value in values:
+        for key, quantity in entries(model, value).items():
+            changes[key] += quantity
+    invalidate_snapshots(model, *values)
+    post(changes)
+
+
+def movement_totals(since=None, until=None, items=None):
+    """
+    Return ``{item_id: {column: total}}`` for movements dated in ``[since, until)``.
+
+    ``since`` and ``until`` are aware datetimes, either may be omitted to
+    leave the range open. ``items`` optionally restricts the item ids.
+    """
+    totals = defaultdict(dict)
+    for model, (column, item_field, datetime_field) in LEDGER_SOURCES.items():
+        queryset = ledger_queryset(model)
+        if since is not None:
+            queryset = queryset.filter(**{datetime_field + '__gte': since})
+        if until is not None:
+            queryset = queryset.filter(**{datetime_field + '__lt': until})
+        if items is not None:
+            queryset = queryset.filter(**{item_field + '__in': items})
+        rows = queryset.order_by().values_list(item_field).annotate(total=Sum('quantity'))
+        for item_id, total in rows:
+            totals[item_id][column] = total or Decimal(0)
+    return totals
+
+
+def rebuild(item_ids):
+    """
+    Recompute the balances of ``item_ids`` from their full history.
+
+    Uses one aggregate query per transaction type whatever the number of items.
+    """
+    totals = movement_totals(items=item_ids)
+    for item_id, initial in InventoryItems.objects.filter(pk__in=item_ids).values_list('pk', 'initial'):
+        values = {column: round(totals[item_id].get(column, Decimal(0)), 4)
+                  for column in LEDGER_COLUMNS.values()}
+        values['available'] = initial + sum(
+            StockBalance.SIGNS[column] * value for column, value in values.items()
+        )
+        StockBalance.objects.update_or_create(item_id=item_id, defaults=values)
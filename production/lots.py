@@ -0,0 +1,294 @@
+"""
+First in first out lot tracking.
+
+Every receipt opens a ``StockLot``, the opening stock of an item is one lot
+received at ``OPENING``. Usages, deliveries and returns to suppliers drain
+the open lots of their item oldest first and record a ``LotConsumption``
+per lot. Open lots are read in order from a partial index and locked in
+slices, so a consumption only touches the lots it drains.
+
+A receipt moved to another item, shrunk below what was taken from its lot
+or deleted while drained has the lots of its items rebuilt.
+
+Customer returns (negative deliveries) are not tracked. Rows written
+without signals, raw (fixture) saves and back dated entries are put right
+by ``rebuild()`` which replays the history in date order.
+"""
+import datetime
+import heapq
+from collections import defaultdict, deque
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from production import ledger
+from production.models.inventory import InventoryItems, StockLevel, StockMovement, StockLot
+from production.models.manufacture import ProductUsage, LotConsumption
+
+
+OPENING = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# model: LotConsumption field of the consuming row
+CONSUMERS = {
+    ProductUsage: 'usage',
+    StockMovement: 'movement',
+    StockLevel: 'returned',
+}
+
+LOCK_SLICE = 20
+
+REBUILD_BATCH_SIZE = 500
+
+
+def consumed_quantity(model, quantity):
+    """
+    Return the quantity a row of ``model`` takes out of the lots.
+    """
+    if model is StockLevel:
+        return max(-quantity, 0)
+    return max(quantity, 0)
+
+
+def consume(item_id, quantity, **source):
+    """
+    Take ``quantity`` of ``item_id`` out of its open lots, oldest first.
+
+    ``source`` names the consuming row, e.g. ``usage=usage``. What no open
+    lot is left for is recorded without a lot.
+    """
+    consumptions = []
+    drained = []
+    with transaction.atomic(savepoint=False):
+        lots = StockLot.objects.open(item_id).select_for_update()
+        start = 0
+        while quantity > 0:
+            batch = list(lots[start:start + LOCK_SLICE])
+            for lot in batch:
+                taken = min(lot.remaining, quantity)
+                lot.remaining -= taken
+                quantity -= taken
+                drained.append(lot)
+                consumptions.append(LotConsumption(lot=lot, item_id=item_id, quantity=taken, **source))
+                if quantity <= 0:
+                    break
+            if len(batch) < LOCK_SLICE:
+                break
+            start += LOCK_SLICE
+        if quantity > 0:
+            consumptions.append(LotConsumption(item_id=item_id, quantity=quantity, **source))
+        StockLot.objects.bulk_update(drained, ['remaining'])
+        LotConsumption.objects.bulk_create(consumptions)
+    return consumptions
+
+
+def release(**source):
+    """
+    Put back what the row named by ``source`` took from its lots.
+    """
+    consumptions = LotConsumption.objects.filter(**source)
+    taken = consumptions.filter(lot__isnull=False).order_by('lot').values_list(
+        'lot'
+    ).annotate(total=Sum('quantity'))
+    for lot_id, total in taken:
+        StockLot.objects.filter(pk=lot_id).update(remaining=F('remaining') + total)
+    consumptions.delete()
+
+
+def _overdrawn(lot, item_id, quantity):
+    """
+    Whether the rows drawn from ``lot`` no longer fit it once it holds
+    ``quantity`` of ``item_id``.
+    """
+    drawn = lot['quantity'] - lot['remaining']
+    return drawn > 0 and (lot['item'] != item_id or quantity < drawn)
+
+
+def drawn(receipt):
+    """
+    Whether rows were consumed from the lot of ``receipt``.
+    """
+    return StockLot.objects.filter(receipt=receipt).exclude(remaining=F('quantity')).exists()
+
+
+def receive(receipt):
+    """
+    Open, resize or close the lot of ``receipt``.
+
+    When rows consumed from the lot no longer fit it, the receipt moved to
+    another item or holds less than was taken, the lots of the items are
+    rebuilt instead and ``True`` is returned.
+    """
+    lot = StockLot.objects.filter(receipt=receipt).values('item', 'quantity', 'remaining').first()
+    if lot and _overdrawn(lot, receipt.item_id, receipt.quantity):
+        rebuild({lot['item'], receipt.item_id})
+        return True
+    if receipt.quantity <= 0:
+        if lot:
+            StockLot.objects.filter(receipt=receipt).delete()
+    elif lot:
+        StockLot.objects.filter(receipt=receipt).update(
+            item_id=receipt.item_id, received_at=receipt.datetime, quantity=receipt.quantity,
+            remaining=F('remaining') + receipt.quantity - F('quantity')
+        )
+    else:
+        StockLot.objects.create(item_id=receipt.item_id, receipt=receipt,
+                                received_at=receipt.datetime, quantity=receipt.quantity,
+                                remaining=receipt.quantity)
+    return False
+
+
+def set_opening(item_id, initial):
+    """
+    Resize the opening lot of ``item_id`` to ``initial``, the lots of the
+    item are rebuilt when less than was taken from it is left.
+    """
+    lot = StockLot.objects.filter(item_id=item_id, receipt__isnull=True).values(
+        'item', 'quantity', 'remaining'
+    ).first()
+    if lot and _overdrawn(lot, item_id, initial):
+        rebuild([item_id])
+        return
+    updated = StockLot.objects.filter(item_id=item_id, receipt__isnull=True).update(
+        quantity=initial, remaining=F('remaining') + initial - F('quantity')
+    )
+    if not updated and initial > 0:
+        StockLot.objects.create(item_id=item_id, received_at=OPENING, quantity=initial,
+                                remaining=initial)
+
+
+def record_change(model, instance, previous, current):
+    """
+    Follow a saved or deleted (``current`` is ``None``) row of ``model``.
+    """
+    if model is StockLevel and current and receive(instance):
+        return
+    if model not in CONSUMERS:
+        return
+    if previous and current and previous['item_pk'] == current['item_pk'] and \
+            previous['quantity'] == current['quantity']:
+        return
+    field = CONSUMERS[model]
+    if previous and consumed_quantity(model, previous['quantity']):
+        release(**{field: instance})
+    if current and consumed_quantity(model, current['quantity']):
+        consume(current['item_pk'], consumed_quantity(model, current['quantity']),
+                **{field: instance})
+
+
+def record_created(model, objs):
+    """
+    Consume for rows of ``model`` written through ``bulk_create``.
+
+    Not every database returns their primary keys, usages without one are
+    read back by manufacture, skipping those consuming already.
+    """
+    field = CONSUMERS[model]
+    rows = [(obj.pk, obj.item_id, obj.quantity) for obj in objs if obj.pk]
+    if model is ProductUsage and len(rows) < len(objs):
+        rows = ProductUsage.objects.filter(
+            manufacture__in={obj.manufacture_id for obj in objs}, lot_consumptions__isnull=True
+        ).order_by('pk').values_list('pk', 'item', 'quantity')
+    for pk, item_id, quantity in rows:
+        quantity = consumed_quantity(model, quantity)
+        if quantity:
+            consume(item_id, quantity, **{field + '_id': pk})
+
+
+def _events(rows, order):
+    for item_id, moved_at, pk, quantity in rows:
+        yield item_id, moved_at, order, pk, quantity
+
+
+def history(item_ids):
+    """
+    Yield ``(item_id, moved_at, order, pk, quantity)`` of receipts (order 0)
+    and consumptions (order 1 and up), sorted by item and date.
+    """
+    receipts = StockLevel.objects.filter(item__in=item_ids, quantity__gt=0)
+    streams = [_events(receipts.order_by('item', 'datetime', 'pk').values_list(
+        'item', 'datetime', 'pk', 'quantity'
+    ).iterator(), 0)]
+    for order, model in enumerate(CONSUMERS, start=1):
+        column, item_field, datetime_field = ledger.LEDGER_SOURCES[model]
+        queryset = model.objects.filter(**{item_field + '__in': item_ids})
+        if model is StockLevel:
+            queryset = queryset.filter(quantity__lt=0)
+        else:
+            queryset = queryset.filter(quantity__gt=0)
+        streams.append(_events(queryset.order_by(item_field, datetime_field, 'pk').values_list(
+            item_field, datetime_field, 'pk', 'quantity'
+        ).iterator(), order))
+    return heapq.merge(*streams, key=itemgetter(0, 1, 2))
+
+
+def _rebuild_batch(items):
+    item_ids = list(items)
+    lots = {}
+    open_lots = defaultdict(deque)
+    for item_id, initial in items.items():
+        if initial > 0:
+            lots[item_id, None] = [item_id, None, OPENING, initial, initial]
+            open_lots[item_id].append(lots[item_id, None])
+
+    fields = list(CONSUMERS.values())
+    taken = []
+    for item_id, moved_at, order, pk, quantity in history(item_ids):
+        if order == 0:
+            lots[item_id, pk] = [item_id, pk, moved_at, quantity, quantity]
+            open_lots[item_id].append(lots[item_id, pk])
+            continue
+        field = fields[order - 1]
+        quantity = consumed_quantity(list(CONSUMERS)[order - 1], quantity)
+        queue = open_lots[item_id]
+        while quantity > 0 and queue:
+            lot = queue[0]
+            amount = min(lot[4], quantity)
+            lot[4] -= amount
+            quantity -= amount
+            taken.append((item_id, (lot[0], lot[1]), field, pk, amount))
+            if lot[4] <= 0:
+                queue.popleft()
+        if quantity > 0:
+            taken.append((item_id, None, field, pk, quantity))
+
+    LotConsumption.objects.filter(item__in=item_ids).delete()
+    StockLot.objects.filter(item__in=item_ids).delete()
+    StockLot.objects.bulk_create([
+        StockLot(item_id=item_id, receipt_id=receipt_id, received_at=received_at,
+                 quantity=quantity, remaining=remaining)
+        for item_id, receipt_id, received_at, quantity, remaining in lots.values()
+    ])
+    pks = {
+        (item_id, receipt_id): pk for pk, item_id, receipt_id in
+        StockLot.objects.filter(item__in=item_ids).values_list('pk', 'item', 'receipt')
+    }
+    LotConsumption.objects.bulk_create([
+        LotConsumption(lot_id=pks[key] if key else None, item_id=item_id, quantity=amount,
+                       **{field + '_id': pk})
+        for item_id, key, field, pk, amount in taken
+    ], batch_size=1000)
+
+
+def rebuild(item_ids=None):
+    """
+    Recreate the lots and consumptions of ``item_ids``, all items by default,
+    by replaying their history in date order. Returns the number of items.
+    """
+    items = InventoryItems.objects.order_by('pk')
+    if item_ids is not None:
+        items = items.filter(pk__in=list(item_ids))
+    initials = dict(items.values_list('pk', 'initial'))
+    pks = list(initials)
+    for start in range(0, len(pks), REBUILD_BATCH_SIZE):
+        with transaction.atomic():
+            _rebuild_batch({pk: initials[pk] for pk in pks[start:start + REBUILD_BATCH_SIZE]})
+    return len(pks)
+
+
+def remaining(item_id):
+    """
+    Return ``[(lot, remaining)]`` of the open lots of ``item_id``, oldest first.
+    """
+    return [(lot, lot.remaining) for lot in StockLot.objects.open(item_id).select_related('receipt')]
@@ -0,0 +1,71 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from production import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Time the hot paths against the current data and store the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('cases', nargs='*', help="Cases to run, default all")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--compare', help="JSON results of an earlier run to compare with")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Allowed growth of a median before it counts as a regression")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--days', type=int, default=30, help="Period of the reports")
+        parser.add_argument('--sample', type=int, default=100,
+                            help="Items looked up one by one for availability")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--list', action='store_true', help="List the cases and exit")
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name in benchmarks.CASES:
+                self.stdout.write(name)
+            return
+        unknown = set(options['cases']) - set(benchmarks.CASES)
+        if unknown:
+            raise CommandError("Unknown case(s): {}".format(", ".join(sorted(unknown))))
+        if options['repeat'] < 1 or options['days'] < 1:
+            raise CommandError("Repeat and days must be positive")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        benchmark = benchmarks.Benchmark(
+            repeat=options['repeat'], days=options['days'], sample=options['sample'],
+            seed=options['seed'], log=lambda name: self.stdout.write(name, ending=' ... ')
+        )
+        results = benchmark.run(options['cases'] or None)
+        self.stdout.write('')
+
+        row = "{:<34} {:>10} {:>10} {:>10} {:>8}"
+        self.stdout.write(row.format("Case", "Min", "Median", "Max", "Queries"))
+        for name, result in results['cases'].items():
+            self.stdout.write(row.format(
+                name, "{:.4f}".format(result['min']), "{:.4f}".format(result['median']),
+                "{:.4f}".format(result['max']), result['queries']
+            ))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS("Results written to {}".format(options['output'])))
+
+        if baseline is not None:
+            regressions = []
+            row = "{:<34} {:>10} {:>10} {:>8}"
+            self.stdout.write(row.format("Case", "Baseline", "Median", "Ratio"))
+            for name, previous, current, ratio, regressed in benchmarks.compare(
+                    baseline, results, options['tolerance']):
+                line = row.format(name, "{:.4f}".format(previous), "{:.4f}".format(current),
+                                  "{:.2f}".format(ratio))
+                self.stdout.write(self.style.ERROR(line) if regressed else line)
+                if regressed:
+                    regressions.append(name)
+            if regressions:
+                raise CommandError("Regressed: {}".format(", ".join(regressions)))
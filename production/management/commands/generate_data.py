@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from production.synthetic import Generator
+
+
+# Row counts at --scale 1
+SIZES = {
+    'items': 50000,
+    'formulas': 20000,
+    'receipts': 2000000,
+    'deliveries': 1000000,
+    'manufactures': 500000,
+    'customers': 2000,
+    'suppliers': 500,
+}
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic dataset for benchmarking, on top of the existing data"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help="Multiply every default size, e.g. 0.01 for a quick dataset")
+        for name, size in SIZES.items():
+            parser.add_argument('--{}'.format(name), type=int,
+                                help="Number of {}, default {} times the scale".format(name, size))
+        parser.add_argument('--days', type=int, default=365,
+                            help="Spread transactions over this many days up to now")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['scale'] <= 0 or options['days'] <= 0:
+            raise CommandError("Scale and days must be positive")
+        sizes = {
+            name: options[name] if options[name] is not None else max(1, int(size * options['scale']))
+            for name, size in SIZES.items()
+        }
+        if sizes['items'] < 10:
+            raise CommandError("At least 10 items are needed")
+
+        generator = Generator(seed=options['seed'], days=options['days'],
+                              batch_size=options['batch_size'], log=self.stdout.write)
+        counts = generator.generate(**sizes)
+        self.stdout.write(self.style.SUCCESS(", ".join(
+            "{} {}".format(count, name) for name, count in counts.items()
+        )))
@@ -0,0 +1,36 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from production import mrp
+
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError("Invalid date \"{}\", use YYYY-MM-DD".format(value))
+
+
+class Command(BaseCommand):
+    help = "Net material requirements of pending and on going manufactures against stock"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=parse_date, help="First order date, YYYY-MM-DD")
+        parser.add_argument('--end', type=parse_date, help="Last order date, YYYY-MM-DD")
+        parser.add_argument('--nested', action='store_true',
+                            help="Explode finished goods used as materials")
+        parser.add_argument('--all', action='store_true',
+                            help="List every required item, not only shortages")
+
+    def handle(self, *args, **options):
+        lines = mrp.run(options['start'], options['end'], nested=options['nested'],
+                        shortages_only=not options['all'])
+        row = "{:<12} {:<45} {:>14} {:>14} {:>14}"
+        self.stdout.write(row.format("Code", "Name", "Required", "Available", "Short"))
+        for line in lines:
+            self.stdout.write(row.format(
+                line.code, line.name, round(line.required, 4), round(line.available, 4),
+                round(line.short, 4)
+            ))
+        self.stdout.write(self.style.SUCCESS("{} item(s)".format(len(lines))))
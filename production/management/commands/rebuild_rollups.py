@@ -0,0 +1,29 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from production import rollups
+
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError("Invalid date \"{}\", use YYYY-MM-DD".format(value))
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily rollups from the transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First date as YYYY-MM-DD, default the first transaction")
+        parser.add_argument('--end', help="Last date as YYYY-MM-DD, default the last transaction")
+
+    def handle(self, *args, **options):
+        start_date = parse_date(options['start']) if options['start'] else None
+        end_date = parse_date(options['end']) if options['end'] else None
+        if start_date and end_date and end_date < start_date:
+            raise CommandError("End date is before start date")
+
+        count = rollups.rebuild(start_date, end_date)
+        self.stdout.write(self.style.SUCCESS("Stored {} rollup row(s)".format(count)))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from production import ledger
+from production.models.inventory import InventoryItems
+
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = "Recompute stored stock balances from the full transaction history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('codes', nargs='*', help="Item codes to rebuild, default all items")
+
+    def handle(self, *args, **options):
+        items = InventoryItems.objects.order_by('pk')
+        if options['codes']:
+            items = items.filter(code__in=options['codes'])
+
+        item_ids = list(items.values_list('pk', flat=True))
+        for start in range(0, len(item_ids), BATCH_SIZE):
+            with transaction.atomic():
+                ledger.rebuild(item_ids[start:start + BATCH_SIZE])
+        self.stdout.write(self.style.SUCCESS("Rebuilt {} stock balance(s)".format(len(item_ids))))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from production import lots
+from production.models.inventory import InventoryItems
+
+
+class Command(BaseCommand):
+    help = "Recreate the FIFO lots of items and what consumed them from their history in date order"
+
+    def add_arguments(self, parser):
+        parser.add_argument('codes', nargs='*', help="Item codes to rebuild, default all items")
+
+    def handle(self, *args, **options):
+        item_ids = None
+        if options['codes']:
+            item_ids = list(InventoryItems.objects.filter(
+                code__in=options['codes']
+            ).values_list('pk', flat=True))
+
+        count = lots.rebuild(item_ids)
+        self.stdout.write(self.style.SUCCESS("Rebuilt the lots of {} item(s)".format(count)))
@@ -0,0 +1,38 @@
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from production import formulas
+from production.models.inventory import InventoryItems
+
+
+def parse_ratio(value):
+    try:
+        ratio = Decimal(value)
+    except InvalidOperation:
+        raise CommandError("Invalid ratio \"{}\"".format(value))
+    if ratio <= 0:
+        raise CommandError("The ratio must be positive")
+    return ratio
+
+
+class Command(BaseCommand):
+    help = "Replace a material by another in every formula using it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('material', help="Code of the material to replace")
+        parser.add_argument('replacement', help="Code of the replacing material")
+        parser.add_argument('--ratio', type=parse_ratio, default=Decimal(1),
+                            help="Quantity of the replacement per unit of the material, default 1")
+
+    def handle(self, *args, **options):
+        codes = [options['material'], options['replacement']]
+        items = dict(InventoryItems.objects.filter(code__in=codes).values_list('code', 'pk'))
+        for code in codes:
+            if code not in items:
+                raise CommandError("Unknown item \"{}\"".format(code))
+        if items[codes[0]] == items[codes[1]]:
+            raise CommandError("The replacement must differ from the material")
+
+        changed = formulas.substitute(items[codes[0]], items[codes[1]], options['ratio'])
+        self.stdout.write(self.style.SUCCESS("Updated {} formula(s)".format(len(changed))))
@@ -0,0 +1,27 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from production.models.inventory import StockSnapshot
+
+
+class Command(BaseCommand):
+    help = "Store the stock balance of every item at the end of a day"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date', help="Snapshot date as YYYY-MM-DD, default yesterday"
+        )
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                date = datetime.datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("Invalid date \"{}\", use YYYY-MM-DD".format(options['date']))
+        else:
+            date = timezone.localdate() - datetime.timedelta(days=1)
+
+        count = StockSnapshot.objects.take(date)
+        self.stdout.write(self.style.SUCCESS("Stored {} snapshot(s) for {}".format(count, date)))
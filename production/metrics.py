@@ -0,0 +1,26 @@
+"""
+Prometheus metrics of the bulk imports and streaming exports.
+
+Throughput is ``rate(rows_total) / rate(seconds_sum)`` per model.
+"""
+from prometheus_client import Counter, Histogram
+
+
+TRANSFER_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float('inf'))
+
+IMPORT_ROWS = Counter(
+    'production_import_rows_total', "Rows written by bulk imports", ['model']
+)
+
+IMPORT_SECONDS = Histogram(
+    'production_import_seconds', "Duration of bulk imports", ['model'], buckets=TRANSFER_BUCKETS
+)
+
+EXPORT_ROWS = Counter(
+    'production_export_rows_total', "Rows written by streaming exports", ['model', 'format']
+)
+
+EXPORT_SECONDS = Histogram(
+    'production_export_seconds', "Duration of streaming exports", ['model', 'format'],
+    buckets=TRANSFER_BUCKETS
+)
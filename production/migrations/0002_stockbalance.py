@@ -0,0 +1,67 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_balances(apps, schema_editor):
+    InventoryItems = apps.get_model('production', 'InventoryItems')
+    StockBalance = apps.get_model('production', 'StockBalance')
+    StockLevel = apps.get_model('production', 'StockLevel')
+    StockMovement = apps.get_model('production', 'StockMovement')
+    ProductUsage = apps.get_model('production', 'ProductUsage')
+    Manufacture = apps.get_model('production', 'Manufacture')
+    InventoryAdjustment = apps.get_model('production', 'InventoryAdjustment')
+
+    def totals(queryset, item_field='item'):
+        rows = queryset.values(item_field).annotate(total=models.Sum('quantity'))
+        return {row[item_field]: row['total'] or 0 for row in rows}
+
+    purchased = totals(StockLevel.objects.all())
+    produced = totals(Manufacture.objects.filter(status='done'), 'bill_of_material__product')
+    used = totals(ProductUsage.objects.all())
+    delivered = totals(StockMovement.objects.all())
+    adjustment = totals(InventoryAdjustment.objects.all())
+
+    balances = []
+    for pk, initial in InventoryItems.objects.values_list('pk', 'initial').iterator():
+        balance = StockBalance(
+            item_id=pk,
+            purchased=purchased.get(pk, 0),
+            produced=produced.get(pk, 0),
+            used=used.get(pk, 0),
+            delivered=delivered.get(pk, 0),
+            adjustment=adjustment.get(pk, 0),
+        )
+        balance.available = (initial + balance.purchased + balance.produced - balance.used -
+                             balance.delivered + balance.adjustment)
+        balances.append(balance)
+    StockBalance.objects.bulk_create(balances, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('purchased', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Purchased')),
+                ('produced', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Produced')),
+                ('used', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Used')),
+                ('delivered', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Delivered')),
+                ('adjustment', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Adjustment')),
+                ('available', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Available')),
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='balance', to='production.inventoryitems', verbose_name='Item')),
+            ],
+            options={
+                'verbose_name': '2.2. Saldo Stock',
+                'verbose_name_plural': '2.2. Saldo Stock',
+            },
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0002_stockbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('purchased', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Purchased')),
+                ('produced', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Produced')),
+                ('used', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Used')),
+                ('delivered', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Delivered')),
+                ('adjustment', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Adjustment')),
+                ('available', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Available')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='production.inventoryitems', verbose_name='Item')),
+            ],
+            options={
+                'verbose_name': '2.3. Snapshot Stock',
+                'verbose_name_plural': '2.3. Snapshot Stock',
+                'unique_together': {('item', 'date')},
+            },
+        ),
+    ]
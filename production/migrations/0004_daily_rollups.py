@@ -0,0 +1,96 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:54
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def populate_rollups(apps, schema_editor):
+    DailyItemRollup = apps.get_model('production', 'DailyItemRollup')
+    DailyUsageRollup = apps.get_model('production', 'DailyUsageRollup')
+    StockLevel = apps.get_model('production', 'StockLevel')
+    StockMovement = apps.get_model('production', 'StockMovement')
+    ProductUsage = apps.get_model('production', 'ProductUsage')
+    Manufacture = apps.get_model('production', 'Manufacture')
+
+    def totals(queryset, datetime_field, item_field, **sums):
+        return queryset.order_by().values(
+            day=TruncDate(datetime_field), key=F(item_field)
+        ).annotate(**sums)
+
+    items = defaultdict(dict)
+    for row in totals(StockLevel.objects.all(), 'datetime', 'item',
+                      total=Sum('quantity'), total_value=Sum(F('quantity') * F('price'))):
+        items[row['day'], row['key']].update(purchased=row['total'], purchased_value=row['total_value'])
+    for row in totals(StockMovement.objects.all(), 'datetime', 'item', total=Sum('quantity')):
+        items[row['day'], row['key']].update(delivered=row['total'])
+    for row in totals(ProductUsage.objects.all(), 'manufacture__datetime', 'item',
+                      total=Sum('quantity'), total_value=Sum('price')):
+        items[row['day'], row['key']].update(used=row['total'], used_value=row['total_value'])
+    for row in totals(Manufacture.objects.all(), 'datetime', 'bill_of_material__product',
+                      total=Sum('quantity'), total_value=Sum('price')):
+        items[row['day'], row['key']].update(output=row['total'], output_value=row['total_value'])
+    DailyItemRollup.objects.bulk_create([
+        DailyItemRollup(date=day, item_id=item_id, **columns)
+        for (day, item_id), columns in items.items()
+    ], batch_size=1000)
+
+    usages = ProductUsage.objects.order_by().values(
+        day=TruncDate('manufacture__datetime'), product=F('manufacture__bill_of_material__product'),
+        material=F('item')
+    ).annotate(total=Sum('quantity'), total_value=Sum('price'))
+    DailyUsageRollup.objects.bulk_create([
+        DailyUsageRollup(date=row['day'], product_id=row['product'], item_id=row['material'],
+                         quantity=row['total'], value=row['total_value'])
+        for row in usages
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0003_stocksnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyUsageRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('quantity', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Quantity')),
+                ('value', models.DecimalField(decimal_places=4, default=0, max_digits=20, verbose_name='Value')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='production.inventoryitems', verbose_name='Item')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='production.inventoryitems', verbose_name='Product')),
+            ],
+            options={
+                'verbose_name': '2.5. Rekap Harian Penggunaan Barang',
+                'verbose_name_plural': '2.5. Rekap Harian Penggunaan Barang',
+                'unique_together': {('date', 'product', 'item')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyItemRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('purchased', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Purchased')),
+                ('purchased_value', models.DecimalField(decimal_places=4, default=0, max_digits=20, verbose_name='Purchased value')),
+                ('delivered', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Delivered')),
+                ('used', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Used')),
+                ('used_value', models.DecimalField(decimal_places=4, default=0, max_digits=20, verbose_name='Used value')),
+                ('output', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Output')),
+                ('output_value', models.DecimalField(decimal_places=4, default=0, max_digits=20, verbose_name='Output value')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='production.inventoryitems', verbose_name='Item')),
+            ],
+            options={
+                'verbose_name': '2.4. Rekap Harian Barang',
+                'verbose_name_plural': '2.4. Rekap Harian Barang',
+                'unique_together': {('date', 'item')},
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0004_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventoryadjustment',
+            index=models.Index(fields=['item', 'first_created'], name='adjustment_item_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventoryitems',
+            index=models.Index(fields=['type', 'code'], name='item_type_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='manufacture',
+            index=models.Index(fields=['datetime'], name='manufacture_datetime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='manufacture',
+            index=models.Index(fields=['status', 'datetime'], name='manufacture_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='manufacture',
+            index=models.Index(fields=['bill_of_material', 'status'], name='manufacture_bom_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productusage',
+            index=models.Index(fields=['manufacture', 'item'], name='usage_manufacture_item_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocklevel',
+            index=models.Index(fields=['item', 'datetime'], name='stocklevel_item_datetime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocklevel',
+            index=models.Index(fields=['datetime'], name='stocklevel_datetime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocklevel',
+            index=models.Index(fields=['status', 'datetime'], name='stocklevel_status_datetime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocklevel',
+            index=models.Index(fields=['delivery_note'], name='stocklevel_delivery_note_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['item', 'datetime'], name='movement_item_datetime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['datetime'], name='movement_datetime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['status', 'datetime'], name='movement_status_datetime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['delivery_order'], name='movement_delivery_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['jo_number'], name='movement_jo_number_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0005_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemCost',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Quantity')),
+                ('average', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Average cost')),
+                ('value', models.DecimalField(decimal_places=4, default=0, max_digits=20, verbose_name='Stock value')),
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cost', to='production.inventoryitems', verbose_name='Item')),
+            ],
+            options={
+                'verbose_name': '2.5. Harga Pokok Rata-rata',
+                'verbose_name_plural': '2.5. Harga Pokok Rata-rata',
+            },
+        ),
+    ]
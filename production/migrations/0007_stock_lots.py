@@ -0,0 +1,123 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:09
+
+import datetime
+import heapq
+from collections import defaultdict, deque
+from operator import itemgetter
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def populate_lots(apps, schema_editor):
+    InventoryItems = apps.get_model('production', 'InventoryItems')
+    StockLot = apps.get_model('production', 'StockLot')
+    LotConsumption = apps.get_model('production', 'LotConsumption')
+    StockLevel = apps.get_model('production', 'StockLevel')
+    StockMovement = apps.get_model('production', 'StockMovement')
+    ProductUsage = apps.get_model('production', 'ProductUsage')
+    opening = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+    def events(queryset, item_field, datetime_field, order):
+        rows = queryset.order_by(item_field, datetime_field, 'pk').values_list(
+            item_field, datetime_field, 'pk', 'quantity'
+        ).iterator()
+        for item_id, moved_at, pk, quantity in rows:
+            yield item_id, moved_at, order, pk, quantity
+
+    # replayed in the order of lots.history(), receipts first on the same moment
+    fields = [None, 'usage', 'movement', 'returned']
+    history = heapq.merge(
+        events(StockLevel.objects.filter(quantity__gt=0), 'item', 'datetime', 0),
+        events(ProductUsage.objects.filter(quantity__gt=0), 'item', 'manufacture__datetime', 1),
+        events(StockMovement.objects.filter(quantity__gt=0), 'item', 'datetime', 2),
+        events(StockLevel.objects.filter(quantity__lt=0), 'item', 'datetime', 3),
+        key=itemgetter(0, 1, 2),
+    )
+
+    lots = {}
+    open_lots = defaultdict(deque)
+    for item_id, initial in InventoryItems.objects.filter(initial__gt=0).values_list('pk', 'initial'):
+        lots[item_id, None] = [item_id, None, opening, initial, initial]
+        open_lots[item_id].append(lots[item_id, None])
+    taken = []
+    for item_id, moved_at, order, pk, quantity in history:
+        field = fields[order]
+        if field is None:
+            lots[item_id, pk] = [item_id, pk, moved_at, quantity, quantity]
+            open_lots[item_id].append(lots[item_id, pk])
+            continue
+        quantity = abs(quantity)
+        queue = open_lots[item_id]
+        while quantity > 0 and queue:
+            lot = queue[0]
+            amount = min(lot[4], quantity)
+            lot[4] -= amount
+            quantity -= amount
+            taken.append((item_id, (lot[0], lot[1]), field, pk, amount))
+            if lot[4] <= 0:
+                queue.popleft()
+        if quantity > 0:
+            taken.append((item_id, None, field, pk, quantity))
+
+    StockLot.objects.bulk_create([
+        StockLot(item_id=item_id, receipt_id=receipt_id, received_at=received_at,
+                 quantity=quantity, remaining=remaining)
+        for item_id, receipt_id, received_at, quantity, remaining in lots.values()
+    ], batch_size=1000)
+    pks = {
+        (item_id, receipt_id): pk for pk, item_id, receipt_id in
+        StockLot.objects.values_list('pk', 'item', 'receipt').iterator()
+    }
+    LotConsumption.objects.bulk_create([
+        LotConsumption(lot_id=pks[key] if key else None, item_id=item_id, quantity=amount,
+                       **{field + '_id': pk})
+        for item_id, key, field, pk, amount in taken
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0006_itemcost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockLot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('received_at', models.DateTimeField(verbose_name='Received at')),
+                ('quantity', models.DecimalField(decimal_places=4, max_digits=14, verbose_name='Quantity')),
+                ('remaining', models.DecimalField(decimal_places=4, max_digits=14, verbose_name='Remaining')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='production.inventoryitems', verbose_name='Item')),
+                ('receipt', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lot', to='production.stocklevel', verbose_name='Receipt')),
+            ],
+            options={
+                'verbose_name': '2.6. Lot Stock',
+                'verbose_name_plural': '2.6. Lot Stock',
+            },
+        ),
+        migrations.CreateModel(
+            name='LotConsumption',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=4, max_digits=14, verbose_name='Quantity')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='production.inventoryitems', verbose_name='Item')),
+                ('lot', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='consumptions', to='production.stocklot', verbose_name='Lot')),
+                ('movement', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lot_consumptions', to='production.stockmovement', verbose_name='Delivery')),
+                ('returned', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lot_consumptions', to='production.stocklevel', verbose_name='Return')),
+                ('usage', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lot_consumptions', to='production.productusage', verbose_name='Usage')),
+            ],
+            options={
+                'verbose_name': '2.7. Pemakaian Lot',
+                'verbose_name_plural': '2.7. Pemakaian Lot',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stocklot',
+            index=models.Index(condition=models.Q(('remaining__gt', 0)), fields=['item', 'received_at', 'id'], name='lot_open_fifo_idx'),
+        ),
+        migrations.RunPython(populate_lots, migrations.RunPython.noop),
+    ]
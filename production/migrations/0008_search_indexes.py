@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+# (index, table, column) served by the autocomplete search on PostgreSQL
+SEARCH_INDEXES = [
+    ('item_code_trgm_idx', 'production_inventoryitems', 'code'),
+    ('item_name_trgm_idx', 'production_inventoryitems', 'name'),
+    ('bom_code_trgm_idx', 'production_billofmaterial', 'code'),
+    ('bom_color_name_trgm_idx', 'production_billofmaterial', 'color_name'),
+    ('customer_name_trgm_idx', 'production_customer', 'name'),
+    ('category_name_trgm_idx', 'production_customercategory', 'name'),
+    ('supplier_name_trgm_idx', 'production_supplier', 'name'),
+    ('unit_name_trgm_idx', 'production_unitmeasurement', 'name'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in SEARCH_INDEXES:
+        # matches the UPPER(column::text) of icontains and the % operator
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS {} ON {} USING gin '
+                              '(UPPER({}::text) gin_trgm_ops)'.format(name, table, column))
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in SEARCH_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0007_stock_lots'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0008_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='billofmaterialdetails',
+            index=models.Index(fields=['material', 'bill_of_material'], name='bomdetail_material_bom_idx'),
+        ),
+    ]
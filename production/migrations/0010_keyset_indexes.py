@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0009_formula_material_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='manufacture',
+            name='manufacture_datetime_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='stocklevel',
+            name='stocklevel_datetime_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='stockmovement',
+            name='movement_datetime_idx',
+        ),
+        migrations.AddIndex(
+            model_name='manufacture',
+            index=models.Index(fields=['datetime', 'id'], name='manufacture_datetime_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocklevel',
+            index=models.Index(fields=['datetime', 'id'], name='stocklevel_datetime_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['datetime', 'id'], name='movement_datetime_id_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:27
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0010_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='itemcost',
+            options={'verbose_name': '2.6. Harga Pokok Rata-rata', 'verbose_name_plural': '2.6. Harga Pokok Rata-rata'},
+        ),
+        migrations.AlterModelOptions(
+            name='lotconsumption',
+            options={'verbose_name': '2.8. Pemakaian Lot', 'verbose_name_plural': '2.8. Pemakaian Lot'},
+        ),
+        migrations.AlterModelOptions(
+            name='stocklot',
+            options={'verbose_name': '2.7. Lot Stock', 'verbose_name_plural': '2.7. Lot Stock'},
+        ),
+    ]
@@ -4,7 +4,8 @@ from django.utils.translation import  ugettext_lazy as _
 from django.db import models
 
 from production.models.customer import Supplier, Customer
-from production.models.managers import InventoryItemsManager
+from production.models.managers import InventoryItemsManager, StockBalanceManager, \
+    StockSnapshotManager, RollupManager, ItemCostManager, StockLotManager
 
 
 class UnitMeasurement(models.Model):
@@ -42,6 +43,9 @@ class InventoryItems(models.Model):
         verbose_name = _("1.5. Stock Barang")
         verbose_name_plural = _("1.5. Daftar Stock Barang")
         app_label = 'production'
+        indexes = [
+            models.Index(fields=['type', 'code'], name='item_type_code_idx'),
+        ]
 
     def __str__(self):
         return "{} - {}".format(self.code, self.name)
@@ -76,10 +80,26 @@ class InventoryItems(models.Model):
         return round(val, 4)
 
     def availability(self):
+        avl = StockBalance.objects.filter(item_id=self.pk).values_list('available', flat=True).first()
+        if avl is None:
+            from production import ledger
 
-        avl = self.initial + self.purchased() + self.produced() - self.used() - self.delivered() + self.adjustment()
+            ledger.rebuild([self.pk])
+            avl = StockBalance.objects.get(item_id=self.pk).available
         return round(avl, 4)
 
+    def availability_at(self, date):
+        """
+        Stock available at the end of ``date``, from the nearest snapshot onwards.
+        """
+        return round(StockSnapshot.objects.balance_at(self, date), 4)
+
+    def current_cost(self):
+        """
+        Moving average unit cost, the master ``price`` until stock was received.
+        """
+        return ItemCost.objects.costs_for([self.pk]).get(self.pk, self.price)
+
 
 class StockLevel(models.Model):
     STATUS = (
@@ -100,6 +120,12 @@ class StockLevel(models.Model):
         verbose_name = _("1.6. Pembelian Barang")
         verbose_name_plural = _("1.6. Pembelian Barang")
         app_label = 'production'
+        indexes = [
+            models.Index(fields=['item', 'datetime'], name='stocklevel_item_datetime_idx'),
+            models.Index(fields=['datetime', 'id'], name='stocklevel_datetime_id_idx'),
+            models.Index(fields=['status', 'datetime'], name='stocklevel_status_datetime_idx'),
+            models.Index(fields=['delivery_note'], name='stocklevel_delivery_note_idx'),
+        ]
 
     def __str__(self):
         return "{} - {}".format(self.delivery_note, self.item.name)
@@ -128,6 +154,13 @@ class StockMovement(models.Model):
         verbose_name = _("1.7. Pengiriman Barang [ Finished Good ]")
         verbose_name_plural = _("1.7. Pengiriman Barang [ Finisehd Good ]")
         app_label = 'production'
+        indexes = [
+            models.Index(fields=['item', 'datetime'], name='movement_item_datetime_idx'),
+            models.Index(fields=['datetime', 'id'], name='movement_datetime_id_idx'),
+            models.Index(fields=['status', 'datetime'], name='movement_status_datetime_idx'),
+            models.Index(fields=['delivery_order'], name='movement_delivery_order_idx'),
+            models.Index(fields=['jo_number'], name='movement_jo_number_idx'),
+        ]
 
     def __str__(self):
         return "{} - {} - {}".format(self.delivery_order, self.customer.name, self.item.name)
@@ -144,6 +177,174 @@ class InventoryAdjustment(models.Model):
         verbose_name = _("2.1. Penyesuaian / Pemutihan Stock")
         verbose_name_plural = _("2.1. Penyesuaian / Pemutihan Stock")
         app_label = 'production'
+        indexes = [
+            models.Index(fields=['item', 'first_created'], name='adjustment_item_created_idx'),
+        ]
 
     def __str__(self):
         return self.item.name
+
+
+class StockBalance(models.Model):
+    """
+    Running stock balance of an item, one column per movement type.
+
+    Maintained incrementally by ``production.ledger`` on every write to the
+    transaction tables, so reading availability is a single indexed lookup.
+    """
+    # How each movement column contributes to ``available``
+    SIGNS = {
+        'initial': 1,
+        'purchased': 1,
+        'produced': 1,
+        'used': -1,
+        'delivered': -1,
+        'adjustment': 1,
+    }
+    item = models.OneToOneField(InventoryItems, verbose_name=_("Item"), on_delete=models.CASCADE,
+                                related_name='balance')
+    purchased = models.DecimalField(verbose_name=_("Purchased"), decimal_places=4, max_digits=14,
+                                    default=0)
+    produced = models.DecimalField(verbose_name=_("Produced"), decimal_places=4, max_digits=14,
+                                   default=0)
+    used = models.DecimalField(verbose_name=_("Used"), decimal_places=4, max_digits=14, default=0)
+    delivered = models.DecimalField(verbose_name=_("Delivered"), decimal_places=4, max_digits=14,
+                                    default=0)
+    adjustment = models.DecimalField(verbose_name=_("Adjustment"), decimal_places=4, max_digits=14,
+                                     default=0)
+    available = models.DecimalField(verbose_name=_("Available"), decimal_places=4, max_digits=14,
+                                    default=0)
+    objects = StockBalanceManager()
+
+    class Meta:
+        verbose_name = _("2.2. Saldo Stock")
+        verbose_name_plural = _("2.2. Saldo Stock")
+        app_label = 'production'
+
+    def __str__(self):
+        return "{} - {}".format(self.item_id, self.available)
+
+
+class ItemCost(models.Model):
+    """
+    Moving weighted average cost of an item.
+
+    Receipts, returns to suppliers and finished production are valued at
+    their own cost and move the average, every other movement is valued at
+    the current average. Maintained by ``production.costing`` on every write
+    and rebuilt in date order by the ``rebuild_item_costs`` command.
+    """
+    item = models.OneToOneField(InventoryItems, verbose_name=_("Item"), on_delete=models.CASCADE,
+                                related_name='cost')
+    quantity = models.DecimalField(verbose_name=_("Quantity"), decimal_places=4, max_digits=14,
+                                   default=0)
+    average = models.DecimalField(verbose_name=_("Average cost"), decimal_places=4, max_digits=14,
+                                  default=0)
+    value = models.DecimalField(verbose_name=_("Stock value"), decimal_places=4, max_digits=20,
+                                default=0)
+    objects = ItemCostManager()
+
+    class Meta:
+        verbose_name = _("2.6. Harga Pokok Rata-rata")
+        verbose_name_plural = _("2.6. Harga Pokok Rata-rata")
+        app_label = 'production'
+
+    def __str__(self):
+        return "{} - {}".format(self.item_id, self.average)
+
+
+class StockLot(models.Model):
+    """
+    Quantity received by one supplier receipt, or the opening stock of an item.
+
+    Lots are consumed first in first out by ``production.lots``, open lots of
+    an item are read in order from a partial index.
+    """
+    item = models.ForeignKey(InventoryItems, verbose_name=_("Item"), on_delete=models.CASCADE)
+    receipt = models.OneToOneField(StockLevel, verbose_name=_("Receipt"), on_delete=models.CASCADE,
+                                   null=True, blank=True, related_name='lot')
+    received_at = models.DateTimeField(verbose_name=_("Received at"))
+    quantity = models.DecimalField(verbose_name=_("Quantity"), decimal_places=4, max_digits=14)
+    remaining = models.DecimalField(verbose_name=_("Remaining"), decimal_places=4, max_digits=14)
+    objects = StockLotManager()
+
+    class Meta:
+        verbose_name = _("2.7. Lot Stock")
+        verbose_name_plural = _("2.7. Lot Stock")
+        app_label = 'production'
+        indexes = [
+            models.Index(fields=['item', 'received_at', 'id'], name='lot_open_fifo_idx',
+                         condition=models.Q(remaining__gt=0)),
+        ]
+
+    def __str__(self):
+        if self.receipt_id:
+            return "{} - {}".format(self.receipt.delivery_note, self.item_id)
+        return "{} - {}".format(_("Saldo Awal"), self.item_id)
+
+
+class StockSnapshot(models.Model):
+    """
+    Stock balance of an item at the end of ``date``.
+
+    Snapshots are taken periodically by the ``take_stock_snapshot`` command and
+    dropped whenever a transaction dated on or before them changes.
+    """
+    item = models.ForeignKey(InventoryItems, verbose_name=_("Item"), on_delete=models.CASCADE)
+    date = models.DateField(verbose_name=_("Date"))
+    purchased = models.DecimalField(verbose_name=_("Purchased"), decimal_places=4, max_digits=14,
+                                    default=0)
+    produced = models.DecimalField(verbose_name=_("Produced"), decimal_places=4, max_digits=14,
+                                   default=0)
+    used = models.DecimalField(verbose_name=_("Used"), decimal_places=4, max_digits=14, default=0)
+    delivered = models.DecimalField(verbose_name=_("Delivered"), decimal_places=4, max_digits=14,
+                                    default=0)
+    adjustment = models.DecimalField(verbose_name=_("Adjustment"), decimal_places=4, max_digits=14,
+                                     default=0)
+    available = models.DecimalField(verbose_name=_("Available"), decimal_places=4, max_digits=14,
+                                    default=0)
+    objects = StockSnapshotManager()
+
+    class Meta:
+        verbose_name = _("2.3. Snapshot Stock")
+        verbose_name_plural = _("2.3. Snapshot Stock")
+        app_label = 'production'
+        unique_together = ('item', 'date')
+
+    def __str__(self):
+        return "{} - {} - {}".format(self.item_id, self.date, self.available)
+
+
+class DailyItemRollup(models.Model):
+    """
+    Quantities and values moved per item and day.
+
+    Finished goods also carry their production output, so this doubles as the
+    (date, product) rollup. Maintained by ``production.rollups`` on every
+    write and rebuilt by the ``rebuild_rollups`` command.
+    """
+    date = models.DateField(verbose_name=_("Date"))
+    item = models.ForeignKey(InventoryItems, verbose_name=_("Item"), on_delete=models.CASCADE)
+    purchased = models.DecimalField(verbose_name=_("Purchased"), decimal_places=4, max_digits=14,
+                                    default=0)
+    purchased_value = models.DecimalField(verbose_name=_("Purchased value"), decimal_places=4,
+                                          max_digits=20, default=0)
+    delivered = models.DecimalField(verbose_name=_("Delivered"), decimal_places=4, max_digits=14,
+                                    default=0)
+    used = models.DecimalField(verbose_name=_("Used"), decimal_places=4, max_digits=14, default=0)
+    used_value = models.DecimalField(verbose_name=_("Used value"), decimal_places=4,
+                                     max_digits=20, default=0)
+    output = models.DecimalField(verbose_name=_("Output"), decimal_places=4, max_digits=14,
+                                 default=0)
+    output_value = models.DecimalField(verbose_name=_("Output value"), decimal_places=4,
+                                       max_digits=20, default=0)
+    objects = RollupManager()
+
+    class Meta:
+        verbose_name = _("2.4. Rekap Harian Barang")
+        verbose_name_plural = _("2.4. Rekap Harian Barang")
+        app_label = 'production'
+        unique_together = ('date', 'item')
+
+    def __str__(self):
+        return "{} - {}".format(self.date, self.item_id)
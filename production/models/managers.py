@@ -1,9 +1,320 @@
+import datetime
+from decimal import Decimal
+
 from django.db import models
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def _quantity_total(queryset, item_field):
+    """
+    Correlated subquery summing ``quantity`` of ``queryset`` for the outer item.
+    """
+    total = queryset.filter(**{item_field: OuterRef('pk')}).order_by().values(
+        item_field
+    ).annotate(total=Sum('quantity')).values('total')
+    return Coalesce(
+        Subquery(total, output_field=models.DecimalField()), Value(Decimal(0)),
+        output_field=models.DecimalField(max_digits=14, decimal_places=4)
+    )
+
+
+class InventoryItemsQuerySet(models.QuerySet):
+    def light(self):
+        """
+        Items with their unit, enough for lists, lookups and print layouts.
+        """
+        return self.select_related('unit')
+
+    def with_ledger(self):
+        """
+        Items with their unit and stored ``StockBalance`` joined in.
+        """
+        return self.select_related('unit', 'balance')
+
+    def with_history(self, since=None):
+        """
+        Items with their transactions prefetched.
 
+        ``since`` is an aware datetime limiting the prefetched rows to those
+        dated on or after it, by default the whole history is loaded.
+        """
+        from production import ledger
+        from production.models.inventory import StockLevel, StockMovement, InventoryAdjustment
+        from production.models.manufacture import Manufacture, ProductUsage
 
-class InventoryItemsManager(models.Manager):
-    def get_queryset(self):
-        return super().get_queryset().prefetch_related(
-            'stocklevel_set', 'billofmaterial_set', 'billofmaterial_set__manufacture_set',
-            'productusage_set', 'stockmovement_set', 'inventoryadjustment_set'
+        def history(model):
+            queryset = model.objects.all()
+            if since is not None:
+                queryset = queryset.filter(**{ledger.LEDGER_SOURCES[model][2] + '__gte': since})
+            return queryset
+
+        return self.prefetch_related(
+            Prefetch('stocklevel_set', queryset=history(StockLevel)),
+            'billofmaterial_set',
+            Prefetch('billofmaterial_set__manufacture_set', queryset=history(Manufacture)),
+            Prefetch('productusage_set', queryset=history(ProductUsage)),
+            Prefetch('stockmovement_set', queryset=history(StockMovement)),
+            Prefetch('inventoryadjustment_set', queryset=history(InventoryAdjustment)),
+        )
+
+    def with_availability(self):
+        """
+        Annotate stock movement totals and ``available`` in a single statement.
+
+        Every total is a correlated subquery so the result can be sorted and
+        filtered in SQL like a regular column.
+        """
+        from production.models.inventory import StockLevel, StockMovement, InventoryAdjustment
+        from production.models.manufacture import Manufacture, ProductUsage
+
+        return self.annotate(
+            total_purchased=_quantity_total(StockLevel.objects.all(), 'item'),
+            total_produced=_quantity_total(
+                Manufacture.objects.filter(status='done'), 'bill_of_material__product'
+            ),
+            total_used=_quantity_total(ProductUsage.objects.all(), 'item'),
+            total_delivered=_quantity_total(StockMovement.objects.all(), 'item'),
+            total_adjusted=_quantity_total(InventoryAdjustment.objects.all(), 'item'),
+        ).annotate(
+            available=models.ExpressionWrapper(
+                F('initial') + F('total_purchased') + F('total_produced') - F('total_used') -
+                F('total_delivered') + F('total_adjusted'),
+                output_field=models.DecimalField(max_digits=14, decimal_places=4)
+            )
         )
+
+    def availability_for(self, item_ids, lock=False):
+        """
+        Return ``{item_id: available}`` for ``item_ids`` in one query.
+
+        Items without a stored balance yet are rebuilt from history. With
+        ``lock`` the balance rows are locked ``FOR UPDATE`` until the end of
+        the surrounding transaction, see ``StockBalanceManager.lock()``.
+        """
+        from production import ledger
+        from production.models.inventory import StockBalance
+
+        item_ids = set(item_ids)
+        if lock:
+            balances = StockBalance.objects.lock(item_ids)
+        else:
+            balances = dict(
+                StockBalance.objects.filter(item_id__in=item_ids).values_list('item_id', 'available')
+            )
+        missing = item_ids - set(balances)
+        if missing:
+            ledger.rebuild(missing)
+            if lock:
+                balances.update(StockBalance.objects.lock(missing))
+            else:
+                balances.update(StockBalance.objects.filter(item_id__in=missing).values_list(
+                    'item_id', 'available'
+                ))
+        return {pk: round(available, 4) for pk, available in balances.items()}
+
+    def shortages(self, requirements, lock=False, available=None):
+        """
+        Check ``{item_id: required}`` against stock in one query.
+
+        Returns ``{item_id: (required, available)}`` for every item that
+        cannot be fulfilled. Pass ``lock`` to reserve the stock: the checked
+        balances stay locked until the transaction writing the consuming rows
+        commits, so concurrent entries for the same items wait for it and
+        then see the reduced balance. ``available`` is a mapping already read
+        by ``availability_for()``, the check then runs without a query.
+        """
+        if available is None:
+            available = self.availability_for(requirements, lock=lock)
+        short = {}
+        for pk, required in requirements.items():
+            stock = available.get(pk, Decimal(0))
+            if required > stock:
+                short[pk] = (required, stock)
+        return short
+
+
+class InventoryItemsManager(models.Manager.from_queryset(InventoryItemsQuerySet)):
+    """
+    Plain item rows by default, related data is loaded through the
+    ``light()``, ``with_ledger()`` and ``with_history()`` profiles.
+    """
+
+
+class StockBalanceManager(models.Manager):
+    def apply(self, item_id, **deltas):
+        """
+        Shift the stored balance of ``item_id`` by ``deltas``.
+
+        ``deltas`` maps movement columns (and ``initial``) to signed quantities,
+        the update is a single atomic ``UPDATE``. Nothing happens when the item
+        has no balance row yet, it is rebuilt from history on first read.
+        """
+        updates = {}
+        available = 0
+        for field, value in deltas.items():
+            if not value:
+                continue
+            available += self.model.SIGNS[field] * value
+            if field != 'initial':
+                updates[field] = F(field) + value
+
+        if not updates and not available:
+            return 0
+        updates['available'] = F('available') + available
+        return self.filter(item_id=item_id).update(**updates)
+
+    def lock(self, item_ids):
+        """
+        Lock the balances of ``item_ids`` and return ``{item_id: available}``.
+
+        Must run inside a transaction, the rows stay locked until it ends.
+        Rows are locked in item order so transactions reserving overlapping
+        items cannot deadlock, entries for other items are not blocked.
+        """
+        return dict(self.select_for_update().filter(item_id__in=item_ids).order_by(
+            'item_id'
+        ).values_list('item_id', 'available'))
+
+
+class StockSnapshotManager(models.Manager):
+    def balance_at(self, item, date):
+        """
+        Return the quantity of ``item`` available at the end of ``date``.
+
+        Starts from the latest snapshot on or before ``date`` and only scans
+        transactions dated after it.
+        """
+        from production import ledger
+        from production.models.inventory import StockBalance
+
+        signs = StockBalance.SIGNS
+        snapshot = self.filter(item=item, date__lte=date).order_by('-date').first()
+        if snapshot:
+            since = ledger.day_start(snapshot.date + datetime.timedelta(days=1))
+            available = snapshot.available
+        else:
+            since = None
+            available = item.initial
+
+        until = ledger.day_start(date + datetime.timedelta(days=1))
+        totals = ledger.movement_totals(since=since, until=until, items=[item.pk])
+        for column, total in totals.get(item.pk, {}).items():
+            available += signs[column] * total
+        return available
+
+    def take(self, date):
+        """
+        Store the balance of every item at the end of ``date``.
+
+        Items are carried forward from the latest earlier snapshot so only the
+        transactions in between are aggregated. Returns the number of rows.
+        """
+        from production import ledger
+        from production.models.inventory import InventoryItems, StockBalance
+
+        signs = StockBalance.SIGNS
+        columns = [column for column in signs if column != 'initial']
+        until = ledger.day_start(date + datetime.timedelta(days=1))
+
+        base_date = self.filter(date__lt=date).aggregate(last=Max('date'))['last']
+        base = {}
+        if base_date:
+            base = {
+                row['item']: row for row in self.filter(date=base_date).values('item', *columns)
+            }
+            totals = ledger.movement_totals(
+                since=ledger.day_start(base_date + datetime.timedelta(days=1)), until=until
+            )
+        else:
+            totals = ledger.movement_totals(until=until)
+
+        items = InventoryItems.objects.values_list('pk', 'initial')
+        if base:
+            missing = [pk for pk, initial in items if pk not in base]
+            if missing:
+                totals.update(ledger.movement_totals(until=until, items=missing))
+
+        snapshots = []
+        for pk, initial in items.iterator():
+            values = {column: base.get(pk, {}).get(column, 0) for column in columns}
+            for column, total in totals.get(pk, {}).items():
+                values[column] += total
+            values['available'] = initial + sum(signs[column] * values[column] for column in columns)
+            snapshots.append(self.model(item_id=pk, date=date, **values))
+
+        with transaction.atomic():
+            self.filter(date=date).delete()
+            self.bulk_create(snapshots, batch_size=1000)
+        return len(snapshots)
+
+
+class RollupManager(models.Manager):
+    def apply(self, deltas, **keys):
+        """
+        Add ``deltas`` to the columns of the row identified by ``keys``.
+
+        The row is created when missing, a concurrent creation is retried
+        as an update.
+        """
+        deltas = {column: value for column, value in deltas.items() if value}
+        if not deltas:
+            return
+        updates = {column: F(column) + value for column, value in deltas.items()}
+        if self.filter(**keys).update(**updates):
+            return
+        try:
+            with transaction.atomic():
+                self.create(**keys, **deltas)
+        except IntegrityError:
+            self.filter(**keys).update(**updates)
+
+
+class ItemCostManager(models.Manager):
+    def costs_for(self, item_ids):
+        """
+        Return ``{item_id: average}`` for ``item_ids`` in one query.
+
+        Items without a stored cost yet are rebuilt from history.
+        """
+        from production import costing
+
+        item_ids = set(item_ids)
+        costs = dict(self.filter(item_id__in=item_ids).values_list('item_id', 'average'))
+        missing = item_ids - set(costs)
+        if missing:
+            costing.rebuild(missing)
+            costs.update(self.filter(item_id__in=missing).values_list('item_id', 'average'))
+        return costs
+
+    def apply(self, changes):
+        """
+        Move ``{item_id: (quantity, value)}`` in, or out for negative quantities.
+
+        Movements without ``value`` are valued at the current average. Rows are
+        locked in item order and written back with one ``bulk_update``. Items
+        without a stored cost are rebuilt from history instead, these
+        movements included.
+        """
+        from production import costing
+
+        with transaction.atomic(savepoint=False):
+            costs = list(self.select_for_update().filter(item_id__in=changes).order_by('item_id'))
+            for cost in costs:
+                quantity, value = changes[cost.item_id]
+                cost.quantity, cost.average = costing.move(cost.quantity, cost.average,
+                                                           quantity, value)
+                cost.value = costing.quantize(cost.quantity * cost.average)
+            self.bulk_update(costs, ['quantity', 'average', 'value'])
+            missing = set(changes) - {cost.item_id for cost in costs}
+            if missing:
+                costing.rebuild(missing)
+
+
+class StockLotManager(models.Manager):
+    def open(self, item_id):
+        """
+        Lots of ``item_id`` with stock left, oldest first.
+        """
+        return self.filter(item_id=item_id, remaining__gt=0).order_by('received_at', 'id')
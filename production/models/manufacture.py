@@ -4,7 +4,9 @@ from django.utils.translation import  ugettext_lazy as _
 from django.db import models
 
 from production.models.customer import Customer, CustomerCategory
-from production.models.inventory import InventoryItems, UnitMeasurement
+from production.models.inventory import InventoryItems, UnitMeasurement, ItemCost, StockLevel, \
+    StockMovement, StockLot
+from production.models.managers import RollupManager
 
 
 class BillOfMaterial(models.Model):
@@ -53,6 +55,9 @@ class BillOfMaterialDetails(models.Model):
         verbose_name = _("1.8.1 Rincian Formula")
         verbose_name_plural = _("1.8.1 Daftar Rincian Formula")
         app_label = 'production'
+        indexes = [
+            models.Index(fields=['material', 'bill_of_material'], name='bomdetail_material_bom_idx'),
+        ]
 
     def __str__(self):
         return "{} - {}".format(self.bill_of_material, self.material.name)
@@ -80,20 +85,42 @@ class Manufacture(models.Model):
         verbose_name = _("1.9. Produksi")
         verbose_name_plural = _("1.9. Produksi")
         app_label = 'production'
+        indexes = [
+            models.Index(fields=['datetime', 'id'], name='manufacture_datetime_id_idx'),
+            models.Index(fields=['status', 'datetime'], name='manufacture_status_date_idx'),
+            models.Index(fields=['bill_of_material', 'status'], name='manufacture_bom_status_idx'),
+        ]
 
     def __str__(self):
         return "{} - {}".format(self.bill_of_material.code, self.customer.name)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_bill_of_material_id = instance.__dict__.get('bill_of_material_id')
+        return instance
+
     def save(self, *args, **kwargs):
-        product_usages = self.productusage_set.all()
         total_price = 0
-        if product_usages.exists():
-            for i in product_usages:
-                total_price += i.price
-                i.save()
+        if self.pk:
+            product_usages = self.productusage_set.all()
+            unpriced = list(product_usages.filter(price=0).select_related('item'))
+            costs = ItemCost.objects.costs_for({i.item_id for i in unpriced}) if unpriced else {}
+            for i in unpriced:
+                i.price = i.quantity * costs.get(i.item_id, i.item.price)
+            if unpriced:
+                from production import rollups
+
+                ProductUsage.objects.bulk_update(unpriced, ['price'])
+                rollups.record_repriced(unpriced)
+            total_price = product_usages.aggregate(total=models.Sum('price'))['total'] or 0
         self.price = total_price
-        self.bom_output_standard = self.bill_of_material.output_weight()
+
+        formula_changed = self.bill_of_material_id != getattr(self, '_loaded_bill_of_material_id', None)
+        if formula_changed or not self.bom_output_standard:
+            self.bom_output_standard = self.bill_of_material.output_weight()
         super().save(*args, **kwargs)
+        self._loaded_bill_of_material_id = self.bill_of_material_id
 
     def _product_name(self):
         return self.bill_of_material.product.name
@@ -112,11 +139,68 @@ class ProductUsage(models.Model):
         verbose_name = _("2.0. Penggunaan Barang")
         verbose_name_plural = _("2.0. Daftar Penggunaan Barang")
         app_label = 'production'
+        indexes = [
+            models.Index(fields=['manufacture', 'item'], name='usage_manufacture_item_idx'),
+        ]
 
     def __str__(self):
         return "{} - {}".format(self.item.name, self.manufacture.bill_of_material.product.name)
 
     def save(self, *args, **kwargs):
         if not self.price:
-            self.price = self.quantity * self.item.price
+            self.price = self.quantity * self.item.current_cost()
         super().save(*args, **kwargs)
+
+
+class LotConsumption(models.Model):
+    """
+    Quantity taken from a lot by a usage, a delivery or a return to the supplier.
+
+    ``lot`` is empty for the part no open lot was left for.
+    """
+    lot = models.ForeignKey(StockLot, verbose_name=_("Lot"), on_delete=models.SET_NULL, null=True,
+                            blank=True, related_name='consumptions')
+    item = models.ForeignKey(InventoryItems, verbose_name=_("Item"), on_delete=models.CASCADE,
+                             related_name='+')
+    usage = models.ForeignKey(ProductUsage, verbose_name=_("Usage"), on_delete=models.CASCADE,
+                              null=True, blank=True, related_name='lot_consumptions')
+    movement = models.ForeignKey(StockMovement, verbose_name=_("Delivery"),
+                                 on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='lot_consumptions')
+    returned = models.ForeignKey(StockLevel, verbose_name=_("Return"), on_delete=models.CASCADE,
+                                 null=True, blank=True, related_name='lot_consumptions')
+    quantity = models.DecimalField(verbose_name=_("Quantity"), decimal_places=4, max_digits=14)
+
+    class Meta:
+        verbose_name = _("2.8. Pemakaian Lot")
+        verbose_name_plural = _("2.8. Pemakaian Lot")
+        app_label = 'production'
+
+    def __str__(self):
+        return "{} - {}".format(self.lot_id, self.quantity)
+
+
+class DailyUsageRollup(models.Model):
+    """
+    Material used per product, material and day.
+
+    Maintained by ``production.rollups`` alongside ``DailyItemRollup``.
+    """
+    date = models.DateField(verbose_name=_("Date"))
+    product = models.ForeignKey(InventoryItems, verbose_name=_("Product"), on_delete=models.CASCADE,
+                                related_name='+')
+    item = models.ForeignKey(InventoryItems, verbose_name=_("Item"), on_delete=models.CASCADE,
+                             related_name='+')
+    quantity = models.DecimalField(verbose_name=_("Quantity"), decimal_places=4, max_digits=14,
+                                   default=0)
+    value = models.DecimalField(verbose_name=_("Value"), decimal_places=4, max_digits=20, default=0)
+    objects = RollupManager()
+
+    class Meta:
+        verbose_name = _("2.5. Rekap Harian Penggunaan Barang")
+        verbose_name_plural = _("2.5. Rekap Harian Penggunaan Barang")
+        app_label = 'production'
+        unique_together = ('date', 'product', 'item')
+
+    def __str__(self):
+        return "{} - {} - {}".format(self.date, self.product_id, self.item_id)
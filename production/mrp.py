@@ -0,0 +1,152 @@
+"""
+Material requirements planning over open manufacture orders.
+
+Orders are grouped per formula in SQL, each formula contributes its
+requirement vector scaled by the ordered quantity, and the resulting gross
+requirements are netted against stock in one lookup. The number of queries
+does not depend on the number of orders.
+
+Nested planning explodes finished goods used as materials level by level,
+ordered by their low level code: the gross requirement of such a good is
+netted against its own stock first and only the shortfall is passed on to
+the materials of its formula.
+"""
+import datetime
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.db.models import Sum
+
+from production import bom, ledger
+from production.models.inventory import InventoryItems
+from production.models.manufacture import Manufacture, ProductUsage
+
+
+OPEN_STATUSES = ('pending', 'on_going')
+
+PlanningLine = namedtuple(
+    'PlanningLine', ['item_id', 'code', 'name', 'unit', 'required', 'available', 'short']
+)
+
+
+def open_orders(start_date=None, end_date=None):
+    """
+    Manufacture orders still to be produced, optionally dated within a range.
+    """
+    orders = Manufacture.objects.filter(status__in=OPEN_STATUSES)
+    if start_date:
+        orders = orders.filter(datetime__gte=ledger.day_start(start_date))
+    if end_date:
+        orders = orders.filter(datetime__lt=ledger.day_start(end_date + datetime.timedelta(days=1)))
+    return orders
+
+
+def ordered_quantities(orders):
+    """
+    Return ``{bom_id: quantity}`` ordered per formula.
+    """
+    return dict(
+        orders.order_by().values_list('bill_of_material').annotate(total=Sum('quantity'))
+    )
+
+
+def gross_requirements(per_formula):
+    """
+    Return ``{item_id: quantity}`` required by the formulas' own lines to
+    produce ``{bom_id: quantity}``, the way ``ManufactureAdmin`` issues them.
+    """
+    vectors = bom.direct_vectors(per_formula)
+    required = defaultdict(Decimal)
+    for bom_id, quantity in per_formula.items():
+        for item_id, per_unit in vectors[bom_id].items():
+            required[item_id] += per_unit * quantity
+    return required
+
+
+def low_level_codes(bom_ids, details, formula):
+    """
+    Return ``{item_id: level}``, the deepest level an item is used at below
+    the formulas ``bom_ids``, their own materials being level 0.
+    """
+    levels = {}
+
+    def visit(bom_id, depth, path):
+        if bom_id in path:
+            raise bom.BOMCycleError(path[path.index(bom_id):] + (bom_id,))
+        for material_id, quantity in details[bom_id]:
+            if levels.get(material_id, -1) < depth:
+                levels[material_id] = depth
+                if formula.get(material_id):
+                    visit(formula[material_id], depth + 1, path + (bom_id,))
+
+    for bom_id in bom_ids:
+        visit(bom_id, 0, ())
+    return levels
+
+
+def net_requirements(required, bom_ids):
+    """
+    Explode the finished goods in ``required`` level by level.
+
+    A finished good made by a formula is netted against its stock once all
+    the levels above it added their requirement, only the shortfall is
+    exploded into the materials of its formula. Returns ``(required,
+    available)``, the former holding the gross requirement of every item at
+    any level.
+    """
+    details, formula = bom.load_tree(bom_ids)
+    levels = low_level_codes(bom_ids, details, formula)
+    required = defaultdict(Decimal, required)
+    available = InventoryItems.objects.availability_for(set(levels) | set(required))
+    for item_id in sorted(levels, key=levels.get):
+        shortfall = required[item_id] - max(available.get(item_id, Decimal(0)), Decimal(0))
+        if formula.get(item_id) and shortfall > 0:
+            for material_id, per_unit in bom.per_unit(details[formula[item_id]]).items():
+                required[material_id] += shortfall * per_unit
+    return {item_id: quantity for item_id, quantity in required.items() if quantity > 0}, available
+
+
+def issued(orders):
+    """
+    Return ``{item_id: quantity}`` already recorded as usage of ``orders``.
+
+    Those quantities are deducted from stock already and must not be
+    counted twice.
+    """
+    return dict(
+        ProductUsage.objects.filter(manufacture__in=orders).order_by().values_list(
+            'item'
+        ).annotate(total=Sum('quantity'))
+    )
+
+
+def run(start_date=None, end_date=None, nested=False, shortages_only=True):
+    """
+    Plan the open orders and return a list of ``PlanningLine`` sorted by item code.
+    """
+    orders = open_orders(start_date, end_date)
+    per_formula = ordered_quantities(orders)
+    required = gross_requirements(per_formula)
+    already_issued = issued(orders)
+    outstanding = {}
+    for item_id, quantity in required.items():
+        outstanding[item_id] = max(round(quantity - already_issued.get(item_id, 0), 4), Decimal(0))
+
+    if nested:
+        outstanding, available = net_requirements(outstanding, per_formula)
+        outstanding = {item_id: round(quantity, 4) for item_id, quantity in outstanding.items()}
+    else:
+        available = InventoryItems.objects.availability_for(outstanding)
+    items = InventoryItems.objects.light().filter(pk__in=outstanding).only(
+        'code', 'name', 'unit__name'
+    )
+
+    lines = []
+    for item in items:
+        stock = available.get(item.pk, Decimal(0))
+        short = max(outstanding[item.pk] - max(stock, Decimal(0)), Decimal(0))
+        if short or not shortages_only:
+            lines.append(PlanningLine(
+                item.pk, item.code, item.name, item.unit.name, outstanding[item.pk], stock, short
+            ))
+    return sorted(lines, key=lambda line: line.code)
@@ -0,0 +1,177 @@
+"""
+Changelist pagination of the large transaction tables.
+
+``KeysetChangeList`` walks the admin ``ordering`` (``datetime`` then ``id``)
+with a cursor holding the values of the last row shown instead of an OFFSET.
+Receipts, deliveries and manufactures read ``list_per_page`` rows from their
+``(datetime, id)`` index however deep the page is. Usages are ordered by the
+datetime of their manufacture, no index covers that join, so a page still
+sorts the usages of the manufactures past the cursor, but never the rows
+before it. Sorting on a column falls back to numbered pages.
+
+``EstimatedCountPaginator`` takes the row count of large results from the
+PostgreSQL planner instead of counting them, "Show all" renders at most
+``list_max_show_all`` rows, more is for the streaming export.
+"""
+import json
+
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+
+# Planner estimates below this are replaced by an exact count
+EXACT_COUNT_LIMIT = 10000
+
+SHOW_ALL_LIMIT = 1000
+
+
+def estimated_count(queryset):
+    """
+    Return the planner estimate of the rows of ``queryset``, ``None`` when the
+    database cannot tell.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator counting large querysets with the planner estimate.
+    """
+    estimated = False
+
+    @cached_property
+    def count(self):
+        if hasattr(self.object_list, 'query'):
+            estimate = estimated_count(self.object_list)
+            if estimate is not None and estimate >= EXACT_COUNT_LIMIT:
+                self.estimated = True
+                return estimate
+        return super().count
+
+
+def _field(model, path):
+    for name in path.split('__'):
+        field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        model = field.related_model
+    return field
+
+
+def keyset_filter(ordering, values, forward=True):
+    """
+    Q of the rows after ``values`` in ``ordering``, or before them.
+    """
+    names = [field.lstrip('-') for field in ordering]
+    lookups = ['lt' if field.startswith('-') == forward else 'gt' for field in ordering]
+    condition = Q()
+    for i, name in enumerate(names):
+        condition |= Q(**dict(zip(names[:i], values[:i])), **{name + '__' + lookups[i]: values[i]})
+    # a bound on the leading column alone lets the index range scan
+    return Q(**{'{}__{}e'.format(names[0], lookups[0]): values[0]}) & condition
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Changelist paged by cursor while sorted by the admin ``ordering``.
+
+    ``?after=`` shows the page following a row, ``?before=`` the page
+    preceding it, the cursor being the row's ordering values joined by commas.
+    """
+    keyset = False
+    keyset_first = keyset_previous = keyset_next = None
+    count_estimated = False
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(AFTER_VAR, None)
+        lookup_params.pop(BEFORE_VAR, None)
+        return lookup_params
+
+    def encode_cursor(self, values):
+        return ','.join(value.isoformat() if hasattr(value, 'isoformat') else str(value)
+                        for value in values)
+
+    def decode_cursor(self, cursor, ordering):
+        parts = cursor.split(',')
+        if len(parts) != len(ordering):
+            raise IncorrectLookupParameters(cursor)
+        try:
+            return [_field(self.model, name.lstrip('-')).to_python(part)
+                    for name, part in zip(ordering, parts)]
+        except ValidationError as e:
+            raise IncorrectLookupParameters(e)
+
+    def get_results(self, request):
+        after = self.params.pop(AFTER_VAR, None)
+        before = self.params.pop(BEFORE_VAR, None)
+        ordering = self.model_admin.get_ordering(request)
+        if self.show_all or ORDER_VAR in self.params or not ordering:
+            super().get_results(request)
+            if self.show_all and self.can_show_all:
+                self.result_list = self.queryset[:self.list_max_show_all]
+            self.count_estimated = getattr(self.paginator, 'estimated', False)
+            return
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        if self.model_admin.show_full_result_count:
+            self.full_result_count = self.root_queryset.count()
+        else:
+            self.full_result_count = None
+        self.result_count = paginator.count
+        self.count_estimated = getattr(paginator, 'estimated', False)
+        self.show_full_result_count = self.model_admin.show_full_result_count
+        self.show_admin_actions = not self.show_full_result_count or bool(self.full_result_count)
+        self.can_show_all = self.result_count <= self.list_max_show_all
+        self.paginator = paginator
+        self.keyset = True
+
+        rows, more = self.keyset_rows(ordering, before or after, forward=not before)
+        if before and not more:
+            # fewer than a page before the cursor, show the first page instead
+            before = None
+            rows, more = self.keyset_rows(ordering, None)
+        self.result_list = self.queryset.filter(pk__in=[row[0] for row in rows])
+        self.multi_page = bool(more or before or after)
+        if before or after:
+            self.keyset_first = self.get_query_string()
+        has_previous = more if before else bool(after)
+        if rows and has_previous:
+            self.keyset_previous = self.get_query_string({BEFORE_VAR: self.encode_cursor(rows[0][1:])})
+        if rows and (before or more):
+            self.keyset_next = self.get_query_string({AFTER_VAR: self.encode_cursor(rows[-1][1:])})
+
+    def keyset_rows(self, ordering, cursor, forward=True):
+        """
+        Return the ``(pk, *ordering values)`` of the page next to ``cursor``
+        in ``ordering`` order, and whether more rows follow in that direction.
+        """
+        queryset = self.queryset
+        if cursor:
+            queryset = queryset.filter(keyset_filter(ordering, self.decode_cursor(cursor, ordering),
+                                                     forward))
+        if not forward:
+            queryset = queryset.reverse()
+        rows = list(queryset.values_list('pk', *[field.lstrip('-') for field in ordering])[
+            :self.list_per_page + 1
+        ])
+        more = len(rows) > self.list_per_page
+        rows = rows[:self.list_per_page]
+        if not forward:
+            rows.reverse()
+        return rows, more
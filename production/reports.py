@@ -0,0 +1,124 @@
+"""
+Loading of report rows into pandas.
+
+Rows are fetched once through ``values_list`` over a server side cursor and
+transposed straight into one typed array per column, every pivot of a report
+is then computed from the same ``DataFrame``.
+
+Results of reports over a date range can be cached with ``cached()``. Every
+day carries a version token which is renewed by ``invalidate()`` when a row
+dated that day is written, an entry is only served while the tokens of all
+days in its range are unchanged. ``invalidate_all()`` renews a token shared
+by every entry, for changes such as item renames which are not dated.
+Tokens are renewed once the writing transaction committed, so a report
+built meanwhile from the previous rows is never stored under a new token.
+
+Tokens and entries live in the ``default`` cache, which must be shared by all
+the processes serving the site, see ``production.checks``.
+"""
+import datetime
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+
+CHUNK_SIZE = 2000
+
+CACHE_PREFIX = 'production:report:'
+
+DAY_VERSION_PREFIX = 'production:report-day:'
+
+GENERATION_KEY = 'production:report-generation'
+
+
+def data_frame(queryset, columns, numeric=('quantity',)):
+    """
+    Return a ``DataFrame`` of ``columns``, a ``{name: lookup}`` mapping.
+
+    Lookups may span relations and use transforms, e.g. ``datetime__date``.
+    ``numeric`` columns are loaded as ``float``.
+    """
+    names = list(columns)
+    rows = queryset.values_list(*columns.values()).iterator(chunk_size=CHUNK_SIZE)
+    arrays = list(zip(*rows)) or [()] * len(names)
+    data = {}
+    for name, values in zip(names, arrays):
+        data[name] = np.array(values, dtype=float if name in numeric else object)
+    return pd.DataFrame(data, columns=names)
+
+
+def pivot_html(data_frame, index, values='quantity', aggfunc=np.sum):
+    """
+    Pivot ``data_frame`` rounded to 3 decimals and render it for the PDF layouts.
+    """
+    pivot = pd.pivot_table(
+        data_frame.round(3),
+        index=index,
+        values=values,
+        aggfunc=aggfunc,
+        fill_value=0
+    )
+    return pivot.to_html(classes=['minimalistBlack'])
+
+
+def _day_keys(start_date, end_date):
+    days = (end_date - start_date).days + 1
+    return ['{}{}'.format(DAY_VERSION_PREFIX, start_date + datetime.timedelta(days=i))
+            for i in range(max(days, 0))]
+
+
+def _day_versions(day_keys):
+    versions = cache.get_many(day_keys)
+    missing = [key for key in day_keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in day_keys]
+
+
+def cached(name, start_date, end_date, build):
+    """
+    Return ``build()`` for report ``name`` over ``[start_date, end_date]``.
+
+    The result is cached until ``invalidate()`` is called for a date in the range.
+    """
+    key = '{}{}:{}:{}'.format(CACHE_PREFIX, name, start_date, end_date)
+    day_keys = [GENERATION_KEY] + _day_keys(start_date, end_date)
+    versions = _day_versions(day_keys)
+    entry = cache.get(key)
+    if entry is not None and entry[0] == versions and None not in versions:
+        return entry[1]
+
+    result = build()
+    cache.set(key, (versions, result), timeout=None)
+    return result
+
+
+def _renew(keys):
+    cache.set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+
+
+def invalidate(*moments):
+    """
+    Expire cached reports covering the local dates of the aware datetimes ``moments``.
+
+    The tokens are renewed once the current transaction commits, a report
+    built from the rows before it would otherwise be stored as current.
+    """
+    keys = {'{}{}'.format(DAY_VERSION_PREFIX, timezone.localtime(moment).date())
+            for moment in moments if moment}
+    if keys:
+        transaction.on_commit(lambda: _renew(keys))
+
+
+def invalidate_all():
+    """
+    Expire every cached report once the current transaction commits.
+    """
+    transaction.on_commit(lambda: _renew([GENERATION_KEY]))
@@ -1,8 +1,29 @@
+import csv
+import io
+import logging
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db import connections, models
+from django.db.models import F
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+from import_export.instance_loaders import CachedInstanceLoader
 from import_export.resources import ModelResource
 from import_export.fields import Field
+from import_export.widgets import ForeignKeyWidget
 
+from production import bookkeeping, ledger, metrics
+from production.models.customer import Customer, Supplier
 from production.models.manufacture import Manufacture, ProductUsage
-from production.models.inventory import StockMovement
+from production.models.inventory import InventoryItems, UnitMeasurement, StockLevel, \
+    StockMovement, StockBalance
+
+
+logger = logging.getLogger(__name__)
 
 
 class ManufactureExportResource(ModelResource):
@@ -49,3 +70,209 @@ class StockMovementExportResource(ModelResource):
     class Meta:
         model = StockMovement
         fields = ('',)
+
+
+class PreloadedForeignKeyWidget(ForeignKeyWidget):
+    """
+    ``ForeignKeyWidget`` resolving values from objects fetched once per file.
+    """
+    def __init__(self, model, field='pk', *args, **kwargs):
+        super().__init__(model, field, *args, **kwargs)
+        self.objects = {}
+
+    def preload(self, values):
+        if self.field == 'pk':
+            lookup_field = self.model._meta.pk
+        else:
+            lookup_field = self.model._meta.get_field(self.field)
+        keys = set()
+        for value in values:
+            try:
+                keys.add(lookup_field.to_python(value))
+            except ValidationError:
+                continue
+        keys.discard(None)
+        self.objects = {
+            str(getattr(obj, self.field)): obj
+            for obj in self.get_queryset(None, None).filter(**{self.field + '__in': keys})
+        }
+
+    def clean(self, value, row=None, *args, **kwargs):
+        obj = self.objects.get(str(value))
+        if obj is not None:
+            return obj
+        return super().clean(value, row, *args, **kwargs)
+
+
+def copy_insert(model, objs, using):
+    """
+    Insert ``objs`` with a single PostgreSQL ``COPY ... FROM STDIN``.
+    """
+    connection = connections[using]
+    fields = [f for f in model._meta.concrete_fields if not isinstance(f, models.AutoField)]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for obj in objs:
+        row = []
+        for field in fields:
+            value = field.get_db_prep_save(field.pre_save(obj, True), connection)
+            row.append('\\N' if value is None else value)
+        writer.writerow(row)
+    buffer.seek(0)
+
+    quote = connection.ops.quote_name
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(
+        quote(model._meta.db_table), ', '.join(quote(f.column) for f in fields)
+    )
+    with connection.cursor() as cursor:
+        cursor.copy_expert(sql, buffer)
+
+
+class StockTransactionResource(ModelResource):
+    """
+    Bulk import of stock transactions.
+
+    The whole file is checked against availability before a row is written,
+    rows are inserted with ``bulk_create``, or ``COPY`` on PostgreSQL, and the
+    balance and cost of every touched item and the daily rollups of the
+    imported dates are rebuilt once at the end, all in one transaction.
+    Signals are not sent for imported rows.
+    """
+    item = Field(attribute='item', column_name='item',
+                 widget=PreloadedForeignKeyWidget(InventoryItems))
+    unit = Field(attribute='unit', column_name='unit',
+                 widget=PreloadedForeignKeyWidget(UnitMeasurement))
+
+    class Meta:
+        use_bulk = True
+        use_transactions = True
+        skip_diff = True
+        instance_loader_class = CachedInstanceLoader
+
+    def signed_quantity(self, status, quantity):
+        """
+        Return ``quantity`` with the sign stored for ``status``.
+        """
+        return quantity
+
+    def stock_direction(self):
+        """
+        Return 1 when rows of this model consume stock, -1 when they add to it.
+        """
+        return -StockBalance.SIGNS[ledger.LEDGER_COLUMNS[self._meta.model]]
+
+    def stored_rows(self, dataset):
+        """
+        Return ledger values of the rows of ``dataset`` which already exist.
+        """
+        id_field = self.fields['id']
+        if id_field.column_name not in dataset.headers:
+            return {}
+        ids = set()
+        for row in dataset.dict:
+            try:
+                ids.add(id_field.clean(row))
+            except ValueError:
+                continue
+        ids.discard(None)
+        return {
+            values.pop('pk'): values
+            for values in self._meta.model.objects.filter(pk__in=ids).values(
+                'pk', 'quantity', item_pk=F('item'), moved_at=F('datetime')
+            )
+        }
+
+    def before_import(self, dataset, using_transactions, dry_run, **kwargs):
+        self.started = time.perf_counter()
+        for field in self.get_import_fields():
+            if isinstance(field.widget, PreloadedForeignKeyWidget) and \
+                    field.column_name in dataset.headers:
+                field.widget.preload(dataset[field.column_name])
+
+        self.previous = self.stored_rows(dataset)
+        self.written = []
+        direction = self.stock_direction()
+        consumption = defaultdict(Decimal)
+        for row in dataset.dict:
+            try:
+                item = self.fields['item'].clean(row)
+                quantity = self.signed_quantity(row.get('status'), self.fields['quantity'].clean(row))
+            except (ValueError, TypeError, ArithmeticError, ObjectDoesNotExist, ValidationError):
+                continue
+            if item is not None and quantity is not None:
+                consumption[item.pk] += direction * quantity
+        for values in self.previous.values():
+            consumption[values['item_pk']] -= direction * values['quantity']
+
+        self.shortages = InventoryItems.objects.shortages(
+            {item_id: quantity for item_id, quantity in consumption.items() if quantity > 0},
+            lock=using_transactions and not dry_run
+        )
+
+    def validate_instance(self, instance, import_validation_errors=None, validate_unique=True):
+        errors = dict(import_validation_errors or {})
+        if instance.item_id in self.shortages:
+            errors.setdefault(
+                'quantity', ValidationError(_("Jumlah stock yang tersedia tidak mencukupi"))
+            )
+        super().validate_instance(instance, errors, validate_unique)
+
+    def before_save_instance(self, instance, using_transactions, dry_run):
+        instance.quantity = self.signed_quantity(instance.status, instance.quantity)
+
+    def after_save_instance(self, instance, using_transactions, dry_run):
+        self.written.append(ledger.instance_values(instance))
+
+    def bulk_create(self, using_transactions, dry_run, raise_errors, batch_size=None):
+        using = self.get_db_connection_name()
+        if connections[using].vendor != 'postgresql' or (dry_run and not using_transactions):
+            return super().bulk_create(using_transactions, dry_run, raise_errors, batch_size)
+        try:
+            if self.create_instances:
+                copy_insert(self._meta.model, self.create_instances, using)
+        except Exception as e:
+            logger.exception(e)
+            if raise_errors:
+                raise e
+        finally:
+            self.create_instances.clear()
+
+    def after_import(self, dataset, result, using_transactions, dry_run, **kwargs):
+        if not dry_run or using_transactions:
+            values = self.written + list(self.previous.values())
+            if values:
+                dates = {timezone.localtime(value['moved_at']).date() for value in values}
+                bookkeeping.rebuild({value['item_pk'] for value in values}, min(dates), max(dates))
+        if not dry_run:
+            model = self._meta.model._meta.label_lower
+            metrics.IMPORT_ROWS.labels(model).inc(len(self.written))
+            metrics.IMPORT_SECONDS.labels(model).observe(time.perf_counter() - self.started)
+        super().after_import(dataset, result, using_transactions, dry_run, **kwargs)
+
+
+class StockLevelImportResource(StockTransactionResource):
+    supplier = Field(attribute='supplier', column_name='supplier',
+                     widget=PreloadedForeignKeyWidget(Supplier))
+
+    class Meta(StockTransactionResource.Meta):
+        model = StockLevel
+
+    def signed_quantity(self, status, quantity):
+        if status == 'return' and quantity > 0:
+            return -quantity
+        return quantity
+
+
+class StockMovementImportResource(StockTransactionResource):
+    customer = Field(attribute='customer', column_name='customer',
+                     widget=PreloadedForeignKeyWidget(Customer))
+
+    class Meta(StockTransactionResource.Meta):
+        model = StockMovement
+
+    def signed_quantity(self, status, quantity):
+        if status == 'return' and quantity > 0:
+            return -quantity
+        if status == 'sent' and quantity < 0:
+            return -quantity
+        return quantity
@@ -0,0 +1,202 @@
+"""
+Incremental maintenance of the daily rollups.
+
+Every transaction row adds its quantity and value to the ``DailyItemRollup``
+row of its item and local date, usages also to the ``DailyUsageRollup`` row
+of their product. Writes post the difference between the previous and the
+new contribution of a row, one ``UPDATE`` per rollup row touched.
+
+Raw (fixture) saves are not followed, run ``rebuild_rollups`` after loading data.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from production import ledger, reports
+from production.models.inventory import StockLevel, StockMovement, DailyItemRollup
+from production.models.manufacture import Manufacture, ProductUsage, DailyUsageRollup
+
+
+# Values fetched along with ``ledger.stored_values``
+EXTRA_VALUES = {
+    StockLevel: {'cost': F('quantity') * F('price')},
+    StockMovement: {},
+    ProductUsage: {'cost': F('price'), 'product_pk': F('manufacture__bill_of_material__product')},
+    Manufacture: {'cost': F('price')},
+}
+
+# model: [(rollup, {rollup key: value}, {rollup column: value})]
+ROLLUPS = {
+    StockLevel: [
+        (DailyItemRollup, {'item_id': 'item_pk'}, {'purchased': 'quantity', 'purchased_value': 'cost'}),
+    ],
+    StockMovement: [
+        (DailyItemRollup, {'item_id': 'item_pk'}, {'delivered': 'quantity'}),
+    ],
+    ProductUsage: [
+        (DailyItemRollup, {'item_id': 'item_pk'}, {'used': 'quantity', 'used_value': 'cost'}),
+        (DailyUsageRollup, {'product_id': 'product_pk', 'item_id': 'item_pk'},
+         {'quantity': 'quantity', 'value': 'cost'}),
+    ],
+    Manufacture: [
+        (DailyItemRollup, {'item_id': 'item_pk'}, {'output': 'quantity', 'output_value': 'cost'}),
+    ],
+}
+
+VALUE_PLACES = Decimal('0.0001')
+
+
+def _quantize(value):
+    return Decimal(value or 0).quantize(VALUE_PLACES, rounding=ROUND_HALF_UP)
+
+
+def stored_values(model, pk):
+    return ledger.stored_values(model, pk, **EXTRA_VALUES[model])
+
+
+def instance_values(instance):
+    """
+    Return the rollup relevant values of an unsaved or saved ``instance``.
+    """
+    values = ledger.instance_values(instance)
+    if isinstance(instance, StockLevel):
+        values['cost'] = instance.quantity * instance.price
+    elif isinstance(instance, ProductUsage):
+        values['cost'] = instance.price
+        values['product_pk'] = instance.manufacture.bill_of_material.product_id
+    elif isinstance(instance, Manufacture):
+        values['cost'] = instance.price
+    return values
+
+
+def entries(model, values):
+    """
+    Return ``{(rollup, keys): {column: amount}}`` contributed by one row of ``model``.
+    """
+    if not values:
+        return {}
+    date = timezone.localtime(values['moved_at']).date()
+    contributions = {}
+    for rollup, keys, columns in ROLLUPS[model]:
+        key = (rollup, (('date', date),) + tuple(
+            (field, values[name]) for field, name in keys.items()
+        ))
+        contributions[key] = {column: _quantize(values[name]) for column, name in columns.items()}
+    return contributions
+
+
+def post(changes):
+    """
+    Apply ``{(rollup, keys): {column: delta}}``, one update per rollup row.
+    """
+    for (rollup, keys), deltas in changes.items():
+        rollup.objects.apply(deltas, **dict(keys))
+
+
+def record_changes(model, previous, current):
+    """
+    Post the difference between the ``previous`` and ``current`` values of rows.
+    """
+    changes = defaultdict(lambda: defaultdict(Decimal))
+    for values, sign in [(value, 1) for value in current] + [(value, -1) for value in previous]:
+        for key, amounts in entries(model, values).items():
+            for column, amount in amounts.items():
+                changes[key][column] += sign * amount
+    post(changes)
+
+
+def record_change(model, previous, current):
+    record_changes(model, [previous], [current])
+
+
+def record_created(model, objs):
+    """
+    Post rows written without signals, e.g. through ``bulk_create``.
+    """
+    record_changes(model, [], [instance_values(obj) for obj in objs])
+
+
+def record_manufacture_moved(pk, previous, current):
+    """
+    Usages are dated by their manufacture and rolled up under its product,
+    moving it or changing its formula moves their contributions too.
+    """
+    if not previous or (previous['moved_at'], previous['item_pk']) == (
+            current['moved_at'], current['item_pk']):
+        return
+    totals = ProductUsage.objects.filter(manufacture=pk).order_by().values('item').annotate(
+        total_quantity=Sum('quantity'), total_cost=Sum('price')
+    )
+    moved = [{'item_pk': total['item'], 'quantity': total['total_quantity'],
+              'cost': total['total_cost']} for total in totals]
+    record_changes(
+        ProductUsage,
+        [dict(values, moved_at=previous['moved_at'], product_pk=previous['item_pk'])
+         for values in moved],
+        [dict(values, moved_at=current['moved_at'], product_pk=current['item_pk'])
+         for values in moved]
+    )
+
+
+def record_repriced(usages):
+    """
+    Post usages priced after they were written, their previous value was 0.
+    """
+    current = [instance_values(usage) for usage in usages]
+    record_changes(ProductUsage, [dict(values, cost=0) for values in current], current)
+
+
+def rebuild(start_date=None, end_date=None):
+    """
+    Recompute the rollups of ``[start_date, end_date]`` from the transactions.
+
+    Either date may be omitted to leave the range open. Cached reports are
+    expired. Returns the number of rollup rows written.
+    """
+    rows = defaultdict(lambda: defaultdict(Decimal))
+    for model, sources in ROLLUPS.items():
+        column, item_field, datetime_field = ledger.LEDGER_SOURCES[model]
+        queryset = model.objects.all()
+        if start_date is not None:
+            queryset = queryset.filter(**{datetime_field + '__gte': ledger.day_start(start_date)})
+        if end_date is not None:
+            queryset = queryset.filter(**{
+                datetime_field + '__lt': ledger.day_start(end_date + datetime.timedelta(days=1))
+            })
+
+        extra = EXTRA_VALUES[model]
+        keys = {name: extra.get(name, F(item_field)) for rollup, fields, columns in sources
+                for name in fields.values()}
+        sums = {'total_' + name: Sum(extra.get(name, F(name))) for rollup, fields, columns in sources
+                for name in columns.values()}
+        totals = queryset.order_by().values(
+            moved_on=TruncDate(datetime_field), **keys
+        ).annotate(**sums)
+        for total in totals:
+            for rollup, fields, columns in sources:
+                key = (rollup, (('date', total['moved_on']),) + tuple(
+                    (field, total[name]) for field, name in fields.items()
+                ))
+                for column, name in columns.items():
+                    rows[key][column] += _quantize(total['total_' + name])
+
+    objs = defaultdict(list)
+    for (rollup, keys), columns in rows.items():
+        objs[rollup].append(rollup(**dict(keys), **columns))
+
+    with transaction.atomic():
+        for rollup in (DailyItemRollup, DailyUsageRollup):
+            queryset = rollup.objects.all()
+            if start_date is not None:
+                queryset = queryset.filter(date__gte=start_date)
+            if end_date is not None:
+                queryset = queryset.filter(date__lte=end_date)
+            queryset.delete()
+            rollup.objects.bulk_create(objs[rollup], batch_size=1000)
+    reports.invalidate_all()
+    return sum(len(items) for items in objs.values())
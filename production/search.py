@@ -0,0 +1,250 @@
+"""
+Autocomplete search of the lookup models.
+
+Candidates are found through an index, then ranked with fuzzywuzzy so exact
+codes come first and misspelt names are still found. On PostgreSQL the
+searched columns carry ``pg_trgm`` GIN indexes (migration 0008) which serve
+both ``icontains`` and the ``%`` similarity operator. Other databases use an
+in-process n-gram index per model, built on first use and rebuilt after the
+model changed, tracked by a version token in the ``default`` cache. The
+cache must be shared by every process serving the site (``production.checks``
+warns otherwise), a process local cache would keep serving stale indexes.
+"""
+import heapq
+import uuid
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import connection, models, transaction
+from django.db.models import Q
+
+from fuzzywuzzy import fuzz
+
+from production.models.customer import Customer, CustomerCategory, Supplier
+from production.models.inventory import UnitMeasurement, InventoryItems
+from production.models.manufacture import BillOfMaterial
+
+
+SEARCH_FIELDS = {
+    InventoryItems: ('code', 'name'),
+    BillOfMaterial: ('code', 'color_name', 'product__name'),
+    Customer: ('name',),
+    CustomerCategory: ('name',),
+    Supplier: ('name',),
+    UnitMeasurement: ('name',),
+}
+
+# Models whose search text includes fields of the key model
+DEPENDENTS = {
+    InventoryItems: [BillOfMaterial],
+}
+
+# Rows ranked per lookup, the best ``limit`` of them are returned
+CANDIDATES = 50
+
+# Average fuzzywuzzy ratio of the words a row must reach when not all are found in it
+MIN_SCORE = 70
+
+# n-grams found in more rows than this share carry no information
+COMMON_GRAM_SHARE = 0.1
+
+VERSION_PREFIX = 'production:search-version:'
+
+_indexes = {}
+
+
+def words(text):
+    return str(text).lower().split()
+
+
+def trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def grams(word):
+    """
+    Index keys of ``word``: its one and two character prefixes, marked by a
+    leading space, and its trigrams.
+    """
+    return {' ' + word[:1], ' ' + word[:2]} | trigrams(word)
+
+
+def query_grams(word):
+    """
+    Keys to look ``word`` up by, words too short for a trigram match prefixes.
+    """
+    if len(word) < 3:
+        return {' ' + word}
+    return trigrams(word)
+
+
+class NgramIndex(object):
+    """
+    In-process n-gram index of the search text of every row of ``model``.
+    """
+    def __init__(self, model, version=None):
+        self.version = version
+        self.texts = {}
+        self.lowered = {}
+        self.postings = defaultdict(set)
+        fields = SEARCH_FIELDS[model]
+        for pk, *values in model.objects.values_list('pk', *fields).iterator():
+            text = ' '.join(str(value) for value in values if value)
+            self.texts[pk] = text
+            self.lowered[pk] = text.lower()
+            for word in words(text):
+                for gram in grams(word):
+                    self.postings[gram].add(pk)
+
+    def exact(self, term, allowed=None):
+        """
+        Rows containing every word of ``term``, among ``allowed`` when given.
+        """
+        term_words = words(term)
+        postings = sorted((self.postings.get(gram, set()) for word in term_words
+                           for gram in query_grams(word)), key=len)
+        if not postings:
+            return set()
+        found = set.intersection(*postings)
+        if allowed is not None:
+            found &= allowed
+        # several trigrams of a word may be found apart from each other
+        long_words = [word for word in term_words if len(word) > 3]
+        if long_words:
+            found = {pk for pk in found if all(word in self.lowered[pk] for word in long_words)}
+        return found
+
+    def similar(self, term, limit, allowed=None):
+        """
+        Up to ``limit`` rows sharing the most n-grams with the words of ``term``,
+        among ``allowed`` when given.
+        """
+        rows = len(self.texts) if allowed is None else len(allowed)
+        common = max(rows * COMMON_GRAM_SHARE, CANDIDATES)
+        shared = Counter()
+        for word in words(term):
+            for gram in query_grams(word):
+                postings = self.postings.get(gram, set())
+                if allowed is not None:
+                    postings = postings & allowed
+                if len(postings) <= common:
+                    shared.update(postings)
+        return [pk for pk, count in shared.most_common(limit)]
+
+    def search(self, term, limit=CANDIDATES, allowed=None):
+        """
+        Return ``{pk: text}`` of up to ``limit`` candidates for ``term``,
+        only rows in ``allowed`` when given.
+        """
+        found = self.exact(term, allowed)
+        if len(found) > limit:
+            # prefer rows where the first word starts a word
+            starting = found & self.postings.get(' ' + words(term)[0][:2], set())
+            found = set(heapq.nsmallest(limit, starting if len(starting) >= limit else found))
+        elif len(found) < limit:
+            found.update(self.similar(term, limit - len(found), allowed))
+        if term.strip().isdigit() and int(term) in self.texts:
+            if allowed is None or int(term) in allowed:
+                found.add(int(term))
+        return {pk: self.texts[pk] for pk in found}
+
+
+def _version_key(model):
+    return '{}{}'.format(VERSION_PREFIX, model._meta.label_lower)
+
+
+def _renew(models):
+    cache.set_many({_version_key(searched): uuid.uuid4().hex for searched in models},
+                   timeout=None)
+
+
+def invalidate(model):
+    """
+    Renew the version of ``model`` and the models searching its fields once
+    the current transaction commits, so an index built meanwhile from the
+    previous rows is never taken for the new version.
+    """
+    searched = [model] + DEPENDENTS.get(model, [])
+    transaction.on_commit(lambda: _renew(searched))
+
+
+def ngram_index(model):
+    version = cache.get(_version_key(model))
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(_version_key(model), version, timeout=None)
+        version = cache.get(_version_key(model), version)
+    index = _indexes.get(model)
+    if index is None or index.version != version:
+        index = _indexes[model] = NgramIndex(model, version)
+    return index
+
+
+class TrigramSimilar(models.Func):
+    """
+    ``UPPER(field) % UPPER(word)``, served by the trigram indexes of 0008.
+    """
+    template = 'UPPER(%(expressions)s::text)'
+    arg_joiner = '::text) %% UPPER('
+    output_field = models.BooleanField()
+
+
+def _trigram_candidates(queryset, term, limit):
+    fields = SEARCH_FIELDS[queryset.model]
+    contained = Q()
+    similar = Q()
+    for word in term.split():
+        contained &= Q(*[Q(**{field + '__icontains': word}) for field in fields], _connector=Q.OR)
+        similar &= Q(*[TrigramSimilar(field, models.Value(word)) for field in fields],
+                     _connector=Q.OR)
+    if term.strip().isdigit():
+        contained |= Q(pk=int(term))
+    rows = list(queryset.filter(contained).values_list('pk', *fields)[:limit])
+    if len(rows) < limit:
+        seen = {row[0] for row in rows}
+        rows += [row for row in queryset.filter(similar).values_list('pk', *fields)[:limit]
+                 if row[0] not in seen]
+    return {pk: ' '.join(str(value) for value in values if value) for pk, *values in rows}
+
+
+def candidates(queryset, term, limit=CANDIDATES):
+    """
+    Return ``{pk: text}`` of up to ``limit`` rows of ``queryset`` matching ``term``.
+    """
+    if connection.vendor == 'postgresql':
+        return _trigram_candidates(queryset, term, limit)
+    allowed = None
+    if queryset.query.has_filters():
+        # restrict before the cut, the best rows overall may all be filtered out
+        allowed = set(queryset.values_list('pk', flat=True))
+    return ngram_index(queryset.model).search(term, limit, allowed)
+
+
+def score(term, text):
+    """
+    Sort key of a row, exact word matches before fuzzy ones.
+    """
+    text_words = words(text)
+    term_words = words(term)
+    return (
+        all(word in text_words for word in term_words),
+        all(word in text.lower() for word in term_words),
+        sum(max(fuzz.ratio(word, text_word) for text_word in text_words)
+            for word in term_words) // len(term_words),
+    )
+
+
+def search(queryset, term, limit=10):
+    """
+    Return the ``limit`` rows of ``queryset`` best matching ``term``, best first.
+    """
+    if not term.strip():
+        return []
+    found = candidates(queryset, term)
+    scores = {pk: score(term, text) for pk, text in found.items()}
+    pk_term = int(term) if term.strip().isdigit() else None
+    ranked = sorted((pk for pk, key in scores.items()
+                     if key[1] or key[2] >= MIN_SCORE or pk == pk_term),
+                    key=lambda pk: (scores[pk], -pk), reverse=True)
+    objects = queryset.in_bulk(ranked)
+    return [objects[pk] for pk in ranked if pk in objects][:limit]
@@ -1,43 +1,205 @@
-from decimal import Decimal
-
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+
+from production import bom, bookkeeping, costing, ledger, lots, reports, rollups, search
+from production.models.inventory import InventoryItems, StockBalance, StockSnapshot, ItemCost, \
+    StockLevel, UnitMeasurement
+from production.models.manufacture import BillOfMaterial, BillOfMaterialDetails, Manufacture, \
+    ProductUsage
+
+
+def invalidate_balance(sender, instance):
+    """
+    Drop the stored balance, cost and snapshots touched by a raw (fixture) save,
+    they are rebuilt on the next read since related rows may not be loaded yet.
+    """
+    if sender is InventoryItems:
+        items = [instance.pk]
+    elif sender in ledger.LEDGER_COLUMNS and hasattr(instance, 'item_id'):
+        items = [instance.item_id]
+    else:
+        items = BillOfMaterial.objects.filter(
+            pk=instance.bill_of_material_id
+        ).values('product_id')
+    StockBalance.objects.filter(item_id__in=items).delete()
+    ItemCost.objects.filter(item_id__in=items).delete()
+    StockSnapshot.objects.filter(item_id__in=items).delete()
+
+
+# Item fields printed by the usage reports
+REPORT_FIELDS = ('code', 'name', 'unit_id')
+
+
+@receiver(pre_save, sender=InventoryItems)
+def item_snapshot(sender, instance, raw, **kwargs):
+    instance._ledger_initial = instance._report_previous = None
+    if instance.pk and not raw:
+        stored = sender.objects.filter(pk=instance.pk).values(
+            'initial', 'type', *REPORT_FIELDS
+        ).first()
+        if stored:
+            instance._ledger_initial = stored.pop('initial')
+            instance._report_previous = stored
+
+
+@receiver(post_save, sender=InventoryItems)
+def item_update(sender, instance, created, raw, **kwargs):
+    if raw:
+        invalidate_balance(sender, instance)
+        reports.invalidate_all()
+        bom.invalidate(product_ids=[instance.pk])
+        return
+    previous = instance._report_previous
+    if previous and any(previous[field] != getattr(instance, field) for field in REPORT_FIELDS):
+        reports.invalidate_all()
+    if previous and (previous['type'] == 'BT') != (instance.type == 'BT'):
+        # formulas using the item now explode it, or stop doing so
+        bom.invalidate(product_ids=[instance.pk])
+    if created or instance._ledger_initial is None:
+        StockBalance.objects.get_or_create(item=instance, defaults={'available': instance.initial})
+        average = costing.quantize(instance.price)
+        ItemCost.objects.get_or_create(item=instance, defaults={
+            'quantity': instance.initial, 'average': average,
+            'value': costing.quantize(instance.initial * average),
+        })
+        lots.set_opening(instance.pk, instance.initial)
+    elif instance.initial != instance._ledger_initial:
+        StockBalance.objects.apply(instance.pk, initial=instance.initial - instance._ledger_initial)
+        costing.post({instance.pk: (instance.initial - instance._ledger_initial, None)})
+        lots.set_opening(instance.pk, instance.initial)
+        StockSnapshot.objects.filter(item=instance).delete()
+
+
+@receiver(post_save, sender=UnitMeasurement)
+def unit_update(sender, instance, created, **kwargs):
+    if not created:
+        reports.invalidate_all()
+
+
+def stored_values(sender, pk):
+    if sender in rollups.ROLLUPS:
+        return rollups.stored_values(sender, pk)
+    return ledger.stored_values(sender, pk)
+
+
+def instance_values(sender, instance):
+    if sender in rollups.ROLLUPS:
+        return rollups.instance_values(instance)
+    return ledger.instance_values(instance)
+
+
+def transaction_snapshot(sender, instance, raw, **kwargs):
+    instance._ledger_previous = None
+    if instance.pk and not raw:
+        instance._ledger_previous = stored_values(sender, instance.pk)
+
+
+def invalidate_reports(sender, *values):
+    """
+    Expire cached usage reports over the dates of changed usages and manufactures.
+    """
+    if sender in (ProductUsage, Manufacture):
+        reports.invalidate(*(value['moved_at'] for value in values if value))
+
+
+def transaction_update(sender, instance, created, raw, **kwargs):
+    if raw:
+        invalidate_balance(sender, instance)
+        if sender is Manufacture:
+            reports.invalidate(instance.datetime)
+        return
+
+    current = instance_values(sender, instance)
+    ledger.record_change(sender, instance._ledger_previous, current)
+    if sender in rollups.ROLLUPS:
+        rollups.record_change(sender, instance._ledger_previous, current)
+    costing.record_change(sender, instance._ledger_previous, current)
+    if sender in lots.CONSUMERS:
+        lots.record_change(sender, instance, instance._ledger_previous, current)
+    invalidate_reports(sender, instance._ledger_previous, current)
+    if sender is Manufacture:
+        ledger.record_manufacture_moved(instance.pk, instance._ledger_previous, current)
+        rollups.record_manufacture_moved(instance.pk, instance._ledger_previous, current)
+
+
+def lots_release(sender, instance, **kwargs):
+    """
+    Put back the lots drained by a row before its consumptions are deleted with it.
+    """
+    lots.release(**{lots.CONSUMERS[sender]: instance})
+    if sender is StockLevel:
+        instance._lots_drawn = lots.drawn(instance)
+
+
+def transaction_delete(sender, instance, **kwargs):
+    values = instance_values(sender, instance)
+    ledger.record_change(sender, values, None)
+    if sender in rollups.ROLLUPS:
+        rollups.record_change(sender, values, None)
+    costing.record_change(sender, values, None)
+    if getattr(instance, '_lots_drawn', False):
+        # the rows drawn from its lot are replayed on the remaining ones
+        lots.rebuild([instance.item_id])
+    invalidate_reports(sender, values)
+
+
+for model in ledger.LEDGER_COLUMNS:
+    pre_save.connect(transaction_snapshot, sender=model, dispatch_uid='ledger_pre_save')
+    post_save.connect(transaction_update, sender=model, dispatch_uid='ledger_post_save')
+    post_delete.connect(transaction_delete, sender=model, dispatch_uid='ledger_post_delete')
+
+for model in lots.CONSUMERS:
+    pre_delete.connect(lots_release, sender=model, dispatch_uid='lots_pre_delete')
+
+
+@receiver(pre_save, sender=BillOfMaterialDetails)
+def bom_detail_snapshot(sender, instance, **kwargs):
+    instance._bom_previous = None
+    if instance.pk:
+        instance._bom_previous = sender.objects.filter(pk=instance.pk).values_list(
+            'bill_of_material_id', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=BillOfMaterialDetails)
+def bom_detail_update(sender, instance, **kwargs):
+    bom.invalidate(bom_ids={instance.bill_of_material_id, instance._bom_previous} - {None})
+
 
-from production.models.inventory import InventoryItems, StockMovement, StockLevel
-from production.models.manufacture import ProductUsage, Manufacture
+@receiver(post_delete, sender=BillOfMaterialDetails)
+def bom_detail_delete(sender, instance, **kwargs):
+    bom.invalidate(bom_ids=[instance.bill_of_material_id])
 
 
-def get_total_stock_level(obj):
-    stock = obj.stock or Decimal(0.000)
-    usage = obj.usage or Decimal(0.000)
-    deliver = obj.deliver or Decimal(0.000)
-    produce = obj.produce or Decimal(0.000)
-    adjustment = obj.adjustment or Decimal(0.000)
-    balance = obj.initial or Decimal(0.0000)
-    total = (balance + stock + produce + adjustment) - usage - deliver
-    obj.available = total
-    obj.save()
+@receiver(pre_save, sender=BillOfMaterial)
+def bom_snapshot(sender, instance, **kwargs):
+    instance._bom_previous = None
+    if instance.pk:
+        instance._bom_previous = sender.objects.filter(pk=instance.pk).values_list(
+            'product_id', flat=True
+        ).first()
 
 
-@receiver(post_save, sender=StockLevel)
-def receipt_update(sender, instance, created, **kwargs):
-    item = InventoryItems.objects.get(pk=instance.item.pk)
-    get_total_stock_level(item)
+@receiver(post_save, sender=BillOfMaterial)
+def bom_update(sender, instance, raw, **kwargs):
+    if not raw and instance._bom_previous not in (None, instance.product_id):
+        bookkeeping.record_product_changed(instance.pk, instance._bom_previous,
+                                           instance.product_id)
+    bom.invalidate(
+        bom_ids=[instance.pk],
+        product_ids={instance.product_id, instance._bom_previous} - {None}
+    )
 
 
-@receiver(post_save, sender=StockMovement)
-def delivery_update(sender, instance, created, **kwargs):
-    item = InventoryItems.objects.get(pk=instance.item.pk)
-    get_total_stock_level(item)
+@receiver(post_delete, sender=BillOfMaterial)
+def bom_delete(sender, instance, **kwargs):
+    bom.invalidate(bom_ids=[instance.pk], product_ids=[instance.product_id])
 
 
-@receiver(post_save, sender=ProductUsage)
-def productusage_update(sender, instance, created, **kwargs):
-    item = InventoryItems.objects.get(pk=instance.item.pk)
-    get_total_stock_level(item)
+def search_invalidate(sender, **kwargs):
+    search.invalidate(sender)
 
 
-@receiver(post_save, sender=Manufacture)
-def manufacture_update(sender, instance, created, **kwargs):
-    item = InventoryItems.objects.get(pk=instance.bill_of_material.product.pk)
-    get_total_stock_level(item)
+for model in search.SEARCH_FIELDS:
+    post_save.connect(search_invalidate, sender=model, dispatch_uid='search_post_save')
+    post_delete.connect(search_invalidate, sender=model, dispatch_uid='search_post_delete')
@@ -0,0 +1,243 @@
+"""
+Synthetic datasets for benchmarking.
+
+Rows are written with ``bulk_create`` in batches and explicit primary keys,
+stock balances, costs, lots and daily rollups are rebuilt once at the end.
+Generated codes and names start with ``PREFIX`` so they can be told apart
+from real data.
+"""
+import datetime
+import random
+from decimal import Decimal
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from production import bookkeeping, search
+from production.models.customer import Customer, CustomerCategory, Supplier
+from production.models.inventory import UnitMeasurement, InventoryItems, StockLevel, StockMovement
+from production.models.manufacture import BillOfMaterial, BillOfMaterialDetails, Manufacture, \
+    ProductUsage
+
+
+PREFIX = 'SYN'
+
+QUANTITY_PLACES = Decimal('0.0001')
+
+
+class Generator(object):
+    """
+    Write a dataset of the requested size, reproducible for a given ``seed``.
+
+    ``days`` spreads transaction dates over the period ending now.
+    """
+    def __init__(self, seed=0, days=365, batch_size=5000, log=None):
+        self.random = random.Random(seed)
+        self.days = days
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+
+    def quantity(self, low, high):
+        return Decimal(self.random.uniform(low, high)).quantize(QUANTITY_PLACES)
+
+    def moment(self):
+        return self.now - datetime.timedelta(seconds=self.random.randint(0, self.days * 86400))
+
+    def next_pk(self, model):
+        return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+    def write(self, model, rows):
+        """
+        Insert the instances yielded by ``rows`` in batches, return how many.
+        """
+        batch = []
+        count = 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self.batch_size:
+                model.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            model.objects.bulk_create(batch)
+            count += len(batch)
+        self.log("{}: {}".format(model._meta.verbose_name_plural, count))
+        return count
+
+    def references(self, customers, suppliers):
+        units = list(UnitMeasurement.objects.values_list('pk', flat=True))
+        if not units:
+            units = [UnitMeasurement.objects.create(name=name).pk for name in ('Kg', 'Pcs')]
+        category = CustomerCategory.objects.create(name='{} category'.format(PREFIX))
+        first = self.next_pk(Customer)
+        self.write(Customer, (Customer(pk=first + i, name='{} customer {}'.format(PREFIX, i))
+                              for i in range(customers)))
+        first_supplier = self.next_pk(Supplier)
+        self.write(Supplier, (Supplier(pk=first_supplier + i, name='{} supplier {}'.format(PREFIX, i))
+                              for i in range(suppliers)))
+        self.units = units
+        self.category = category.pk
+        self.customers = list(range(first, first + customers))
+        self.suppliers = list(range(first_supplier, first_supplier + suppliers))
+
+    def items(self, count):
+        """
+        70% raw materials, 20% finished goods and 10% consumables.
+        """
+        first = self.next_pk(InventoryItems)
+        types = ['TTD'] * 7 + ['BT'] * 2 + ['CON']
+        self.materials, self.products = [], []
+        self.prices = {}
+
+        def rows():
+            for i in range(count):
+                pk = first + i
+                item_type = types[i % len(types)]
+                price = Decimal(self.random.randint(1000, 250000))
+                self.prices[pk] = price
+                (self.products if item_type == 'BT' else self.materials).append(pk)
+                yield InventoryItems(
+                    pk=pk, code='{}-{:07d}'.format(PREFIX, pk), type=item_type,
+                    name='{} {} {}'.format(PREFIX, item_type, pk), unit_id=self.random.choice(self.units),
+                    price=price, initial=self.quantity(0, 500)
+                )
+        return self.write(InventoryItems, rows())
+
+    def formulas(self, count):
+        """
+        3 to 12 lines per formula, one in ten also uses an earlier finished
+        good so nested formulas exist without cycles.
+        """
+        first = self.next_pk(BillOfMaterial)
+        self.lines = {}
+        self.formula_products = {}
+
+        def formulas():
+            for i in range(count):
+                pk = first + i
+                position = i % len(self.products)
+                product = self.products[position]
+                lines = [(material, self.quantity(0.1, 50), self.random.choice(self.units))
+                         for material in self.random.sample(self.materials,
+                                                            min(len(self.materials),
+                                                                self.random.randint(3, 12)))]
+                if position and self.random.random() < 0.1:
+                    nested = self.products[self.random.randrange(position)]
+                    lines.append((nested, self.quantity(0.1, 20), self.random.choice(self.units)))
+                self.lines[pk] = lines
+                self.formula_products[pk] = product
+                yield BillOfMaterial(
+                    pk=pk, code='{}-F{:07d}'.format(PREFIX, pk),
+                    customer_id=self.random.choice(self.customers), customer_category_id=self.category,
+                    color_name='{} color {}'.format(PREFIX, pk), product_id=product,
+                    output_standard=sum(quantity for material, quantity, unit in lines)
+                )
+
+        def details():
+            for bom_id, lines in self.lines.items():
+                for material, quantity, unit in lines:
+                    yield BillOfMaterialDetails(bill_of_material_id=bom_id, material_id=material,
+                                                quantity=quantity, unit_id=unit)
+
+        written = self.write(BillOfMaterial, formulas())
+        self.write(BillOfMaterialDetails, details())
+        return written
+
+    def receipts(self, count):
+        def rows():
+            for i in range(count):
+                item = self.random.choice(self.materials)
+                returned = self.random.random() < 0.02
+                quantity = self.quantity(1, 200)
+                yield StockLevel(
+                    item_id=item, delivery_note='{}-DN{:08d}'.format(PREFIX, i),
+                    datetime=self.moment(), quantity=-quantity if returned else quantity,
+                    price=self.prices[item], unit_id=self.random.choice(self.units),
+                    status='return' if returned else 'receipt',
+                    supplier_id=self.random.choice(self.suppliers)
+                )
+        return self.write(StockLevel, rows())
+
+    def deliveries(self, count):
+        def rows():
+            for i in range(count):
+                returned = self.random.random() < 0.02
+                quantity = self.quantity(1, 50)
+                yield StockMovement(
+                    item_id=self.random.choice(self.products),
+                    delivery_order='{}-DO{:08d}'.format(PREFIX, i), datetime=self.moment(),
+                    quantity=-quantity if returned else quantity,
+                    customer_id=self.random.choice(self.customers),
+                    unit_id=self.random.choice(self.units),
+                    status='return' if returned else 'sent', jo_number='JO-{}'.format(i % 5000)
+                )
+        return self.write(StockMovement, rows())
+
+    def manufactures(self, count):
+        """
+        Orders with their material usages, priced the way ``ManufactureAdmin`` does.
+        """
+        first = self.next_pk(Manufacture)
+        formulas = list(self.lines)
+        self.usage_count = 0
+        for start in range(0, count, self.batch_size):
+            orders, usages = [], []
+            for pk in range(first + start, first + min(count, start + self.batch_size)):
+                bom_id = self.random.choice(formulas)
+                lines = self.lines[bom_id]
+                output_weight = sum(quantity for material, quantity, unit in lines)
+                quantity = self.quantity(5, 500)
+                price = Decimal(0)
+                for material, line_quantity, unit in lines:
+                    used = (line_quantity / output_weight * quantity).quantize(QUANTITY_PLACES)
+                    cost = (used * self.prices[material]).quantize(QUANTITY_PLACES)
+                    price += cost
+                    usages.append(ProductUsage(item_id=material, manufacture_id=pk, quantity=used,
+                                               price=cost, unit_id=unit))
+                orders.append(Manufacture(
+                    pk=pk, datetime=self.moment(), bill_of_material_id=bom_id, price=price,
+                    bom_output_standard=output_weight, customer_id=self.random.choice(self.customers),
+                    quantity=quantity, unit_id=self.random.choice(self.units),
+                    status=self.random.choice(['done'] * 7 + ['pending'] * 2 + ['on_going'])
+                ))
+            Manufacture.objects.bulk_create(orders)
+            ProductUsage.objects.bulk_create(usages, batch_size=self.batch_size)
+            self.usage_count += len(usages)
+        self.log("{}: {}, {}: {}".format(
+            Manufacture._meta.verbose_name_plural, count,
+            ProductUsage._meta.verbose_name_plural, self.usage_count
+        ))
+        return count
+
+    def generate(self, items, formulas, receipts, deliveries, manufactures, customers=200,
+                 suppliers=100):
+        """
+        Write the dataset, then rebuild balances and rollups. Returns row counts.
+        """
+        counts = {}
+        with transaction.atomic():
+            self.references(customers, suppliers)
+            counts['items'] = self.items(items)
+            counts['formulas'] = self.formulas(formulas)
+            counts['receipts'] = self.receipts(receipts)
+            counts['deliveries'] = self.deliveries(deliveries)
+            counts['manufactures'] = self.manufactures(manufactures)
+            counts['usages'] = self.usage_count
+
+            models = [Customer, Supplier, InventoryItems, BillOfMaterial, Manufacture]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+            for model in models:
+                if model in search.SEARCH_FIELDS:
+                    search.invalidate(model)
+
+        self.log("Rebuilding stock balances, costs, lots and rollups")
+        bookkeeping.rebuild(
+            self.prices,
+            start_date=timezone.localtime(self.now).date() - datetime.timedelta(days=self.days)
+        )
+        return counts
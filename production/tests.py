@@ -1,10 +1,70 @@
+import datetime
+import importlib
+import json
+import os
+import re
+import tempfile
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-from django.test import TransactionTestCase
+from django.apps import apps as django_apps
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.template import engines
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.contrib.messages.storage import default_storage
+from django.test import Client, RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from prometheus_client import REGISTRY
+from tablib import Dataset
 
-from production.models.manufacture import Manufacture, BillOfMaterial, BillOfMaterialDetails
-from production.models.inventory import Customer, UnitMeasurement, InventoryItems, StockMovement
+from html2pdf import cache as pdf_cache, jobs
+from html2pdf.response import HTML2PDFResponse
+
+from production.models.manufacture import Manufacture, BillOfMaterial, BillOfMaterialDetails, \
+    ProductUsage, DailyUsageRollup, LotConsumption
+from production import benchmarks, bom, checks, costing, formulas, ledger, lots, mrp, pagination, \
+    reports, rollups, search
+from django.forms import inlineformset_factory
+
+from production.forms import StockMovementForm, ProductUsageInlineForm, ProductUsageInlineFormSet
+from production.synthetic import Generator
+from production.resources import StockLevelImportResource, StockMovementImportResource
+from production.models.inventory import Customer, UnitMeasurement, InventoryItems, StockMovement, \
+    InventoryAdjustment, ItemCost, StockLevel, StockBalance, StockSnapshot, Supplier, DailyItemRollup, \
+    StockLot
+
+
+def cache_settings(location):
+    return {'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location
+    }}
+
+
+# Keep the tests off the cache and document directories of the site
+storage_root = tempfile.TemporaryDirectory()
+test_storage = override_settings(
+    CACHES=cache_settings(os.path.join(storage_root.name, 'cache')),
+    HTML2PDF_JOB_ROOT=os.path.join(storage_root.name, 'pdf_jobs'),
+    HTML2PDF_CACHE_ROOT=os.path.join(storage_root.name, 'pdf_cache'),
+)
+
+
+def setUpModule():
+    test_storage.enable()
+
+
+def tearDownModule():
+    test_storage.disable()
+    storage_root.cleanup()
 
 
 def manufacture_data_creation(quantity):
@@ -114,3 +174,1575 @@ class InventoryItemsTest(TransactionTestCase):
         self.deliver_product(item=item, quantity=Decimal(20.0000))
         self.return_product(item=item, quantity=Decimal(5.0000))
         self.assertEqual(item.availability(), Decimal(10.0000))
+
+
+def rebuilt_available(item):
+    ledger.rebuild([item.pk])
+    return StockBalance.objects.get(item=item).available
+
+
+class StockBalanceTest(TransactionTestCase):
+    fixtures = [
+        'unit_measurement.json', 'customer.json', 'customer_category.json', 'supplier.json',
+        'inventory_items.json', 'bill_of_material.json', 'bill_of_material_detail.json'
+    ]
+
+    def setUp(self):
+        self.item = InventoryItems.objects.get(code='602')
+        self.receipt = StockLevel.objects.create(
+            item=self.item, datetime=timezone.now(), quantity=Decimal('5.0000'),
+            price=Decimal('10000.0000'), unit=UnitMeasurement.objects.get(pk=1),
+            status='receipt', supplier=Supplier.objects.first()
+        )
+
+    def assertBalanceConsistent(self, item):
+        stored = StockBalance.objects.get(item=item).available
+        self.assertEqual(stored, rebuilt_available(item))
+
+    def test_receipt_updates_balance(self):
+        self.assertEqual(self.item.availability(), Decimal('25.0000'))
+        self.assertBalanceConsistent(self.item)
+
+    def test_missing_balances_rebuilt(self):
+        other = InventoryItems.objects.get(code='603')
+        StockBalance.objects.filter(item__in=[self.item, other]).delete()
+        self.assertEqual(self.item.availability(), Decimal('25.0000'))
+        StockBalance.objects.filter(item=self.item).delete()
+        self.assertEqual(InventoryItems.objects.availability_for([self.item.pk, other.pk]),
+                         {self.item.pk: Decimal('25.0000'), other.pk: Decimal('20.0000')})
+
+        StockBalance.objects.filter(item=self.item).update(available=0)
+        call_command('rebuild_stock_balance', '602', stdout=StringIO())
+        self.assertBalanceConsistent(self.item)
+        self.assertEqual(self.item.availability(), Decimal('25.0000'))
+
+    def test_receipt_change_and_delete(self):
+        self.receipt.quantity = Decimal('2.5000')
+        self.receipt.save()
+        self.assertEqual(self.item.availability(), Decimal('22.5000'))
+        self.receipt.delete()
+        self.assertEqual(self.item.availability(), Decimal('20.0000'))
+        self.assertBalanceConsistent(self.item)
+
+    def test_receipt_moved_to_other_item(self):
+        other = InventoryItems.objects.get(code='603')
+        self.receipt.item = other
+        self.receipt.save()
+        self.assertEqual(self.item.availability(), Decimal('20.0000'))
+        self.assertEqual(other.availability(), Decimal('25.0000'))
+
+    def test_initial_change(self):
+        self.item.initial = Decimal('30.0000')
+        self.item.save()
+        self.assertEqual(self.item.availability(), Decimal('35.0000'))
+        self.assertBalanceConsistent(self.item)
+
+    def test_formula_product_change_moves_output(self):
+        manufacture_data_creation(Decimal('10.0000'))
+        manufacture = Manufacture.objects.get()
+        ProductUsage.objects.create(item=self.item, manufacture=manufacture,
+                                    quantity=Decimal('3.0000'), unit=manufacture.unit,
+                                    price=Decimal('30.0000'))
+        manufacture.status = 'done'
+        manufacture.save()
+        formula = manufacture.bill_of_material
+        previous = formula.product
+        produced = previous.availability()
+        product = InventoryItems.objects.create(code='BT-002', name='Red Gloss', type='BT',
+                                                unit=previous.unit, price=0)
+
+        formula.product = product
+        formula.save()
+        self.assertEqual(previous.availability(), produced - Decimal('10.0000'))
+        self.assertEqual(product.availability(), Decimal('10.0000'))
+        self.assertBalanceConsistent(previous)
+        self.assertBalanceConsistent(product)
+        rows = sorted(DailyUsageRollup.objects.exclude(quantity=0).values_list('product', 'item',
+                                                                               'quantity'))
+        self.assertEqual(rows, [(product.pk, self.item.pk, Decimal('3.0000'))])
+        outputs = sorted(DailyItemRollup.objects.exclude(output=0).values_list('item', 'output'))
+        self.assertEqual(outputs, [(product.pk, Decimal('10.0000'))])
+        self.assertEqual(ItemCost.objects.get(item=product).quantity, Decimal('10.0000'))
+
+    def test_bulk_usages_are_recorded(self):
+        request = RequestFactory().post('/')
+        request.session = {}
+        request._messages = default_storage(request)
+        formula = BillOfMaterial.objects.get(code='BT-001')
+        manufacture = Manufacture(
+            datetime=timezone.now(), bill_of_material=formula, customer=Customer.objects.get(pk=1),
+            quantity=Decimal('4.0000'), unit=UnitMeasurement.objects.get(pk=1), status='pending'
+        )
+        site._registry[Manufacture].save_model(request, manufacture, None, False)
+        usages = ProductUsage.objects.filter(manufacture=manufacture)
+        self.assertTrue(usages.exists())
+        self.assertEqual(
+            dict(LotConsumption.objects.values_list('usage').annotate(total=Sum('quantity'))),
+            dict(usages.values_list('pk', 'quantity'))
+        )
+        for usage in usages:
+            self.assertBalanceConsistent(usage.item)
+        self.assertEqual(sum(DailyUsageRollup.objects.values_list('quantity', flat=True)),
+                         sum(usages.values_list('quantity', flat=True)))
+
+    def test_prefetch_profiles(self):
+        with self.assertNumQueries(1):
+            InventoryItems.objects.get(pk=self.item.pk)
+        with self.assertNumQueries(1):
+            InventoryItems.objects.light().get(pk=self.item.pk).unit.name
+        since = timezone.now() + datetime.timedelta(days=1)
+        item = InventoryItems.objects.with_history(since=since).get(pk=self.item.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(list(item.stocklevel_set.all()), [])
+        item = InventoryItems.objects.with_history().get(pk=self.item.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(list(item.stocklevel_set.all()), [self.receipt])
+
+    def test_annotated_availability(self):
+        items = InventoryItems.objects.with_availability()
+        for item in items:
+            self.assertEqual(item.available, item.availability())
+        negative = items.filter(available__lt=0)
+        self.assertFalse(negative.exists())
+        self.assertEqual(items.get(pk=self.item.pk).total_purchased, Decimal('5.0000'))
+
+
+class StockSnapshotTest(TransactionTestCase):
+    fixtures = [
+        'unit_measurement.json', 'customer.json', 'customer_category.json', 'supplier.json',
+        'inventory_items.json', 'bill_of_material.json', 'bill_of_material_detail.json'
+    ]
+
+    def setUp(self):
+        self.item = InventoryItems.objects.get(code='602')
+        self.today = timezone.localdate()
+        for days_ago, quantity in ((10, '5.0000'), (5, '3.0000'), (1, '2.0000')):
+            self.receive(days_ago, quantity)
+
+    def receive(self, days_ago, quantity):
+        return StockLevel.objects.create(
+            item=self.item, datetime=timezone.now() - datetime.timedelta(days=days_ago),
+            quantity=Decimal(quantity), price=Decimal('10000.0000'),
+            unit=UnitMeasurement.objects.get(pk=1), status='receipt',
+            supplier=Supplier.objects.first()
+        )
+
+    def test_availability_at_without_snapshot(self):
+        self.assertEqual(self.item.availability_at(self.today - datetime.timedelta(days=20)),
+                         Decimal('20.0000'))
+        self.assertEqual(self.item.availability_at(self.today - datetime.timedelta(days=5)),
+                         Decimal('28.0000'))
+        self.assertEqual(self.item.availability_at(self.today), self.item.availability())
+
+    def test_availability_at_from_snapshot(self):
+        StockSnapshot.objects.take(self.today - datetime.timedelta(days=7))
+        StockSnapshot.objects.take(self.today - datetime.timedelta(days=3))
+        snapshot = StockSnapshot.objects.get(item=self.item, date=self.today - datetime.timedelta(days=3))
+        self.assertEqual(snapshot.available, Decimal('28.0000'))
+        self.assertEqual(self.item.availability_at(self.today), Decimal('30.0000'))
+
+    def test_backdated_write_drops_snapshot(self):
+        date = self.today - datetime.timedelta(days=3)
+        StockSnapshot.objects.take(date)
+        self.receive(4, '1.0000')
+        self.assertFalse(StockSnapshot.objects.filter(item=self.item, date=date).exists())
+        self.assertEqual(self.item.availability_at(date), Decimal('29.0000'))
+
+
+class AvailabilityLookupTest(TransactionTestCase):
+    fixtures = [
+        'unit_measurement.json', 'customer.json', 'customer_category.json',
+        'inventory_items.json', 'bill_of_material.json', 'bill_of_material_detail.json'
+    ]
+
+    def create_manufacture(self, quantity):
+        request = RequestFactory().post('/')
+        request.session = {}
+        request._messages = default_storage(request)
+        manufacture = Manufacture(
+            datetime=timezone.now(), bill_of_material=BillOfMaterial.objects.get(code='BT-001'),
+            customer=Customer.objects.get(pk=1), quantity=quantity,
+            unit=UnitMeasurement.objects.get(pk=1), status='pending'
+        )
+        site._registry[Manufacture].save_model(request, manufacture, None, False)
+        return manufacture, [m.message for m in request._messages]
+
+    def test_availability_for(self):
+        items = list(InventoryItems.objects.filter(code__in=['602', 'BT-001']))
+        InventoryItems.objects.availability_for(item.pk for item in items)
+        with self.assertNumQueries(1):
+            available = InventoryItems.objects.availability_for(item.pk for item in items)
+        self.assertEqual(available, {item.pk: item.availability() for item in items})
+
+    def test_shortages(self):
+        item = InventoryItems.objects.get(code='602')
+        short = InventoryItems.objects.shortages({item.pk: Decimal('25.0000')})
+        self.assertEqual(short, {item.pk: (Decimal('25.0000'), Decimal('20.0000'))})
+        self.assertEqual(InventoryItems.objects.shortages({item.pk: Decimal('20.0000')}), {})
+
+    def test_reserve_locks_balances_in_item_order(self):
+        items = sorted(InventoryItems.objects.filter(code__in=['602', 'BT-001']).values_list(
+            'pk', flat=True
+        ))
+        InventoryItems.objects.availability_for(items)
+        with transaction.atomic(), CaptureQueriesContext(connection) as captured:
+            short = InventoryItems.objects.shortages(
+                {items[1]: Decimal('1000.0000'), items[0]: Decimal('0.0001')}, lock=True
+            )
+        self.assertEqual(list(short), [items[1]])
+        self.assertEqual(len(captured), 1)
+        self.assertIn('ORDER BY', captured[0]['sql'])
+        if connection.features.has_select_for_update:
+            self.assertIn('FOR UPDATE', captured[0]['sql'])
+
+    def test_manufacture_save_locks_in_item_order(self):
+        client = Client()
+        client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        product = InventoryItems.objects.get(code='BT-001')
+        bill = BillOfMaterial.objects.get(code='BT-001')
+        formula = set(bill.billofmaterialdetails_set.values_list('material_id', flat=True))
+        InventoryItems.objects.availability_for(formula | {product.pk})
+        lock = StockBalance.objects.lock
+        with mock.patch.object(StockBalance.objects, 'lock', side_effect=lock) as locked, \
+                CaptureQueriesContext(connection) as captured:
+            response = client.post('/admin/production/manufacture/add/', {
+                'customer': 1, 'datetime_0': timezone.localdate().isoformat(),
+                'datetime_1': '08:00:00', 'bill_of_material': bill.pk, 'unit': 1,
+                'quantity': '1.0000',
+                'productusage_set-TOTAL_FORMS': 1, 'productusage_set-INITIAL_FORMS': 0,
+                'productusage_set-0-item': product.pk, 'productusage_set-0-unit': 1,
+                'productusage_set-0-quantity': '0.0000', 'productusage_set-0-price': '0',
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Manufacture.objects.get().productusage_set.count(), 4)
+        # the usage row sorts after the formula materials, one statement locks them all
+        self.assertEqual([set(args[0]) for args, kwargs in locked.call_args_list],
+                         [formula | {product.pk}])
+        if connection.features.has_select_for_update:
+            self.assertEqual(len([q for q in captured if 'FOR UPDATE' in q['sql']]), 1)
+
+    def test_delivery_form_reserves_stock(self):
+        item = InventoryItems.objects.get(code='602')
+        delivery = StockMovement.objects.create(
+            item=item, customer=Customer.objects.get(pk=1), datetime=timezone.now(),
+            quantity=Decimal('15.0000'), unit=item.unit, status='sent'
+        )
+
+        def form(quantity, instance=None):
+            return StockMovementForm(data={
+                'datetime': timezone.now(), 'quantity': quantity, 'item': item.pk,
+                'customer': 1, 'unit': item.unit_id, 'status': 'sent',
+            }, instance=instance)
+
+        with transaction.atomic():
+            self.assertFalse(form('6.0000').is_valid())
+            self.assertTrue(form('5.0000').is_valid())
+            # an edit only needs the stock added to what the delivery already took
+            self.assertTrue(form('20.0000', StockMovement.objects.get(pk=delivery.pk)).is_valid())
+            self.assertFalse(form('20.0001', StockMovement.objects.get(pk=delivery.pk)).is_valid())
+
+    def usage_formset(self, manufacture, rows):
+        """
+        Usage inline formset of ``manufacture`` posting ``[(usage, quantity)]``,
+        ``usage`` being ``None`` for new rows.
+        """
+        FormSet = inlineformset_factory(Manufacture, ProductUsage, form=ProductUsageInlineForm,
+                                        formset=ProductUsageInlineFormSet, extra=0)
+        item = InventoryItems.objects.get(code='602')
+        initial = [usage for usage, quantity in rows if usage is not None]
+        data = {
+            'productusage_set-TOTAL_FORMS': len(rows),
+            'productusage_set-INITIAL_FORMS': len(initial),
+        }
+        for i, (usage, quantity) in enumerate(rows):
+            data.update({
+                'productusage_set-{}-id'.format(i): usage.pk if usage else '',
+                'productusage_set-{}-manufacture'.format(i): manufacture.pk,
+                'productusage_set-{}-item'.format(i): item.pk,
+                'productusage_set-{}-unit'.format(i): item.unit_id,
+                'productusage_set-{}-quantity'.format(i): quantity,
+                'productusage_set-{}-price'.format(i): '0',
+            })
+        return FormSet(data, instance=manufacture)
+
+    def test_usage_formset_checks_edited_rows(self):
+        manufacture, msgs = self.create_manufacture(Decimal('0.0000'))
+        item = InventoryItems.objects.get(code='602')
+        usage = ProductUsage.objects.create(item=item, manufacture=manufacture,
+                                            quantity=Decimal('5.0000'), unit=item.unit)
+        self.assertEqual(item.availability(), Decimal('15.0000'))
+        with transaction.atomic():
+            # the edited row only needs the stock added to what it already took
+            self.assertTrue(self.usage_formset(manufacture, [(usage, '20.0000')]).is_valid())
+            self.assertFalse(self.usage_formset(manufacture, [(usage, '20.0001')]).is_valid())
+            self.assertFalse(self.usage_formset(manufacture, [(usage, '500.0000')]).is_valid())
+
+    def test_usage_formset_sums_rows_of_an_item(self):
+        manufacture, msgs = self.create_manufacture(Decimal('0.0000'))
+        item = InventoryItems.objects.get(code='602')
+        ProductUsage.objects.create(item=item, manufacture=manufacture,
+                                    quantity=Decimal('5.0000'), unit=item.unit)
+        with transaction.atomic():
+            # each row fits in the 15 available, both together do not
+            formset = self.usage_formset(manufacture, [(None, '10.0000'), (None, '10.0000')])
+            self.assertFalse(formset.is_valid())
+            self.assertTrue(all(form.non_field_errors() for form in formset.forms))
+            formset = self.usage_formset(manufacture, [(None, '10.0000'), (None, '5.0000')])
+            self.assertTrue(formset.is_valid())
+
+    def test_manufacture_creates_usages(self):
+        manufacture, msgs = self.create_manufacture(Decimal('10.0000'))
+        self.assertEqual(msgs, [])
+        usages = ProductUsage.objects.filter(manufacture=manufacture)
+        self.assertEqual(usages.count(), 3)
+        for usage in usages:
+            self.assertEqual(usage.item.availability(), usage.item.initial - usage.quantity)
+
+    def test_manufacture_reports_shortage(self):
+        manufacture, msgs = self.create_manufacture(Decimal('100.0000'))
+        self.assertEqual(len(msgs), 2)
+        self.assertEqual(ProductUsage.objects.filter(manufacture=manufacture).count(), 2)
+
+    def test_manufacture_save_query_count(self):
+        manufacture, msgs = self.create_manufacture(Decimal('1.0000'))
+        manufacture = Manufacture.objects.get(pk=manufacture.pk)
+        with self.assertNumQueries(5):
+            manufacture.save()
+
+        item = InventoryItems.objects.get(code='602')
+        usages = [ProductUsage(item=item, manufacture=manufacture, quantity=Decimal('0.0100'),
+                               unit=manufacture.unit) for i in range(40)]
+        ProductUsage.objects.bulk_create(usages)
+        rollups.record_created(ProductUsage, usages)
+        costing.record_created(ProductUsage, usages)
+        # repricing reads the item costs and updates the usage and output value rollups
+        with self.assertNumQueries(10):
+            manufacture.save()
+        self.assertEqual(manufacture.price, sum(
+            ProductUsage.objects.filter(manufacture=manufacture).values_list('price', flat=True)
+        ))
+
+
+class BillOfMaterialExplosionTest(TransactionTestCase):
+    fixtures = [
+        'unit_measurement.json', 'customer.json', 'customer_category.json',
+        'inventory_items.json', 'bill_of_material.json', 'bill_of_material_detail.json'
+    ]
+
+    def setUp(self):
+        cache.clear()
+        self.base = BillOfMaterial.objects.get(code='BT-001')
+        unit = UnitMeasurement.objects.get(pk=1)
+        product = InventoryItems.objects.create(
+            code='BT-002', name='Red Sampoerna Gloss', type='BT', unit=unit, price=0
+        )
+        self.nested = BillOfMaterial.objects.create(
+            code='BT-002', customer=self.base.customer,
+            customer_category=self.base.customer_category, color_name='Red', product=product
+        )
+        for material, quantity in ((self.base.product, '0.5000'),
+                                   (InventoryItems.objects.get(code='602'), '0.5000')):
+            BillOfMaterialDetails.objects.create(
+                bill_of_material=self.nested, material=material, quantity=Decimal(quantity),
+                unit=unit
+            )
+
+    def test_nested_formula_is_exploded(self):
+        required = bom.explode(self.nested.pk, Decimal('10'))
+        self.assertNotIn(self.base.product_id, required)
+        self.assertEqual(round(sum(required.values()), 4), Decimal('10.0000'))
+        raw = InventoryItems.objects.get(code='602')
+        self.assertEqual(round(required[raw.pk], 4), Decimal('5.0000'))
+        with self.assertNumQueries(0):
+            bom.explode(self.nested.pk, Decimal('20'))
+
+    def test_detail_change_invalidates_parent(self):
+        before = bom.requirement_vector(self.nested.pk)
+        detail = self.base.billofmaterialdetails_set.first()
+        detail.quantity += 1
+        detail.save()
+        self.assertNotEqual(bom.requirement_vector(self.nested.pk), before)
+
+    def test_type_change_invalidates_users(self):
+        product = self.base.product
+        self.assertNotIn(product.pk, bom.requirement_vector(self.nested.pk))
+        product.type = 'TTD'
+        product.save()
+        self.assertEqual(bom.requirement_vector(self.nested.pk)[product.pk], Decimal('0.5'))
+        product.type = 'BT'
+        product.save()
+        self.assertNotIn(product.pk, bom.requirement_vector(self.nested.pk))
+
+    def test_vector_resolved_before_commit(self):
+        before = bom.requirement_vector(self.nested.pk)
+        detail = self.base.billofmaterialdetails_set.first()
+        with transaction.atomic():
+            detail.quantity += 1
+            detail.save()
+            # another request, not seeing the change yet, caches the old vector
+            cache.set(bom._cache_key(self.nested.pk), before, timeout=None)
+        self.assertNotEqual(bom.requirement_vector(self.nested.pk), before)
+
+    def test_invalidation_seen_by_other_processes(self):
+        before = bom.requirement_vector(self.nested.pk)
+        detail = self.base.billofmaterialdetails_set.first()
+        other = caches.create_connection('default')
+        with mock.patch.object(bom, 'cache', other):
+            detail.quantity += 1
+            detail.save()
+        self.assertNotEqual(bom.requirement_vector(self.nested.pk), before)
+
+    def test_cycle_is_detected(self):
+        BillOfMaterialDetails.objects.create(
+            bill_of_material=self.base, material=self.nested.product, quantity=Decimal('0.1000'),
+            unit=self.nested.product.unit
+        )
+        with self.assertRaises(bom.BOMCycleError):
+            bom.requirement_vector(self.nested.pk)
+
+
+class FormulaBulkTest(TransactionTestCase):
+    fixtures = [
+        'unit_measurement.json', 'customer.json', 'customer_category.json',
+        'inventory_items.json', 'bill_of_material.json', 'bill_of_material_detail.json'
+    ]
+
+    def setUp(self):
+        cache.clear()
+        self.base = BillOfMaterial.objects.get(code='BT-001')
+
+    def lines(self, bom_id):
+        return dict(BillOfMaterialDetails.objects.filter(bill_of_material=bom_id).values_list(
+            'material__code', 'quantity'
+        ))
+
+    def test_copy_and_scale(self):
+        copies = formulas.copy([self.base.pk], code_suffix='-B')
+        copy = BillOfMaterial.objects.get(pk=copies[self.base.pk])
+        self.assertEqual(copy.code, 'BT-001-B')
+        self.assertEqual(self.lines(copy.pk), self.lines(self.base.pk))
+
+        bom.requirement_vector(copy.pk)
+        with self.assertNumQueries(5):
+            self.assertEqual(formulas.scale([self.base.pk, copy.pk], Decimal('2')), 6)
+        self.assertEqual(self.lines(copy.pk), {
+            '676': Decimal('1.6200'), '675': Decimal('0.1580'), '674': Decimal('0.1920')
+        })
+        self.assertEqual(BillOfMaterial.objects.get(pk=copy.pk).output_standard, Decimal('1.9700'))
+
+    def test_substitute(self):
+        copy_id = formulas.copy([self.base.pk])[self.base.pk]
+        replacement = InventoryItems.objects.get(code='602')
+        BillOfMaterialDetails.objects.create(bill_of_material_id=copy_id, material=replacement,
+                                             quantity=Decimal('0.1000'), unit_id=1)
+        material = InventoryItems.objects.get(code='674')
+        self.assertEqual(formulas.formulas_using([material.pk]), {self.base.pk, copy_id})
+        bom.requirement_vector(self.base.pk)
+
+        changed = formulas.substitute(material.pk, replacement.pk, Decimal('1.5'))
+        self.assertEqual(changed, {self.base.pk, copy_id})
+        self.assertEqual(self.lines(self.base.pk), {
+            '676': Decimal('0.8100'), '675': Decimal('0.0790'), '602': Decimal('0.1440')
+        })
+        self.assertEqual(self.lines(copy_id), {
+            '676': Decimal('0.8100'), '675': Decimal('0.0790'), '602': Decimal('0.2440')
+        })
+        self.assertEqual(BillOfMaterial.objects.get(pk=copy_id).output_standard, Decimal('1.1330'))
+        self.assertIn(replacement.pk, bom.requirement_vector(self.base.pk))
+        self.assertEqual(formulas.formulas_using([material.pk]), set())
+
+    def test_substitute_takes_replacement_unit(self):
+        replacement = InventoryItems.objects.get(code='602')
+        material = InventoryItems.objects.get(code='674')
+        InventoryItems.objects.filter(pk=replacement.pk).update(unit=2)
+        self.assertNotEqual(material.unit_id, 2)
+        formulas.substitute(material.pk, replacement.pk)
+        line = BillOfMaterialDetails.objects.get(bill_of_material=self.base, material=replacement)
+        self.assertEqual(line.unit_id, 2)
+
+    def test_admin_actions(self):
+        client = Client()
+        client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        url = '/admin/production/billofmaterial/'
+        data = {'action': 'substitute_material', '_selected_action': [self.base.pk]}
+        response = client.post(url, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'name="replacement"')
+
+        data.update(apply='Apply', material='674', replacement='602', ratio='1')
+        self.assertEqual(client.post(url, data).status_code, 302)
+        self.assertEqual(self.lines(self.base.pk)['602'], Decimal('0.0960'))
+
+        client.post(url, {'action': 'copy_bill_of_material', '_selected_action': [self.base.pk]})
+        self.assertEqual(BillOfMaterial.objects.filter(code='BT-001').count(), 2)
+
+
+class MaterialPlanningTest(TransactionTestCase):
+    fixtures = [
+        'unit_measurement.json', 'customer.json', 'customer_category.json',
+        'inventory_items.json', 'bill_of_material.json', 'bill_of_material_detail.json'
+    ]
+
+    def setUp(self):
+        for i in range(2):
+            manufacture_data_creation(Decimal('15.0000'))
+
+    def test_shortage_report(self):
+        lines = mrp.run()
+        self.assertEqual([line.code for line in lines], ['676'])
+        line = lines[0]
+        self.assertEqual(line.available, Decimal('20.0000'))
+        self.assertEqual(line.short, line.required - line.available)
+        self.assertEqual(len(mrp.run(shortages_only=False)), 3)
+
+    def test_done_orders_are_ignored(self):
+        Manufacture.objects.update(status='done')
+        self.assertEqual(mrp.run(shortages_only=False), [])
+
+    def nested_order(self, initial):
+        """
+        Order 10 of a formula using half a unit of the BT-001 product per unit,
+        with ``initial`` of that product in stock.
+        """
+        Manufacture.objects.all().delete()
+        base = BillOfMaterial.objects.get(code='BT-001')
+        unit = UnitMeasurement.objects.get(pk=1)
+        product = InventoryItems.objects.create(code='BT-002', name='Red Gloss', type='BT', unit=unit,
+                                                price=0)
+        nested = BillOfMaterial.objects.create(
+            code='BT-002', customer=base.customer, customer_category=base.customer_category,
+            color_name='Red', product=product
+        )
+        raw = InventoryItems.objects.get(code='602')
+        for material in (base.product, raw):
+            BillOfMaterialDetails.objects.create(bill_of_material=nested, material=material,
+                                                 quantity=Decimal('0.5000'), unit=unit)
+        Manufacture.objects.create(datetime=timezone.now(), bill_of_material=nested,
+                                   customer=base.customer, quantity=Decimal('10.0000'), unit=unit,
+                                   status='pending')
+        base.product.initial = initial
+        base.product.save()
+        return base, raw
+
+    def test_nested_nets_finished_goods(self):
+        base, raw = self.nested_order(Decimal('3.0000'))
+        expected = defaultdict(Decimal, {base.product_id: Decimal('5'), raw.pk: Decimal('5')})
+        # only the 2 not in stock are made from the formula of BT-001
+        for item_id, per_unit in bom.direct_vectors([base.pk])[base.pk].items():
+            expected[item_id] += 2 * per_unit
+        lines = mrp.run(nested=True, shortages_only=False)
+        self.assertEqual({line.item_id: line.required for line in lines},
+                         {item_id: round(quantity, 4) for item_id, quantity in expected.items()})
+        line = next(line for line in lines if line.item_id == base.product_id)
+        self.assertEqual(line.short, Decimal('2.0000'))
+
+    def test_nested_stock_covers_finished_goods(self):
+        base, raw = self.nested_order(Decimal('6.0000'))
+        lines = mrp.run(nested=True, shortages_only=False)
+        self.assertEqual({line.item_id: line.required for line in lines},
+                         {base.product_id: Decimal('5.0000'), raw.pk: Decimal('5.0000')})
+
+    def test_planning_form(self):
+        client = Client()
+        client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        response = client.get('/admin/production/manufacture/planning/')
+        self.assertTemplateUsed(response, 'admin/manufacture/material_planning.html')
+        response = client.post('/admin/production/manufacture/planning/', {'nested': 'on'})
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+    def test_query_count_does_not_grow(self):
+        mrp.run()
+        with self.assertNumQueries(5):
+            mrp.run()
+        for i in range(20):
+            manufacture_data_creation(Decimal('1.0000'))
+        with self.assertNumQueries(5):
+            mrp.run()
+
+
+class StreamingExportTest(TransactionTestCase):
+    fixtures = [
+        'unit_measurement.json', 'customer.json', 'customer_category.json',
+        'inventory_items.json'
+    ]
+
+    def setUp(self):
+        item = InventoryItems.objects.get(code='602')
+        for i in range(3):
+            StockMovement.objects.create(
+                item=item, customer=Customer.objects.get(pk=1), datetime=timezone.now(),
+                quantity=Decimal('1.5000'), unit=UnitMeasurement.objects.get(pk=1),
+                delivery_order='DO-{}'.format(i), status='sent'
+            )
+        self.model_admin = site._registry[StockMovement]
+
+    def export(self, file_format):
+        formats = [f.__name__ for f in self.model_admin.get_export_formats()]
+        request = RequestFactory().post('/', {'file_format': formats.index(file_format)})
+        request.user = User(is_superuser=True, is_staff=True)
+        return self.model_admin.export_action(request)
+
+    def test_csv_is_streamed(self):
+        labels = {'model': 'production.stockmovement', 'format': 'csv'}
+        exported = REGISTRY.get_sample_value('production_export_rows_total', labels) or 0
+        response = self.export('CSV')
+        self.assertTrue(response.streaming)
+        with self.assertNumQueries(1):
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(REGISTRY.get_sample_value('production_export_rows_total', labels),
+                         exported + 3)
+        self.assertEqual(lines[0].split(',')[:3], ['Date', 'Delivery Order', 'JO Number'])
+        self.assertEqual(len(lines), 4)
+        self.assertIn('1.5000', lines[1])
+
+    def test_xlsx_is_streamed(self):
+        response = self.export('XLSX')
+        self.assertTrue(response.streaming)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'PK'))
+
+
+class KeysetPaginationTest(TransactionTestCase):
+    fixtures = [
+        'unit_measurement.json', 'customer.json', 'customer_category.json',
+        'inventory_items.json'
+    ]
+
+    def setUp(self):
+        item = InventoryItems.objects.get(code='602')
+        now = timezone.now()
+        for i in range(7):
+            # pairs of deliveries at the same time are told apart by id
+            StockMovement.objects.create(
+                item=item, customer=Customer.objects.get(pk=1),
+                datetime=now - datetime.timedelta(hours=i // 2),
+                quantity=Decimal('1.0000'), unit=UnitMeasurement.objects.get(pk=1),
+                delivery_order='DO-{}'.format(i), status='sent'
+            )
+        self.expected = list(StockMovement.objects.order_by('-datetime', '-pk').values_list(
+            'pk', flat=True
+        ))
+        model_admin = site._registry[StockMovement]
+        model_admin.list_per_page, model_admin.list_max_show_all = 3, 5
+        self.addCleanup(setattr, model_admin, 'list_per_page', 25)
+        self.addCleanup(delattr, model_admin, 'list_max_show_all')
+        self.client = Client()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+
+    def page(self, query=''):
+        response = self.client.get('/admin/production/stockmovement/' + query)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def test_pages_follow_cursor(self):
+        cl = self.page()
+        self.assertTrue(cl.keyset)
+        self.assertEqual(cl.result_count, 7)
+        self.assertIsNone(cl.keyset_previous)
+        seen = [[obj.pk for obj in cl.result_list]]
+        while cl.keyset_next:
+            cl = self.page(cl.keyset_next)
+            seen.append([obj.pk for obj in cl.result_list])
+        self.assertEqual(seen, [self.expected[:3], self.expected[3:6], self.expected[6:]])
+
+        cl = self.page(cl.keyset_previous)
+        self.assertEqual([obj.pk for obj in cl.result_list], self.expected[3:6])
+        cl = self.page(cl.keyset_previous)
+        self.assertEqual([obj.pk for obj in cl.result_list], self.expected[:3])
+        self.assertIsNone(cl.keyset_previous)
+
+    def test_pages_do_not_offset(self):
+        cl = self.page()
+        with CaptureQueriesContext(connection) as queries:
+            self.page(cl.keyset_next)
+        self.assertFalse([query for query in queries if 'OFFSET' in query['sql']])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/admin/production/stockmovement/', {'after': 'soon,1'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_sorted_and_show_all(self):
+        cl = self.page('?o=1')
+        self.assertFalse(cl.keyset)
+        self.assertEqual(cl.paginator.num_pages, 3)
+        StockMovement.objects.filter(pk__in=self.expected[:3]).delete()
+        cl = self.page('?all=')
+        self.assertEqual(len(cl.result_list), 4)
+        paginator = pagination.EstimatedCountPaginator(StockMovement.objects.order_by('pk'), 3)
+        self.assertEqual(paginator.count, 4)
+        self.assertFalse(paginator.estimated)
+
+
+class MetricsTest(TransactionTestCase):
+    fixtures = ['unit_measurement.json']
+
+    def test_requests_are_measured(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        client = Client()
+        client.force_login(user)
+        view = 'admin:production_unitmeasurement_changelist'
+        count = REGISTRY.get_sample_value(
+            'django_request_seconds_count', {'view': view, 'method': 'GET'}
+        ) or 0
+        self.assertEqual(client.get('/admin/production/unitmeasurement/').status_code, 200)
+        self.assertEqual(REGISTRY.get_sample_value(
+            'django_request_seconds_count', {'view': view, 'method': 'GET'}
+        ), count + 1)
+        self.assertGreater(
+            REGISTRY.get_sample_value('django_request_queries_sum', {'view': view}), 0
+        )
+
+        # no address is allowed by default outside DEBUG
+        self.assertEqual(client.get('/metrics').status_code, 403)
+        with override_settings(METRICS_ALLOWED_IPS=['127.0.0.1'], METRICS_TOKEN='scrape'):
+            response = client.get('/metrics')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'django_request_query_seconds_bucket', response.content)
+            self.assertEqual(client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+            # every request comes from the loopback address behind a local proxy
+            anonymous = Client()
+            self.assertEqual(anonymous.get('/metrics').status_code, 403)
+            self.assertEqual(anonymous.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code,
+                             403)
+            self.assertEqual(anonymous.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape').status_code,
+                             200)
+            user.is_staff = False
+            user.save()
+            self.assertEqual(client.get('/metrics').status_code, 403)
+
+
+class PendingExecutor(object):
+    """
+    Pool keeping its jobs pending, or failing them with ``error``.
+    """
+    def __init__(self, error=None):
+        self.error = error
+
+    def submit(self, fn, *args):
+        future = Future()
+        if self.error:
+            future.set_exception(self.error)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+@override_settings(HTML2PDF_CACHE=False)
+class HTML2PDFJobTest(TransactionTestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.template = engines['django'].from_string('<p>{{ text }}</p>')
+
+    def tearDown(self):
+        jobs._executor = None
+
+    def submit(self, executor):
+        """
+        Print through ``executor`` and return the id of the job polled by the page.
+        """
+        jobs._executor = executor
+        request = RequestFactory().get('/')
+        response = HTML2PDFResponse(request, self.template, {'text': 'Hello'},
+                                    filename='hello.pdf', asynchronous=True).render()
+        if isinstance(executor, ThreadPoolExecutor):
+            executor.shutdown(wait=True)
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+        self.assertNotIn('Content-Disposition', response)
+        return re.search(r'/html2pdf/jobs/([0-9a-f]{32})/', response.content.decode()).group(1)
+
+    def job_status(self, job_id):
+        return self.client.get('/html2pdf/jobs/{}/'.format(job_id)).json()['status']
+
+    def test_job_is_polled_until_done(self):
+        job_id = self.submit(PendingExecutor())
+        self.assertEqual(self.job_status(job_id), 'pending')
+        self.assertEqual(self.client.get('/html2pdf/jobs/{}/download/'.format(job_id)).status_code,
+                         404)
+
+        job_id = self.submit(ThreadPoolExecutor(max_workers=1))
+        data = self.client.get('/html2pdf/jobs/{}/'.format(job_id)).json()
+        self.assertEqual(data['status'], 'done')
+        response = self.client.get(data['download_url'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.assertIn('hello.pdf', response['Content-Disposition'])
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get('/html2pdf/jobs/{}/'.format('0' * 32)).status_code, 404)
+        self.assertEqual(self.client.get('/html2pdf/jobs/nope/').status_code, 404)
+
+    def test_failed_render(self):
+        with mock.patch.object(jobs, 'write_pdf', side_effect=ValueError("bad document")):
+            job_id = self.submit(ThreadPoolExecutor(max_workers=1))
+        self.assertEqual(self.job_status(job_id), 'failed')
+        self.assertEqual(self.client.get('/html2pdf/jobs/{}/download/'.format(job_id)).status_code,
+                         404)
+
+    def test_broken_pool_fails_jobs(self):
+        job_id = self.submit(PendingExecutor(BrokenProcessPool("worker died")))
+        self.assertEqual(self.job_status(job_id), 'failed')
+        self.assertIsNone(jobs._executor)
+
+        executor = mock.Mock(**{'submit.side_effect': BrokenProcessPool("worker died")})
+        job_id = self.submit(executor)
+        self.assertEqual(self.job_status(job_id), 'failed')
+        self.assertIsNone(jobs._executor)
+
+    def test_stale_pending_job(self):
+        job_id = self.submit(PendingExecutor())
+        with override_settings(HTML2PDF_JOB_TIMEOUT=-1):
+            self.assertEqual(self.job_status(job_id), 'failed')
+
+
+@override_settings(HTML2PDF_CACHE=True)
+class HTML2PDFCacheTest(TransactionTestCase):
+
+    def setUp(self):
+        self.template = engines['django'].from_string('<p>{{ text }}</p><p>{{ date }}</p>')
+
+    def get(self, text='Hello', **headers):
+        request = RequestFactory().get('/', **headers)
+        return HTML2PDFResponse(request, self.template, {'text': text, 'date': timezone.now()},
+                                filename='hello.pdf', asynchronous=False).render()
+
+    def test_documents_are_reused(self):
+        first = self.get()
+        self.assertTrue(first.content.startswith(b'%PDF'))
+        self.assertIn('Last-Modified', first)
+        self.assertTrue(pdf_cache.cache_root().startswith(storage_root.name))
+        hits = REGISTRY.get_sample_value('html2pdf_cache_lookups_total', {'result': 'hit'}) or 0
+
+        # printed later, only the print time differs
+        with mock.patch.object(jobs, 'write_pdf') as write_pdf:
+            second = self.get()
+        write_pdf.assert_not_called()
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(
+            REGISTRY.get_sample_value('html2pdf_cache_lookups_total', {'result': 'hit'}), hits + 1
+        )
+        self.assertNotEqual(self.get('Changed')['ETag'], first['ETag'])
+
+    def test_conditional_get(self):
+        first = self.get()
+        for headers in ({'HTTP_IF_NONE_MATCH': first['ETag']},
+                        {'HTTP_IF_MODIFIED_SINCE': first['Last-Modified']}):
+            response = self.get(**headers)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+            self.assertNotIn('Content-Disposition', response)
+
+        response = self.get('Changed', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+    def test_layouts_show_print_time(self):
+        request = RequestFactory().get('/')
+        response = HTML2PDFResponse(request, 'admin/inventory/inventory_item_pdf_layout.html', {
+            'item_list': [], 'page_title': "Daftar", 'date': datetime.datetime(2020, 5, 4, 13, 45),
+        })
+        self.assertIn(b'2020-05-04 - 13:45', response.render_html())
+
+
+class AutocompleteSearchTest(TransactionTestCase):
+    fixtures = [
+        'unit_measurement.json', 'customer.json', 'customer_category.json',
+        'inventory_items.json', 'bill_of_material.json'
+    ]
+
+    def setUp(self):
+        cache.clear()
+
+    def codes(self, term, model=InventoryItems):
+        return [obj.code for obj in search.search(model.objects.all(), term)]
+
+    def test_ranking(self):
+        self.assertEqual(self.codes('602')[0], '602')
+        self.assertEqual(self.codes('max opaque')[0], '602')
+        # misspelt words are still found
+        self.assertEqual(self.codes('opaqe')[0], '602')
+        self.assertEqual(set(self.codes('magenta')[:2]), {'603', '662'})
+        self.assertEqual(self.codes('sampoerna', BillOfMaterial), ['BT-001'])
+        self.assertEqual(self.codes(''), [])
+
+    def test_index_follows_changes(self):
+        self.assertEqual(self.codes('sampoerna', BillOfMaterial), ['BT-001'])
+        item = InventoryItems.objects.get(code='BT-001')
+        item.name = 'Blue Marlboro'
+        item.save()
+        self.assertEqual(self.codes('marlboro', BillOfMaterial), ['BT-001'])
+        InventoryItems.objects.create(code='TTD-900', name='Opaque Silver', type='TTD',
+                                      unit=item.unit, price=1, initial=0)
+        self.assertIn('TTD-900', self.codes('opaque'))
+
+    def test_index_renewed_by_other_processes(self):
+        index = search.ngram_index(InventoryItems)
+        with mock.patch.object(search, 'cache', caches.create_connection('default')):
+            search.invalidate(InventoryItems)
+        self.assertIsNot(search.ngram_index(InventoryItems), index)
+
+    def test_index_built_before_commit(self):
+        stale = search.NgramIndex(BillOfMaterial)
+        item = InventoryItems.objects.get(code='BT-001')
+        with transaction.atomic():
+            item.name = 'Blue Marlboro'
+            item.save()
+            # another request, not seeing the rename yet, builds the index
+            stale.version = search.ngram_index(BillOfMaterial).version
+            search._indexes[BillOfMaterial] = stale
+        self.assertEqual(self.codes('marlboro', BillOfMaterial), ['BT-001'])
+
+    def test_filtered_queryset_before_cut(self):
+        unit = UnitMeasurement.objects.get(pk=1)
+        InventoryItems.objects.bulk_create([
+            InventoryItems(code='TTD-9{:02}'.format(i), name='Opaque Silver', type='TTD', unit=unit,
+                           price=1)
+            for i in range(search.CANDIDATES + 10)
+        ])
+        InventoryItems.objects.create(code='BT-900', name='Opaque Gold', type='BT', unit=unit,
+                                      price=1)
+        finished = InventoryItems.objects.filter(type='BT')
+        self.assertEqual([obj.code for obj in search.search(finished, 'opaque')], ['BT-900'])
+        self.assertEqual([obj.code for obj in search.search(finished, 'opaqe gld')], ['BT-900'])
+
+    def test_autocomplete_lookup(self):
+        client = Client()
+        client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        response = client.get('/grappelli/lookup/autocomplete/', {
+            'term': 'opaqe whte', 'app_label': 'production', 'model_name': 'inventoryitems',
+        })
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data[0]['value'], InventoryItems.objects.get(code='602').pk)
+
+
+class BulkImportTest(TransactionTestCase):
+    fixtures = [
+        'unit_measurement.json', 'customer.json', 'customer_category.json', 'supplier.json',
+        'inventory_items.json'
+    ]
+
+    def setUp(self):
+        self.item = InventoryItems.objects.get(code='602')
+        self.item.availability()
+        self.now = timezone.localtime().strftime('%Y-%m-%d %H:%M:%S')
+
+    def dataset(self, headers, rows):
+        return Dataset(*rows, headers=headers)
+
+    def test_receipts_are_imported_in_bulk(self):
+        supplier = Supplier.objects.first()
+        rows = [(self.item.pk, supplier.pk, 1, self.now, '5.0000', '100', 'receipt')
+                for i in range(10)]
+        rows.append((self.item.pk, supplier.pk, 1, self.now, '2.0000', '100', 'return'))
+        dataset = self.dataset(
+            ['item', 'supplier', 'unit', 'datetime', 'quantity', 'price', 'status'], rows
+        )
+        result = StockLevelImportResource().import_data(dataset, raise_errors=True)
+        self.assertFalse(result.has_validation_errors())
+        self.assertEqual(StockLevel.objects.filter(quantity__lt=0).count(), 1)
+        self.assertEqual(self.item.availability(), Decimal('68.0000'))
+        self.assertEqual(StockBalance.objects.get(item=self.item).available,
+                         rebuilt_available(self.item))
+
+    def test_deliveries_exceeding_stock_are_rejected(self):
+        customer = Customer.objects.get(pk=1)
+        rows = [(self.item.pk, customer.pk, 1, self.now, '15.0000', 'sent'),
+                (self.item.pk, customer.pk, 1, self.now, '15.0000', 'sent')]
+        dataset = self.dataset(['item', 'customer', 'unit', 'datetime', 'quantity', 'status'], rows)
+        result = StockMovementImportResource().import_data(dataset)
+        self.assertTrue(result.has_validation_errors())
+        self.assertEqual(StockMovement.objects.count(), 0)
+        self.assertEqual(self.item.availability(), Decimal('20.0000'))
+
+        del dataset[1]
+        result = StockMovementImportResource().import_data(dataset)
+        self.assertFalse(result.has_validation_errors())
+        self.assertEqual(self.item.availability(), Decimal('5.0000'))
+
+
+@override_settings(HTML2PDF_CACHE=False)
+class ReportDataFrameTest(TransactionTestCase):
+    fixtures = [
+        'unit_measurement.json', 'customer.json', 'customer_category.json',
+        'inventory_items.json', 'bill_of_material.json', 'bill_of_material_detail.json'
+    ]
+
+    def setUp(self):
+        request = RequestFactory().post('/')
+        request.session = {}
+        request._messages = default_storage(request)
+        for quantity in (Decimal('4.0000'), Decimal('6.0000')):
+            manufacture = Manufacture(
+                datetime=timezone.now(), bill_of_material=BillOfMaterial.objects.get(code='BT-001'),
+                customer=Customer.objects.get(pk=1), quantity=quantity,
+                unit=UnitMeasurement.objects.get(pk=1), status='pending'
+            )
+            site._registry[Manufacture].save_model(request, manufacture, None, False)
+
+    def test_single_fetch_into_typed_columns(self):
+        with self.assertNumQueries(1):
+            data_frame = reports.data_frame(ProductUsage.objects.all(), {
+                'date': 'manufacture__datetime__date',
+                'item_code': 'item__code',
+                'quantity': 'quantity',
+            })
+        self.assertEqual(len(data_frame), 6)
+        self.assertEqual(data_frame['quantity'].dtype, float)
+        self.assertAlmostEqual(data_frame['quantity'].sum(), 10.0, places=3)
+        self.assertEqual(data_frame['date'][0], timezone.localdate())
+
+    def test_empty_queryset(self):
+        data_frame = reports.data_frame(ProductUsage.objects.none(), {'quantity': 'quantity'})
+        self.assertEqual(list(data_frame.columns), ['quantity'])
+        self.assertEqual(len(data_frame), 0)
+
+    def test_usage_reports(self):
+        today = timezone.localdate()
+        model_admin = site._registry[ProductUsage]
+        for report_type, queries in (('material', 1), ('product', 2)):
+            request = RequestFactory().post('/', {
+                'start_date': today, 'end_date': today, 'report_type': report_type
+            })
+            request.user = User(is_superuser=True, is_staff=True)
+            with self.assertNumQueries(queries):
+                response = model_admin.print(request).render()
+            self.assertTrue(response.content.startswith(b'%PDF'))
+            self.assertIn(report_type, response['Content-Disposition'])
+
+    def test_usage_report_cache(self):
+        today = timezone.localdate()
+        model_admin = site._registry[ProductUsage]
+
+        def report():
+            return model_admin.report_context(today, today, 'material')['report']
+
+        first = reports.cached('test-usage', today, today, report)
+        with self.assertNumQueries(0):
+            self.assertEqual(reports.cached('test-usage', today, today, report), first)
+
+        Manufacture.objects.create(
+            datetime=timezone.now() - datetime.timedelta(days=3),
+            bill_of_material=BillOfMaterial.objects.get(code='BT-001'),
+            customer=Customer.objects.get(pk=1), quantity=Decimal('1.0000'),
+            unit=UnitMeasurement.objects.get(pk=1), status='pending'
+        )
+        with self.assertNumQueries(0):
+            reports.cached('test-usage', today, today, report)
+
+        ProductUsage.objects.first().delete()
+        with self.assertNumQueries(1):
+            self.assertNotEqual(reports.cached('test-usage', today, today, report), first)
+
+    def test_usage_report_built_before_commit(self):
+        today = timezone.localdate()
+        reports.cached('test-usage', today, today, lambda: 'old')
+        with transaction.atomic():
+            ProductUsage.objects.first().delete()
+            # another request, not seeing the delete yet, builds the report
+            reports.cached('test-usage', today, today, lambda: 'old')
+        self.assertEqual(reports.cached('test-usage', today, today, lambda: 'new'), 'new')
+
+    def test_usage_report_cache_expired_by_other_processes(self):
+        today = timezone.localdate()
+        calls = []
+
+        def report():
+            calls.append(today)
+            return len(calls)
+
+        reports.cached('test-usage', today, today, report)
+        # another process has its own cache connection to the same storage
+        with mock.patch.object(reports, 'cache', caches.create_connection('default')):
+            reports.invalidate(timezone.now())
+        self.assertEqual(reports.cached('test-usage', today, today, report), 2)
+        with mock.patch.object(reports, 'cache', caches.create_connection('default')):
+            self.assertEqual(reports.cached('test-usage', today, today, report), 2)
+
+    def test_usage_report_cache_expired_by_renames(self):
+        today = timezone.localdate()
+        model_admin = site._registry[ProductUsage]
+
+        def report():
+            return model_admin.report_context(today, today, 'product')['summary']
+
+        item = InventoryItems.objects.get(pk=BillOfMaterial.objects.get(code='BT-001').product_id)
+        self.assertIn(item.name, reports.cached('test-usage', today, today, report))
+        item.name = 'Renamed product'
+        item.save()
+        self.assertIn('Renamed product', reports.cached('test-usage', today, today, report))
+
+        with self.assertNumQueries(0):
+            reports.cached('test-usage', today, today, report)
+        rollups.rebuild(today, today)
+        with self.assertNumQueries(2):
+            reports.cached('test-usage', today, today, report)
+
+    def test_process_local_cache_check(self):
+        self.assertEqual(checks.shared_cache_check(None), [])
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+        }}):
+            errors = checks.shared_cache_check(None)
+        self.assertEqual([error.id for error in errors], ['production.W001'])
+
+
+class ItemCostTest(TransactionTestCase):
+    fixtures = [
+        'unit_measurement.json', 'customer.json', 'customer_category.json', 'supplier.json',
+        'inventory_items.json', 'bill_of_material.json', 'bill_of_material_detail.json'
+    ]
+
+    def costs(self):
+        return sorted(ItemCost.objects.filter(item__code__in=['602', 'BT-001']).values_list(
+            'item', 'quantity', 'average', 'value'
+        ))
+
+    def test_moving_average(self):
+        item = InventoryItems.objects.get(code='602')
+        unit = UnitMeasurement.objects.get(pk=1)
+        now = timezone.now()
+        self.assertEqual(item.current_cost(), Decimal('10000.0000'))
+        receipt = StockLevel.objects.create(
+            item=item, datetime=now - datetime.timedelta(days=3), quantity=Decimal('10.0000'),
+            price=Decimal('13000.0000'), unit=unit, status='receipt',
+            supplier=Supplier.objects.first()
+        )
+        self.assertEqual(item.current_cost(), Decimal('11000.0000'))
+        StockMovement.objects.create(
+            item=item, customer=Customer.objects.get(pk=1), datetime=now - datetime.timedelta(days=2),
+            quantity=Decimal('6.0000'), unit=unit, status='sent'
+        )
+        self.assertEqual(item.current_cost(), Decimal('11000.0000'))
+        StockLevel.objects.create(
+            item=item, datetime=now - datetime.timedelta(days=1), quantity=Decimal('-4.0000'),
+            price=Decimal('13000.0000'), unit=unit, status='return',
+            supplier=Supplier.objects.first()
+        )
+        self.assertEqual(item.current_cost(), Decimal('10600.0000'))
+
+        manufacture_data_creation(Decimal('1.0000'))
+        manufacture = Manufacture.objects.get()
+        usage = ProductUsage.objects.create(item=item, manufacture=manufacture,
+                                            quantity=Decimal('5.0000'), unit=unit)
+        self.assertEqual(usage.price, Decimal('53000.0000'))
+        manufacture.status = 'done'
+        manufacture.save()
+        self.assertEqual(manufacture.price, Decimal('53000.0000'))
+        self.assertEqual(manufacture.bill_of_material.product.current_cost(),
+                         Decimal('53000.0000'))
+
+        incremental = self.costs()
+        self.assertEqual(ItemCost.objects.get(item=item).quantity, Decimal('15.0000'))
+        costing.rebuild()
+        self.assertEqual(self.costs(), incremental)
+
+        # removing a consumed receipt takes its own value out, replaying the
+        # history in date order prices the later movements without it
+        receipt.delete()
+        self.assertEqual(item.current_cost(), Decimal('5800.0000'))
+        costing.rebuild([item.pk])
+        self.assertEqual(item.current_cost(), Decimal('8800.0000'))
+        self.assertEqual(ItemCost.objects.get(item=item).value, Decimal('44000.0000'))
+
+
+class StockLotTest(TransactionTestCase):
+    fixtures = [
+        'unit_measurement.json', 'customer.json', 'customer_category.json', 'supplier.json',
+        'inventory_items.json', 'bill_of_material.json', 'bill_of_material_detail.json'
+    ]
+
+    def setUp(self):
+        self.item = InventoryItems.objects.get(code='602')
+        self.unit = UnitMeasurement.objects.get(pk=1)
+        self.now = timezone.now()
+        lots.rebuild([self.item.pk])
+
+    def receive(self, days, quantity):
+        return StockLevel.objects.create(
+            item=self.item, datetime=self.now - datetime.timedelta(days=days), quantity=quantity,
+            price=Decimal('10000.0000'), unit=self.unit, status='receipt',
+            supplier=Supplier.objects.first()
+        )
+
+    def remaining(self):
+        return [(lot.receipt_id, lot.remaining) for lot, remaining in lots.remaining(self.item.pk)]
+
+    def state(self, item=None):
+        item = item or self.item
+        return (
+            list(StockLot.objects.filter(item=item).order_by('received_at').values_list(
+                'receipt', 'quantity', 'remaining'
+            )),
+            sorted(LotConsumption.objects.filter(item=item).values_list(
+                'lot__receipt', 'usage', 'movement', 'returned', 'quantity'
+            ), key=str)
+        )
+
+    def test_first_in_first_out(self):
+        first = self.receive(3, Decimal('10.0000'))
+        second = self.receive(2, Decimal('5.0000'))
+        self.assertEqual(self.remaining(), [
+            (None, Decimal('20.0000')), (first.pk, Decimal('10.0000')), (second.pk, Decimal('5.0000'))
+        ])
+
+        delivery = StockMovement.objects.create(
+            item=self.item, customer=Customer.objects.get(pk=1),
+            datetime=self.now - datetime.timedelta(days=1), quantity=Decimal('25.0000'),
+            unit=self.unit, status='sent'
+        )
+        self.assertEqual(self.remaining(), [(first.pk, Decimal('5.0000')), (second.pk, Decimal('5.0000'))])
+
+        manufacture_data_creation(Decimal('1.0000'))
+        manufacture = Manufacture.objects.get()
+        usage = ProductUsage.objects.create(item=self.item, manufacture=manufacture,
+                                            quantity=Decimal('8.0000'), unit=self.unit)
+        self.assertEqual(self.remaining(), [(second.pk, Decimal('2.0000'))])
+        # the receipts a manufacture used are traceable from its usages
+        self.assertEqual(sorted(LotConsumption.objects.filter(
+            usage__manufacture=manufacture
+        ).values_list('lot__receipt', 'quantity')), [
+            (first.pk, Decimal('5.0000')), (second.pk, Decimal('3.0000'))
+        ])
+        incremental = self.state()
+        lots.rebuild([self.item.pk])
+        self.assertEqual(self.state(), incremental)
+
+        delivery.quantity = Decimal('20.0000')
+        delivery.save()
+        self.assertEqual(self.remaining(), [(first.pk, Decimal('5.0000')), (second.pk, Decimal('2.0000'))])
+
+        usage.delete()
+        self.assertEqual(self.remaining(), [(first.pk, Decimal('10.0000')), (second.pk, Decimal('5.0000'))])
+        self.assertFalse(LotConsumption.objects.filter(usage__isnull=False).exists())
+
+        StockLevel.objects.create(
+            item=self.item, datetime=self.now, quantity=Decimal('-12.0000'),
+            price=Decimal('10000.0000'), unit=self.unit, status='return',
+            supplier=Supplier.objects.first()
+        )
+        self.assertEqual(self.remaining(), [(second.pk, Decimal('3.0000'))])
+        incremental = self.state()
+        lots.rebuild([self.item.pk])
+        self.assertEqual(self.state(), incremental)
+
+    def test_migration_populates_lots(self):
+        self.receive(3, Decimal('10.0000'))
+        self.receive(2, Decimal('5.0000'))
+        StockMovement.objects.create(
+            item=self.item, customer=Customer.objects.get(pk=1),
+            datetime=self.now - datetime.timedelta(days=1), quantity=Decimal('25.0000'),
+            unit=self.unit, status='sent'
+        )
+        manufacture_data_creation(Decimal('1.0000'))
+        ProductUsage.objects.create(item=self.item, manufacture=Manufacture.objects.get(),
+                                    quantity=Decimal('12.0000'), unit=self.unit)
+        StockLevel.objects.create(
+            item=self.item, datetime=self.now, quantity=Decimal('-2.0000'),
+            price=Decimal('10000.0000'), unit=self.unit, status='return',
+            supplier=Supplier.objects.first()
+        )
+        items = list(InventoryItems.objects.all())
+        lots.rebuild()
+        rebuilt = [self.state(item) for item in items]
+        LotConsumption.objects.all().delete()
+        StockLot.objects.all().delete()
+        migration = importlib.import_module('production.migrations.0007_stock_lots')
+        migration.populate_lots(django_apps, None)
+        self.assertEqual([self.state(item) for item in items], rebuilt)
+
+    def assertRebuilt(self, *items):
+        incremental = [self.state(item) for item in items]
+        lots.rebuild([item.pk for item in items])
+        self.assertEqual([self.state(item) for item in items], incremental)
+
+    def test_receipt_changes_replay_consumers(self):
+        first = self.receive(3, Decimal('10.0000'))
+        second = self.receive(2, Decimal('5.0000'))
+        StockMovement.objects.create(
+            item=self.item, customer=Customer.objects.get(pk=1),
+            datetime=self.now - datetime.timedelta(days=1), quantity=Decimal('28.0000'),
+            unit=self.unit, status='sent'
+        )
+
+        first.quantity = Decimal('6.0000')
+        first.save()
+        self.assertEqual(self.remaining(), [(second.pk, Decimal('3.0000'))])
+        self.assertRebuilt(self.item)
+
+        first.delete()
+        self.assertEqual(self.remaining(), [])
+        self.assertEqual(LotConsumption.objects.get(lot__isnull=True).quantity, Decimal('3.0000'))
+        self.assertRebuilt(self.item)
+
+        other = InventoryItems.objects.get(code='603')
+        second.item = other
+        second.save()
+        self.assertEqual(LotConsumption.objects.get(lot__isnull=True).quantity, Decimal('8.0000'))
+        self.assertEqual(StockLot.objects.get(receipt=second).remaining, Decimal('5.0000'))
+        self.assertFalse(StockLot.objects.filter(remaining__lt=0).exists())
+        self.assertRebuilt(self.item, other)
+
+    def test_opening_shrunk_below_consumed(self):
+        receipt = self.receive(3, Decimal('10.0000'))
+        StockMovement.objects.create(
+            item=self.item, customer=Customer.objects.get(pk=1), datetime=self.now,
+            quantity=Decimal('15.0000'), unit=self.unit, status='sent'
+        )
+        self.assertEqual(self.remaining(), [(None, Decimal('5.0000')), (receipt.pk, Decimal('10.0000'))])
+        self.item.initial = Decimal('5.0000')
+        self.item.save()
+        self.assertEqual(self.remaining(), [])
+        self.assertRebuilt(self.item)
+
+    def test_unmatched_consumption(self):
+        StockMovement.objects.create(
+            item=self.item, customer=Customer.objects.get(pk=1), datetime=self.now,
+            quantity=Decimal('26.0000'), unit=self.unit, status='sent'
+        )
+        self.assertEqual(self.remaining(), [])
+        self.assertEqual(LotConsumption.objects.get(lot__isnull=False).quantity, Decimal('20.0000'))
+        self.assertEqual(LotConsumption.objects.get(lot__isnull=True).quantity, Decimal('6.0000'))
+
+
+class DailyRollupTest(TransactionTestCase):
+    fixtures = [
+        'unit_measurement.json', 'customer.json', 'customer_category.json', 'supplier.json',
+        'inventory_items.json', 'bill_of_material.json', 'bill_of_material_detail.json'
+    ]
+
+    def rollup_rows(self):
+        return (
+            sorted(DailyItemRollup.objects.exclude(
+                purchased=0, purchased_value=0, delivered=0, used=0, used_value=0, output=0,
+                output_value=0
+            ).values_list('date', 'item', 'purchased', 'purchased_value', 'delivered', 'used',
+                          'used_value', 'output', 'output_value')),
+            sorted(DailyUsageRollup.objects.exclude(quantity=0, value=0).values_list(
+                'date', 'product', 'item', 'quantity', 'value'
+            )),
+        )
+
+    def test_incremental_rollups_match_rebuild(self):
+        item = InventoryItems.objects.get(code='602')
+        unit = UnitMeasurement.objects.get(pk=1)
+        receipt = StockLevel.objects.create(
+            item=item, datetime=timezone.now(), quantity=Decimal('5.0000'),
+            price=Decimal('100.0000'), unit=unit, status='receipt',
+            supplier=Supplier.objects.first()
+        )
+        receipt.datetime -= datetime.timedelta(days=2)
+        receipt.quantity = Decimal('7.0000')
+        receipt.save()
+        StockMovement.objects.create(
+            item=item, customer=Customer.objects.get(pk=1), datetime=timezone.now(),
+            quantity=Decimal('2.0000'), unit=unit, status='sent'
+        )
+        manufacture_data_creation(Decimal('10.0000'))
+        manufacture = Manufacture.objects.get()
+        ProductUsage.objects.create(item=item, manufacture=manufacture,
+                                    quantity=Decimal('3.0000'), unit=unit)
+        manufacture.save()
+        ProductUsage.objects.create(item=item, manufacture=manufacture,
+                                    quantity=Decimal('1.0000'), unit=unit).delete()
+
+        incremental = self.rollup_rows()
+        self.assertEqual(incremental[0][0][2], Decimal('7.0000'))
+        self.assertEqual(len(incremental[1]), 1)
+        rollups.rebuild()
+        self.assertEqual(self.rollup_rows(), incremental)
+
+        manufacture.delete()
+        incremental = self.rollup_rows()
+        self.assertEqual(incremental[1], [])
+        rollups.rebuild()
+        self.assertEqual(self.rollup_rows(), incremental)
+
+    def test_moved_manufacture_moves_usages(self):
+        unit = UnitMeasurement.objects.get(pk=1)
+        manufacture_data_creation(Decimal('10.0000'))
+        manufacture = Manufacture.objects.get()
+        for code, quantity in (('602', '3.0000'), ('602', '1.0000'), ('603', '2.0000')):
+            ProductUsage.objects.create(item=InventoryItems.objects.get(code=code),
+                                        manufacture=manufacture, quantity=Decimal(quantity),
+                                        unit=unit, price=Decimal('10.0000'))
+        base = manufacture.bill_of_material
+        product = InventoryItems.objects.create(code='BT-002', name='Red Gloss', type='BT',
+                                                unit=unit, price=0)
+        other = BillOfMaterial.objects.create(
+            code='BT-002', customer=base.customer, customer_category=base.customer_category,
+            color_name='Red', product=product
+        )
+
+        manufacture.datetime -= datetime.timedelta(days=3)
+        manufacture.save()
+        manufacture.bill_of_material = other
+        manufacture.save()
+        incremental = self.rollup_rows()
+        self.assertEqual({row[1] for row in incremental[1]}, {product.pk})
+        self.assertEqual({row[0] for row in incremental[1]},
+                         {timezone.localtime(manufacture.datetime).date()})
+        rollups.rebuild()
+        self.assertEqual(self.rollup_rows(), incremental)
+
+
+class SyntheticDataTest(TransactionTestCase):
+    fixtures = ['unit_measurement.json']
+
+    def test_generated_data_is_consistent(self):
+        counts = Generator(seed=1, days=10, batch_size=40).generate(
+            items=60, formulas=12, receipts=150, deliveries=40, manufactures=30, customers=5,
+            suppliers=3
+        )
+        self.assertEqual(counts['items'], InventoryItems.objects.count())
+        self.assertEqual(counts['usages'], ProductUsage.objects.count())
+        self.assertEqual(
+            dict(StockBalance.objects.values_list('item', 'available')),
+            {pk: round(available, 4) for pk, available in
+             InventoryItems.objects.with_availability().values_list('pk', 'available')}
+        )
+        stored = sorted(DailyUsageRollup.objects.values_list('date', 'product', 'item', 'quantity'))
+        rollups.rebuild()
+        self.assertEqual(
+            sorted(DailyUsageRollup.objects.values_list('date', 'product', 'item', 'quantity')),
+            stored
+        )
+
+        results = benchmarks.Benchmark(repeat=1, days=10, sample=5).run([
+            'availability', 'inventory_changelist', 'manufacture_create', 'print_usage_product',
+            'export_productusage_csv'
+        ])
+        self.assertEqual(results['rows']['manufacture'], 30)
+        self.assertEqual(results['cases']['availability']['queries'], 5)
+        self.assertEqual(len(results['cases']), 5)
+        self.assertEqual(Manufacture.objects.count(), 30)
+
+
+class QueryPlanTest(TransactionTestCase):
+    """
+    The filters of the admin, reports and ledger must be answered from an index.
+
+    On PostgreSQL sequential scans are disabled for the check, so a plan only
+    contains one when no index applies at all.
+    """
+    fixtures = ['unit_measurement.json']
+
+    def setUp(self):
+        Generator(seed=2, days=30, batch_size=200).generate(
+            items=100, formulas=20, receipts=500, deliveries=200, manufactures=50, customers=5,
+            suppliers=3
+        )
+        self.since = timezone.now() - datetime.timedelta(days=7)
+
+    def assertIndexed(self, queryset):
+        table = queryset.model._meta.db_table
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan on {}'.format(table), plan)
+        else:
+            self.assertRegex(plan, r'SEARCH (TABLE )?{} USING'.format(table))
+
+    def test_transaction_filters_use_indexes(self):
+        item = StockLevel.objects.values_list('item', flat=True).first()
+        until = timezone.now()
+        self.assertIndexed(StockLevel.objects.filter(item=item, datetime__gte=self.since))
+        self.assertIndexed(StockLevel.objects.filter(datetime__gte=self.since, datetime__lt=until))
+        self.assertIndexed(StockLevel.objects.filter(status='return', datetime__gte=self.since))
+        self.assertIndexed(StockLevel.objects.filter(delivery_note='SYN-DN00000001'))
+        self.assertIndexed(StockMovement.objects.filter(item=item, datetime__gte=self.since))
+        self.assertIndexed(StockMovement.objects.filter(status='sent', datetime__gte=self.since))
+        self.assertIndexed(StockMovement.objects.filter(jo_number='JO-1'))
+        self.assertIndexed(StockMovement.objects.filter(delivery_order='SYN-DO00000001'))
+        self.assertIndexed(InventoryAdjustment.objects.filter(item=item,
+                                                              first_created__gte=self.since))
+
+    def test_manufacture_filters_use_indexes(self):
+        manufacture = ProductUsage.objects.values_list('manufacture', 'item').first()
+        formula = Manufacture.objects.values_list('bill_of_material', flat=True).first()
+        self.assertIndexed(ProductUsage.objects.filter(manufacture=manufacture[0],
+                                                       item=manufacture[1]))
+        self.assertIndexed(Manufacture.objects.filter(bill_of_material=formula, status='done'))
+        self.assertIndexed(Manufacture.objects.filter(datetime__gte=self.since))
+        self.assertIndexed(mrp.open_orders(self.since.date(), timezone.localdate()))
+
+
+class QueryBudgetTest(TransactionTestCase):
+    """
+    Every admin page reads its related rows in a fixed number of queries, so
+    the same budget holds with ``rows`` transactions, inline rows and
+    adjustments as with a hundred times as many.
+    """
+    fixtures = ['unit_measurement.json']
+    rows = 10
+
+    # most queries per page, session, user and content type lookups included
+    CHANGELIST_BUDGETS = {
+        'customer': 6, 'customercategory': 6, 'supplier': 6, 'unitmeasurement': 6,
+        'inventoryitems': 7, 'inventoryadjustment': 6, 'stocklevel': 6, 'stockmovement': 6,
+        'billofmaterial': 9, 'billofmaterialdetails': 6, 'manufacture': 6, 'productusage': 7,
+    }
+    CHANGE_FORM_BUDGETS = {
+        StockLevel: 10, StockMovement: 11, Manufacture: 16, BillOfMaterial: 13, ProductUsage: 15,
+        InventoryItems: 7, BillOfMaterialDetails: 13, InventoryAdjustment: 8,
+    }
+    PRINT_BUDGETS = {
+        'inventoryitems/print/': 7, 'stocklevel/print/': 5, 'stockmovement/print/': 5,
+        'manufacture/{}/print/': 5,
+    }
+
+    def setUp(self):
+        Generator(seed=1, days=30, batch_size=1000).generate(
+            items=20 + self.rows // 10, formulas=5 + self.rows // 10, receipts=self.rows,
+            deliveries=self.rows, manufactures=self.rows, customers=5, suppliers=3
+        )
+        self.manufacture = Manufacture.objects.first()
+        self.formula = self.manufacture.bill_of_material
+        items = list(InventoryItems.objects.order_by('pk'))
+        unit = UnitMeasurement.objects.first()
+        ProductUsage.objects.filter(manufacture=self.manufacture).delete()
+        BillOfMaterialDetails.objects.filter(bill_of_material=self.formula).delete()
+        ProductUsage.objects.bulk_create([
+            ProductUsage(item=items[i % len(items)], manufacture=self.manufacture, quantity=1,
+                         unit=unit) for i in range(self.rows)
+        ])
+        BillOfMaterialDetails.objects.bulk_create([
+            BillOfMaterialDetails(material=items[i % len(items)], bill_of_material=self.formula,
+                                  quantity=1, unit=unit) for i in range(self.rows)
+        ])
+        InventoryAdjustment.objects.bulk_create([
+            InventoryAdjustment(item=items[i % len(items)], quantity=1) for i in range(self.rows)
+        ])
+        self.client = Client()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+
+    def assertBudget(self, url, budget):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/production/' + url)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertLessEqual(len(queries), budget, '{} with {} rows'.format(url, self.rows))
+
+    def test_changelists(self):
+        for model_name, budget in self.CHANGELIST_BUDGETS.items():
+            self.assertBudget(model_name + '/', budget)
+
+    def test_change_forms(self):
+        objects = {Manufacture: self.manufacture, BillOfMaterial: self.formula}
+        for model, budget in self.CHANGE_FORM_BUDGETS.items():
+            pk = objects[model].pk if model in objects else model.objects.values_list(
+                'pk', flat=True
+            ).first()
+            self.assertBudget('{}/{}/change/'.format(model._meta.model_name, pk), budget)
+
+    def test_print_views(self):
+        for url, budget in self.PRINT_BUDGETS.items():
+            self.assertBudget(url.format(self.manufacture.pk), budget)
+
+
+class LargeQueryBudgetTest(QueryBudgetTest):
+    rows = 1000
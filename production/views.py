@@ -1,3 +1,19 @@
-from django.shortcuts import render
+from grappelli.settings import AUTOCOMPLETE_LIMIT
+from grappelli.views.related import AutocompleteLookup as GrappelliAutocompleteLookup, get_label
 
-# Create your views here.
+from production import search
+
+
+class AutocompleteLookup(GrappelliAutocompleteLookup):
+    """
+    Grappelli autocomplete served from ``production.search`` for the models it
+    indexes, ranked best match first.
+    """
+    def get_data(self):
+        if self.model not in search.SEARCH_FIELDS:
+            return super().get_data()
+        queryset = self.get_filtered_queryset(self.model._default_manager.get_queryset())
+        return [
+            {"value": self.get_return_value(obj, obj.pk), "label": get_label(obj)}
+            for obj in search.search(queryset, self.GET['term'], AUTOCOMPLETE_LIMIT)
+        ]